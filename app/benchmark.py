@@ -0,0 +1,271 @@
+"""
+Retrieval benchmark with TVTropes ground truth.
+
+Every query is the description of a trope and its relevant books are the titles that
+list the trope in `lit_goodreads_match`. Each rank profile is run over the same queries
+and the report (recall@k and MRR over books, QPS and latency percentiles) is written
+to a JSON file that can be compared between runs.
+
+    python -m app.benchmark --backend vespa --profiles bm25 dense colbert hybrid
+    python -m app.benchmark --backend local --profiles dense colbert
+    python -m app.benchmark --layout chunk --profiles bm25 dense colbert hybrid
+    python -m app.benchmark --schema document_embeddings_compact --quantizer data/quantizer.json --profiles dense
+"""
+import argparse
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+import orjson
+from adalflow.core.types import Embedding, EmbedderOutput, RetrieverOutput
+
+from app.crud.tvtropes import TropeExamplesCRUD, TropesCRUD
+from app.retriever import PROFILE_EMBEDDING_TYPES as RETRIEVER_EMBEDDING_TYPES
+from app.utils.manifest import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+# the fusion profile queries bm25, dense and colbert
+PROFILE_EMBEDDING_TYPES = {**RETRIEVER_EMBEDDING_TYPES, "fusion": ["dense", "colbert"]}
+
+
+@dataclass
+class BenchmarkQuery:
+    query_id: str
+    text: str
+    relevant: set[str] = field(default_factory=set)
+
+
+def _column(df, *names: str) -> str:
+    for name in names:
+        if name in df.columns:
+            return name
+    raise KeyError(f"None of the columns {names} found")
+
+
+def build_queries(
+    tropes: TropesCRUD,
+    examples: TropeExamplesCRUD,
+    limit: int = 200,
+    title_ids: Optional[set[str]] = None,
+    min_relevant: int = 1,
+    seed: int = 42,
+) -> list[BenchmarkQuery]:
+    """
+    Trope description queries with the titles listing the trope as relevant books.
+    With `title_ids` (the indexed books) only those count as relevant, and tropes without
+    `min_relevant` relevant books are dropped. A fixed seed keeps the query set stable
+    between runs.
+    """
+    df = examples.df.dropna(subset=["trope_id", "title_id"])
+    if title_ids is not None:
+        df = df[df["title_id"].isin(title_ids)]
+    relevant = df.groupby("trope_id")["title_id"].agg(set)
+    relevant = relevant[relevant.map(len) >= min_relevant]
+
+    trope_id_col = _column(tropes.df, "trope_id", "TropeID")
+    description_col = _column(tropes.df, "description", "Description")
+    descriptions = (
+        tropes.df.dropna(subset=[description_col])
+        .drop_duplicates(subset=[trope_id_col])
+        .set_index(trope_id_col)[description_col]
+    )
+    trope_ids = sorted(set(relevant.index) & set(descriptions.index))
+    rng = np.random.default_rng(seed)
+    if len(trope_ids) > limit:
+        trope_ids = sorted(rng.choice(trope_ids, size=limit, replace=False).tolist())
+    return [
+        BenchmarkQuery(query_id=trope_id, text=descriptions[trope_id], relevant=relevant[trope_id])
+        for trope_id in trope_ids
+    ]
+
+
+class PrecomputedEmbedder:
+    """
+    Embeds all benchmark queries once per embedding type and serves them by text,
+    so the measured latency is the retrieval alone.
+    """
+
+    def __init__(self, embedder: Any, queries: list[str], embedding_types: list[str], batch_size: int = 32):
+        self.vectors: dict[str, dict[str, Any]] = {}
+        for embedding_type in embedding_types:
+            vectors = self.vectors.setdefault(embedding_type, {})
+            for i in range(0, len(queries), batch_size):
+                batch = queries[i : i + batch_size]
+                output = embedder(batch, embedding_type=embedding_type)
+                vectors.update(zip(batch, (e.embedding for e in output.data)))
+
+    def __call__(self, input, embedding_type: str = "dense", **kwargs) -> EmbedderOutput:
+        input = input if isinstance(input, list) else [input]
+        return EmbedderOutput(
+            data=[Embedding(self.vectors[embedding_type][text], i) for i, text in enumerate(input)]
+        )
+
+
+def hit_title_id(document) -> Optional[str]:
+    """Book of a retrieved document, from its 'parent_id' (Vespa) or 'book_id' (local)."""
+    meta = document.meta_data or {}
+    return meta.get("parent_id") or meta.get("book_id")
+
+
+def ranked_titles(output: RetrieverOutput) -> list[str]:
+    """Distinct books of the hits in rank order."""
+    titles = (hit_title_id(document) for document in output.documents or [])
+    return list(dict.fromkeys(title for title in titles if title is not None))
+
+
+def evaluate_ranking(ranking: list[str], relevant: set[str], ks: list[int]) -> dict[str, float]:
+    """recall@k for every k and the reciprocal rank of the first relevant book."""
+    metrics = {
+        f"recall@{k}": len(relevant.intersection(ranking[:k])) / len(relevant) for k in ks
+    }
+    first = next((rank for rank, title in enumerate(ranking, 1) if title in relevant), None)
+    metrics["mrr"] = 1.0 / first if first else 0.0
+    return metrics
+
+
+def run_profile(
+    retriever: Any,
+    queries: list[BenchmarkQuery],
+    top_k: int,
+    ks: list[int],
+    embedding_type: Optional[str] = None,
+    warmup: int = 3,
+    clock: Callable[[], float] = time.perf_counter,
+) -> dict:
+    """
+    Runs the queries one by one and aggregates quality and latency.
+    The first `warmup` queries are run once more before timing and not counted twice.
+    """
+    for query in queries[:warmup]:
+        retriever.call(query.text, top_k=top_k, embedding_type=embedding_type)
+
+    latencies, metrics, errors = [], [], 0
+    started = clock()
+    for query in queries:
+        t0 = clock()
+        try:
+            output = retriever.call(query.text, top_k=top_k, embedding_type=embedding_type)[0]
+        except Exception as e:
+            logger.error(f"Query {query.query_id} failed: {e}")
+            errors += 1
+            continue
+        latencies.append(clock() - t0)
+        metrics.append(evaluate_ranking(ranked_titles(output), query.relevant, ks))
+    elapsed = clock() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        name: float(np.mean([m[name] for m in metrics])) if metrics else 0.0
+        for name in [*(f"recall@{k}" for k in ks), "mrr"]
+    }
+    result.update(
+        {
+            "num_queries": len(queries),
+            "errors": errors,
+            "qps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "mean": float(latencies_ms.mean()) if len(latencies_ms) else None,
+                "p50": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else None,
+                "p99": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else None,
+            },
+        }
+    )
+    return result
+
+
+def run_benchmark(
+    make_retriever: Callable[[str], Any],
+    queries: list[BenchmarkQuery],
+    profiles: list[str],
+    top_k: int = 100,
+    ks: list[int] = [10, 100],
+    warmup: int = 3,
+) -> dict:
+    """
+    Runs every profile with the retriever from `make_retriever(profile)`.
+    """
+    results = {}
+    for profile in profiles:
+        logger.info(f"Running {len(queries)} queries with the '{profile}' profile")
+        embedding_types = PROFILE_EMBEDDING_TYPES[profile]
+        results[profile] = run_profile(
+            make_retriever(profile),
+            queries,
+            top_k=top_k,
+            ks=ks,
+            embedding_type=embedding_types[0] if len(embedding_types) == 1 else None,
+            warmup=warmup,
+        )
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "num_queries": len(queries),
+        "top_k": top_k,
+        "profiles": results,
+    }
+
+
+def save_report(report: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write_bytes(path, orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    from app.config import settings
+    from app.crud.embeddings import EmbeddingStore
+    from app.quantization import DenseQuantizer
+    from app.retriever import LocalRetriever, M3Embdder, VespaRetriever
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmark retrieval against TVTropes ground truth")
+    parser.add_argument("--backend", choices=["vespa", "local"], default="vespa")
+    parser.add_argument("--profiles", nargs="+", default=["bm25", "dense", "colbert", "hybrid"])
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("--top_k", type=int, default=100)
+    parser.add_argument("--ks", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--schema", default="document_embeddings", help="Vespa schema to query")
+    parser.add_argument("--layout", choices=["section", "chunk"], default=None, help="Query the schema of this document layout")
+    parser.add_argument("--quantizer", type=Path, default=None, help="Quantizer of the compact schema's int8 vectors")
+    parser.add_argument("--colbert_store", type=Path, default=None, help="Token vector store for the local colbert profile, see create_embeddings --colbert_store")
+    parser.add_argument("--output", type=Path, default=Path("data/benchmarks") / f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    args = parser.parse_args()
+
+    tropes = TropesCRUD.load_from_csv(settings.tvtropes, "tropes")
+    examples = TropeExamplesCRUD.load_from_csv(settings.tvtropes, "lit_goodreads_match")
+    store = None
+    if args.backend == "local":
+        store = EmbeddingStore.open(settings.embeddings.dir)
+        title_ids = set(store.book_ids())
+    else:
+        title_ids = {path.stem for path in settings.books.dir.glob("*.epub")}
+    queries = build_queries(tropes, examples, limit=args.num_queries, title_ids=title_ids)
+
+    embedding_types = sorted({t for p in args.profiles for t in PROFILE_EMBEDDING_TYPES[p]})
+    if args.backend == "local":
+        embedding_types = sorted(set(embedding_types) | {"dense"})
+    embedder = PrecomputedEmbedder(M3Embdder(max_length=2048), [q.text for q in queries], embedding_types)
+
+    quantizer = DenseQuantizer.load(args.quantizer) if args.quantizer else None
+
+    def make_retriever(profile: str):
+        if args.backend == "local":
+            colbert_store = EmbeddingStore.open(args.colbert_store) if args.colbert_store else None
+            return LocalRetriever(store, embedder=embedder, rank_profile=profile, colbert_store=colbert_store)
+        return VespaRetriever(
+            embedder=embedder,
+            vespa_url=settings.vespa_url,
+            vespa_port=settings.vespa_port,
+            schema="*" if args.layout else args.schema,
+            layout=args.layout,
+            rank_profile=profile,
+            quantizer=quantizer,
+        )
+
+    report = run_benchmark(make_retriever, queries, args.profiles, top_k=args.top_k, ks=args.ks)
+    report["backend"] = args.backend
+    save_report(report, args.output)
+    logger.info(f"Saved the benchmark report to {args.output}")
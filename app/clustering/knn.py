@@ -0,0 +1,148 @@
+"""
+Persisted approximate kNN graph over (a sample of) the embedding store.
+
+The graph is built once with NN-descent and saved as CSR arrays together with the
+search index, so UMAP fits with different `n_components` reuse it instead of
+recomputing the neighbours.
+
+    <cache_dir>/<metric>_k<k>_<rows digest>/
+        graph.json         - parameters, written last
+        indptr.npy         - (n + 1,) CSR row pointers
+        indices.npy        - (n * k,) neighbour positions within the graph rows
+        distances.npy      - (n * k,) neighbour distances
+        rows.npy           - (n,) store rows of the graph nodes
+        index.pkl          - pickled NNDescent index, needed by `UMAP.transform`
+"""
+import hashlib
+import json
+import logging
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from app.utils.manifest import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+GRAPH_FILE = "graph.json"
+
+
+@dataclass
+class KnnGraph:
+    """
+    k nearest neighbours of every node, nodes are the store rows in `rows`.
+    """
+
+    rows: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    distances: np.ndarray
+    metric: str
+    index: "pynndescent.NNDescent | None" = None
+
+    @property
+    def n_neighbors(self) -> int:
+        return int(self.indptr[1] - self.indptr[0]) if len(self.indptr) > 1 else 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def neighbors(self, n_neighbors: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Dense (n, n_neighbors) neighbour indices and distances, closest first.
+        The node itself is its first neighbour.
+        """
+        k = self.n_neighbors
+        n_neighbors = n_neighbors or k
+        if n_neighbors > k:
+            raise ValueError(f"The graph has {k} neighbours per node, {n_neighbors} requested")
+        indices = self.indices.reshape(-1, k)[:, :n_neighbors]
+        distances = self.distances.reshape(-1, k)[:, :n_neighbors]
+        return indices, distances
+
+
+def graph_dir(cache_dir: Path, rows: np.ndarray, n_neighbors: int, metric: str) -> Path:
+    """
+    Cache directory of the graph over the given store rows.
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(rows, dtype=np.int64).tobytes()).hexdigest()[:16]
+    return Path(cache_dir) / f"{metric}_k{n_neighbors}_{digest}"
+
+
+def build_knn_graph(
+    data: np.ndarray, rows: np.ndarray, n_neighbors: int = 30, metric: str = "euclidean", seed: int = 42
+) -> KnnGraph:
+    """
+    Builds the kNN graph of `data` (the embeddings of the store `rows`) with NN-descent,
+    using the same settings UMAP uses internally.
+    """
+    from pynndescent import NNDescent
+
+    index = NNDescent(
+        data,
+        n_neighbors=n_neighbors,
+        metric=metric,
+        random_state=seed,
+        n_trees=min(64, 5 + int(round(len(data) ** 0.5 / 20.0))),
+        n_iters=max(5, int(round(np.log2(len(data))))),
+        max_candidates=60,
+        compressed=False,
+    )
+    indices, distances = index.neighbor_graph
+    return KnnGraph(
+        rows=np.asarray(rows, dtype=np.int64),
+        indptr=np.arange(len(data) + 1, dtype=np.int64) * n_neighbors,
+        indices=indices.astype(np.int32).ravel(),
+        distances=distances.astype(np.float32).ravel(),
+        metric=metric,
+        index=index,
+    )
+
+
+def save_knn_graph(graph: KnnGraph, dir: Path):
+    dir.mkdir(parents=True, exist_ok=True)
+    for name in ("rows", "indptr", "indices", "distances"):
+        np.save(dir / f"{name}.npy", getattr(graph, name))
+    if graph.index is not None:
+        atomic_write_bytes(dir / "index.pkl", pickle.dumps(graph.index))
+    info = {"metric": graph.metric, "n_neighbors": graph.n_neighbors, "num_nodes": len(graph)}
+    atomic_write_bytes(dir / GRAPH_FILE, json.dumps(info).encode())
+
+
+def load_knn_graph(dir: Path, mmap: bool = True) -> KnnGraph:
+    """
+    Loads a saved graph, the CSR arrays are memory-mapped unless `mmap` is False.
+    """
+    info = json.loads((dir / GRAPH_FILE).read_text())
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(dir / f"{name}.npy", mmap_mode=mmap_mode)
+        for name in ("rows", "indptr", "indices", "distances")
+    }
+    index = None
+    if (dir / "index.pkl").exists():
+        index = pickle.loads((dir / "index.pkl").read_bytes())
+    return KnnGraph(metric=info["metric"], index=index, **arrays)
+
+
+def cached_knn_graph(
+    cache_dir: Path,
+    data: np.ndarray,
+    rows: np.ndarray,
+    n_neighbors: int = 30,
+    metric: str = "euclidean",
+    seed: int = 42,
+) -> KnnGraph:
+    """
+    Returns the saved graph over `rows` if there is one, building and saving it otherwise.
+    """
+    dir = graph_dir(cache_dir, rows, n_neighbors, metric)
+    if (dir / GRAPH_FILE).exists():
+        logger.info(f"Loading kNN graph from {dir}")
+        return load_knn_graph(dir)
+    logger.info(f"Building kNN graph with {n_neighbors} neighbours over {len(rows)} chunks")
+    graph = build_knn_graph(data, rows, n_neighbors=n_neighbors, metric=metric, seed=seed)
+    save_knn_graph(graph, dir)
+    return graph
@@ -0,0 +1,268 @@
+"""
+Out-of-core clustering of the chunk embeddings in the embedding store.
+
+UMAP and HDBSCAN are fitted on a sample stratified by book. The remaining chunks are
+streamed shard by shard through `UMAP.transform` and `hdbscan.approximate_predict`,
+and the cluster assignments are written next to the store, one file per shard.
+The kNN graph of the sample is cached (see `app.clustering.knn`), so sweeps over the
+UMAP and HDBSCAN parameters do not repeat the neighbour search.
+
+    python -m app.clustering.pipeline --run_name nightly --sample_size 200000
+"""
+import argparse
+import io
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from app.clustering.knn import KnnGraph, cached_knn_graph
+from app.crud.embeddings import EmbeddingStore, ShardedArray
+from app.utils.manifest import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+RUN_FILE = "run.json"
+
+
+@dataclass
+class ClusteringParams:
+    """
+    Parameters of a clustering run.
+    """
+
+    sample_size: int = 200_000
+    n_neighbors: int = 15
+    # neighbours kept in the cached kNN graph, an upper bound for n_neighbors
+    knn_neighbors: int = 30
+    n_components: int = 5
+    metric: str = "euclidean"
+    min_cluster_size: int = 50
+    min_samples: int | None = None
+    batch_size: int = 65536
+    seed: int = 42
+
+
+@dataclass
+class ClusteringRun:
+    """
+    Output of a clustering run, arrays are aligned with the rows of the store.
+    """
+
+    dir: Path
+    params: ClusteringParams
+    sample_rows: np.ndarray
+    labels: ShardedArray
+    probabilities: ShardedArray
+    reduced: np.ndarray
+    n_clusters: int = field(default=0)
+
+
+def stratified_sample(store: EmbeddingStore, sample_size: int, seed: int = 42) -> np.ndarray:
+    """
+    Sorted row indices of a sample with every book represented in proportion to its
+    number of chunks (and by at least one chunk while the sample size allows it).
+    """
+    if sample_size >= len(store):
+        return np.arange(len(store))
+    rng = np.random.default_rng(seed)
+    ranges = np.array([store.book_range(book_id) for book_id in store.book_ids()])
+    starts, sizes = ranges[:, 0], ranges[:, 1] - ranges[:, 0]
+    quotas = np.floor(sizes * sample_size / len(store)).astype(np.int64)
+    # hand out the rows lost to rounding, books without any sampled chunk first
+    missing = sample_size - quotas.sum()
+    order = np.lexsort((rng.random(len(sizes)), quotas > 0))
+    order = order[quotas[order] < sizes[order]][:missing]
+    quotas[order] += 1
+
+    rows = []
+    for start, size, quota in zip(starts, sizes, quotas):
+        if quota:
+            rows.append(start + rng.choice(size, size=quota, replace=False))
+    return np.sort(np.concatenate(rows))
+
+
+def fit_sample(
+    sample: np.ndarray, params: ClusteringParams, knn: KnnGraph | None = None
+) -> tuple["umap.UMAP", "hdbscan.HDBSCAN"]:
+    """
+    Fits UMAP on the sample and HDBSCAN on its reduced embedding.
+    UMAP uses the precomputed kNN graph of the sample when given.
+    HDBSCAN keeps prediction data for `approximate_predict`.
+    """
+    import hdbscan
+    import umap
+
+    precomputed_knn = (None, None, None)
+    if knn is not None:
+        # UMAP only prunes wider graphs for large inputs, so slice it here
+        indices, distances = knn.neighbors(params.n_neighbors)
+        precomputed_knn = (np.ascontiguousarray(indices), np.ascontiguousarray(distances), knn.index)
+    reducer = umap.UMAP(
+        n_neighbors=params.n_neighbors,
+        n_components=params.n_components,
+        metric=params.metric,
+        random_state=params.seed,
+        precomputed_knn=precomputed_knn,
+    )
+    reduced = reducer.fit_transform(sample)
+    clusterer = hdbscan.HDBSCAN(
+        min_cluster_size=params.min_cluster_size,
+        min_samples=params.min_samples,
+        metric="euclidean",
+        prediction_data=True,
+    ).fit(reduced)
+    return reducer, clusterer
+
+
+def _save_npy(path: Path, array: np.ndarray):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    atomic_write_bytes(path, buffer.getvalue())
+
+
+def assign_clusters(
+    store: EmbeddingStore,
+    reducer: "umap.UMAP",
+    clusterer: "hdbscan.HDBSCAN",
+    sample_rows: np.ndarray,
+    out_dir: Path,
+    batch_size: int = 65536,
+) -> np.ndarray:
+    """
+    Streams the store shard by shard, reduces chunks outside the sample with
+    `reducer.transform` and predicts their clusters with `approximate_predict`.
+    Sampled chunks keep the labels from the fit. Writes `<shard>.cluster.npy` and
+    `<shard>.probability.npy` for every shard and returns the reduced embedding
+    as a (num_rows, n_components) array memory-mapped from `reduced.npy`.
+    """
+    import hdbscan
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sample_index = np.full(len(store), -1, dtype=np.int64)
+    sample_index[sample_rows] = np.arange(len(sample_rows))
+
+    reduced = np.lib.format.open_memmap(
+        out_dir / "reduced.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(store), reducer.n_components),
+    )
+    for shard_id, (start, shard) in enumerate(store.embeddings.blocks()):
+        labels = np.empty(len(shard), dtype=np.int32)
+        probabilities = np.empty(len(shard), dtype=np.float32)
+
+        in_sample = sample_index[start : start + len(shard)]
+        sampled = in_sample >= 0
+        labels[sampled] = clusterer.labels_[in_sample[sampled]]
+        probabilities[sampled] = clusterer.probabilities_[in_sample[sampled]]
+        reduced[start : start + len(shard)][sampled] = reducer.embedding_[in_sample[sampled]]
+
+        rest = np.flatnonzero(~sampled)
+        for i in range(0, len(rest), batch_size):
+            rows = rest[i : i + batch_size]
+            batch_reduced = reducer.transform(np.asarray(shard[rows], dtype=np.float32))
+            labels[rows], probabilities[rows] = hdbscan.approximate_predict(clusterer, batch_reduced)
+            reduced[start + rows] = batch_reduced
+
+        _save_npy(out_dir / f"{shard_id:05d}.cluster.npy", labels)
+        _save_npy(out_dir / f"{shard_id:05d}.probability.npy", probabilities)
+        logger.info(f"Assigned clusters for shard {shard_id} ({len(rest)} transformed chunks)")
+
+    reduced.flush()
+    return reduced
+
+
+def load_assignments(store: EmbeddingStore, run_dir: Path) -> tuple[ShardedArray, ShardedArray]:
+    """
+    Cluster labels and membership probabilities of a finished run, aligned with the store rows.
+    """
+    num_rows = json.loads((run_dir / RUN_FILE).read_text())["num_rows"]
+    arrays = []
+    for name in ("cluster", "probability"):
+        shards = [
+            np.load(run_dir / f"{shard_id:05d}.{name}.npy", mmap_mode="r")
+            for shard_id in range(-(-num_rows // store.shard_size))
+        ]
+        arrays.append(ShardedArray(shards, num_rows, store.shard_size))
+    return arrays[0], arrays[1]
+
+
+def cluster_store(
+    store: EmbeddingStore, params: ClusteringParams, run_dir: Path, knn_cache_dir: Path | None = None
+) -> ClusteringRun:
+    """
+    Runs the whole pipeline: sample, fit, stream assignments and record the run.
+    With `knn_cache_dir` the kNN graph of the sample is loaded from (or saved to) the cache.
+    The run file is written last, a run directory without it is incomplete.
+    """
+    sample_rows = stratified_sample(store, params.sample_size, seed=params.seed)
+    sample = np.asarray(store.embeddings[sample_rows], dtype=np.float32)
+    knn = None
+    if knn_cache_dir is not None:
+        knn = cached_knn_graph(
+            knn_cache_dir,
+            sample,
+            sample_rows,
+            n_neighbors=max(params.knn_neighbors, params.n_neighbors),
+            metric=params.metric,
+            seed=params.seed,
+        )
+    logger.info(f"Fitting UMAP and HDBSCAN on {len(sample_rows)} of {len(store)} chunks")
+    reducer, clusterer = fit_sample(sample, params, knn=knn)
+    n_clusters = int(clusterer.labels_.max()) + 1
+    logger.info(f"Found {n_clusters} clusters using HDBSCAN")
+
+    reduced = assign_clusters(
+        store, reducer, clusterer, sample_rows, run_dir, batch_size=params.batch_size
+    )
+    np.save(run_dir / "sample_rows.npy", sample_rows)
+    run_info = {
+        "params": asdict(params),
+        "num_rows": len(store),
+        "sample_size": len(sample_rows),
+        "n_clusters": n_clusters,
+    }
+    atomic_write_bytes(run_dir / RUN_FILE, json.dumps(run_info).encode())
+
+    labels, probabilities = load_assignments(store, run_dir)
+    return ClusteringRun(
+        dir=run_dir,
+        params=params,
+        sample_rows=sample_rows,
+        labels=labels,
+        probabilities=probabilities,
+        reduced=reduced,
+        n_clusters=n_clusters,
+    )
+
+
+if __name__ == "__main__":
+    from app.config import settings
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Cluster all chunk embeddings in the embedding store")
+    parser.add_argument("--run_name", type=str, default="latest", help="Name of the run directory")
+    parser.add_argument("--sample_size", type=int, default=ClusteringParams.sample_size)
+    parser.add_argument("--n_neighbors", type=int, default=ClusteringParams.n_neighbors)
+    parser.add_argument("--n_components", type=int, default=ClusteringParams.n_components)
+    parser.add_argument("--knn_neighbors", type=int, default=ClusteringParams.knn_neighbors)
+    parser.add_argument("--no_knn_cache", action="store_true", help="Do not use the cached kNN graph")
+    parser.add_argument("--min_cluster_size", type=int, default=ClusteringParams.min_cluster_size)
+    parser.add_argument("--batch_size", type=int, default=ClusteringParams.batch_size)
+    args = parser.parse_args()
+
+    store = EmbeddingStore.open(settings.embeddings.dir)
+    params = ClusteringParams(
+        sample_size=args.sample_size,
+        n_neighbors=args.n_neighbors,
+        n_components=args.n_components,
+        knn_neighbors=args.knn_neighbors,
+        min_cluster_size=args.min_cluster_size,
+        batch_size=args.batch_size,
+    )
+    knn_cache_dir = None if args.no_knn_cache else store.dir / "knn"
+    run = cluster_store(store, params, store.dir / "clusters" / args.run_name, knn_cache_dir=knn_cache_dir)
+    logger.info(f"Saved {run.n_clusters} clusters for {len(store)} chunks to {run.dir}")
@@ -0,0 +1,83 @@
+"""
+Cluster statistics over the chunk metadata of a clustering run.
+
+All statistics come from a few groupby passes over categorical columns, so a
+report over thousands of clusters takes about as long as reading the metadata.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class ClusterReport:
+    """
+    clusters:           one row per cluster with 'num_chunks', 'num_books', 'top_trope',
+                        'purity' (share of the top trope) and 'entropy' (of the trope
+                        distribution, in nats)
+    trope_distribution: tidy frame of (cluster, trope, count, share)
+    chunks_per_book:    tidy frame of (cluster, book_id, num_chunks)
+    """
+
+    clusters: pd.DataFrame
+    trope_distribution: pd.DataFrame
+    chunks_per_book: pd.DataFrame
+
+    def soft_labels(self, cluster) -> pd.Series:
+        """Trope shares of one cluster, largest first."""
+        labels = self.trope_distribution[self.trope_distribution["cluster"] == cluster]
+        return labels.set_index("trope")["share"].sort_values(ascending=False)
+
+
+def _as_category(column: pd.Series) -> pd.Series:
+    return column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype("category")
+
+
+def cluster_report(
+    metadata: pd.DataFrame,
+    cluster_column: str = "cluster",
+    trope_column: str = "trope",
+    book_column: str = "book_id",
+) -> ClusterReport:
+    """
+    Computes the report from chunk metadata with one row per chunk.
+    """
+    df = pd.DataFrame(
+        {
+            "cluster": metadata[cluster_column].to_numpy(),
+            "trope": _as_category(metadata[trope_column]),
+            "book_id": _as_category(metadata[book_column]),
+        }
+    )
+
+    trope_distribution = (
+        df.groupby(["cluster", "trope"], observed=True).size().rename("count").reset_index()
+    )
+    cluster_sizes = trope_distribution.groupby("cluster")["count"].transform("sum")
+    trope_distribution["share"] = trope_distribution["count"] / cluster_sizes
+    trope_distribution = trope_distribution.sort_values(
+        ["cluster", "count"], ascending=[True, False], kind="stable", ignore_index=True
+    )
+
+    chunks_per_book = (
+        df.groupby(["cluster", "book_id"], observed=True).size().rename("num_chunks").reset_index()
+    )
+
+    # after the sort, the first trope of every cluster is its top trope
+    top = trope_distribution.drop_duplicates("cluster").set_index("cluster")
+    share = trope_distribution["share"].to_numpy()
+    entropy = pd.Series(-share * np.log(share)).groupby(trope_distribution["cluster"].to_numpy()).sum()
+    clusters = pd.DataFrame(
+        {
+            "num_chunks": df.groupby("cluster").size(),
+            "num_books": chunks_per_book.groupby("cluster").size(),
+            "top_trope": top["trope"],
+            "purity": top["share"],
+            "entropy": entropy,
+        }
+    )
+    clusters.index.name = "cluster"
+    return ClusterReport(
+        clusters=clusters, trope_distribution=trope_distribution, chunks_per_book=chunks_per_book
+    )
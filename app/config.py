@@ -90,6 +90,19 @@ class BooksConfig(BaseModel):
         return self
     
 
+class EmbeddingsConfig(BaseModel):
+    """
+    Configuration for the sharded chunk embedding store.
+    """
+    dir: Path = Field(default=Path("./data/books/embeddings"))
+    dim: int = Field(default=1024, description="Embedding dimension")
+    shard_size: int = Field(default=65536, description="Rows per shard")
+    dtype: str = Field(default="float16", description="Dtype of stored embeddings")
+
+    def finalize(self) -> "EmbeddingsConfig":
+        return self
+
+
 class BookCompanionConfig(BaseModel):
     """
     Configuration for the BookCompanion dataset.
@@ -99,6 +112,30 @@ class BookCompanionConfig(BaseModel):
     def finalize(self) -> "BookCompanionConfig":
         return self
 
+class ScraperConfig(BaseModel):
+    """
+    Configuration of the shared HTTP client the libgen scraper searches and downloads with.
+    """
+    proxy: Optional[str] = Field(default=None, description="Proxy of every request")
+    http2: bool = Field(default=True)
+    concurrency: int = Field(default=8, description="Requests in flight at once")
+    per_host: int = Field(default=4, description="Requests in flight at once per host")
+    mirror_race: int = Field(default=3, description="Mirror links of a title downloaded at once, first valid wins")
+    rate: float = Field(default=4.0, description="Requests started per second, 0 for no limit")
+    burst: int = Field(default=4, description="Requests that may start at once after idling")
+    workers: int = Field(default=16, description="Titles processed at once")
+    queue_size: int = Field(default=64, description="Titles queued ahead of the workers")
+    timeout: float = Field(default=10.0, description="Connect, read, write and pool timeout in seconds")
+    max_connections: int = Field(default=16)
+    max_keepalive_connections: int = Field(default=8)
+    keepalive_expiry: float = Field(default=30.0)
+
+    def finalize(self) -> "ScraperConfig":
+        if self.max_connections < self.concurrency:
+            object.__setattr__(self, "max_connections", self.concurrency)
+        return self
+
+
 class VespaConfig(BaseModel):
     """
     Configuration for connecting to a Vespa instance.
@@ -140,8 +177,10 @@ class AppSettings(BaseSettings):
     # Sub-configs
     tvtropes: TVTropesConfig = TVTropesConfig()
     books: BooksConfig = BooksConfig()
+    embeddings: EmbeddingsConfig = EmbeddingsConfig()
     vespa: VespaConfig = VespaConfig()
     bookcompanion: BookCompanionConfig = BookCompanionConfig()
+    scraper: ScraperConfig = ScraperConfig()
 
     def post_init(self) -> "AppSettings":
         """
@@ -161,6 +200,11 @@ class AppSettings(BaseSettings):
         }).finalize()
 
 
+        new_embeddings = self.embeddings.model_copy(update={
+            "dir": self.data_folder / "books" / "embeddings",
+        }).finalize()
+
+
         new_vespa = self.vespa.model_copy(update={
             "url": self.vespa_url,
             "port": self.vespa_port,
@@ -173,10 +217,16 @@ class AppSettings(BaseSettings):
             "dir": self.data_folder / "bookcompanion",
         }).finalize()
 
+        new_scraper = self.scraper.model_copy(update={
+            "proxy": self.proxy or self.scraper.proxy,
+        }).finalize()
+
         object.__setattr__(self, "tvtropes", new_tvt)
         object.__setattr__(self, "books", new_books)
+        object.__setattr__(self, "embeddings", new_embeddings)
         object.__setattr__(self, "vespa", new_vespa)
         object.__setattr__(self, "bookcompanion", new_bookcompanion)
+        object.__setattr__(self, "scraper", new_scraper)
 
         return self
     
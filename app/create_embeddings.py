@@ -0,0 +1,360 @@
+"""
+Batch job embedding the chunks of downloaded books into the sharded embedding store.
+
+Books are parsed and chunked on worker processes while the main process encodes.
+Chunks of many books are pooled into token-budgeted encoder batches and every
+finished book is appended to the store on a background writer thread. With
+--colbert_store the ColBERT token vectors of every chunk are appended to a second
+store, one row per token, for the colbert profile of app.retriever.LocalRetriever.
+
+    python -m app.create_embeddings --books_csv notebooks/books_downloaded.csv
+    python -m app.create_embeddings --colbert_store data/books/colbert
+"""
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Iterator, TypeVar
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.crud.embeddings import EmbeddingStore
+from app.utils.document_processing import chunk_text_with_overlap, epub_to_text
+from app.utils.manifest import Manifest, atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "BAAI/bge-m3"
+# longest input of the model, in tokens
+MODEL_MAX_LENGTH = 8192
+# metadata of the token vector store, the chunk of every token row
+COLBERT_COLUMNS = {"chunk_index": "int32"}
+
+T = TypeVar("T")
+
+
+@dataclass
+class PreparedBook:
+    """Output of the parse and chunk stage for one book."""
+    book_id: str
+    chunks: list[str] = field(default_factory=list)
+    metadata: list[dict] = field(default_factory=list)
+    skip_reason: str | None = None
+
+
+@dataclass
+class PendingBook:
+    """A book whose chunks are (partly) waiting for the encoder."""
+    book: PreparedBook
+    vectors: list[np.ndarray | None]
+    remaining: int
+    # (num_tokens, dim) ColBERT vectors of every chunk, None unless they are stored
+    colbert: list[np.ndarray | None] | None = None
+
+
+def token_budget_batches(
+    items: Iterable[tuple[T, int]], token_budget: int, pool_size: int = 4096
+) -> Iterator[list[T]]:
+    """
+    Groups a stream of (item, num_tokens) pairs into batches whose padded size
+    (batch length * longest item) stays within token_budget.
+
+    Up to pool_size items are buffered and sorted by length, so a batch holds items of
+    similar length and little compute is spent on padding. An item longer than the
+    budget forms a batch of its own.
+    """
+    pool: list[tuple[T, int]] = []
+
+    def drain(pool: list[tuple[T, int]]) -> Iterator[list[T]]:
+        batch: list[T] = []
+        longest = 0
+        for item, num_tokens in sorted(pool, key=lambda x: x[1]):
+            if batch and max(longest, num_tokens) * (len(batch) + 1) > token_budget:
+                yield batch
+                batch, longest = [], 0
+            batch.append(item)
+            longest = max(longest, num_tokens)
+        if batch:
+            yield batch
+
+    for item in items:
+        pool.append(item)
+        if len(pool) >= pool_size:
+            yield from drain(pool)
+            pool = []
+    yield from drain(pool)
+
+
+_tokenizer = None
+
+
+def _init_worker(model_name: str):
+    global _tokenizer
+    from transformers import AutoTokenizer
+
+    logging.basicConfig(level=logging.INFO)
+    _tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+
+def prepare_book(
+    book_id: str, books_dir: Path, max_tokens: int, overlap_tokens: int
+) -> PreparedBook:
+    """
+    Parse and chunk stage, runs on a worker process.
+    Extracts the text of the book's EPUB, saves it as `<book_id>.txt` next to it and
+    splits it into sentence aligned chunks.
+    """
+    text = epub_to_text(books_dir / f"{book_id}.epub")
+    if not text.strip():
+        return PreparedBook(book_id=book_id, skip_reason="no text")
+
+    # Written atomically so an interrupted run never leaves a truncated text file.
+    atomic_write_bytes(books_dir / f"{book_id}.txt", text.encode("utf-8"))
+
+    chunks, metadata = chunk_text_with_overlap(
+        text, _tokenizer, max_tokens=max_tokens, overlap_tokens=overlap_tokens
+    )
+    if not chunks:
+        return PreparedBook(book_id=book_id, skip_reason="no chunks")
+    return PreparedBook(book_id=book_id, chunks=chunks, metadata=metadata)
+
+
+def prepared_books(
+    executor: ProcessPoolExecutor, book_ids: list[str], prefetch: int, **kwargs
+) -> Iterator[PreparedBook]:
+    """
+    Runs `prepare_book` for all books on the executor, keeping at most `prefetch` books
+    in flight so parsing runs ahead of encoding without holding every book in memory.
+    Books are yielded in completion order.
+    """
+    todo = deque(book_ids)
+    in_flight: set[Future] = set()
+    while todo or in_flight:
+        while todo and len(in_flight) < prefetch:
+            in_flight.add(executor.submit(prepare_book, todo.popleft(), **kwargs))
+        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f"Error preparing a book: {e}")
+
+
+def write_book(store: EmbeddingStore, pending: PendingBook, colbert_store: EmbeddingStore | None = None):
+    """
+    Writer stage, appends the embeddings and metadata of a finished book to the store and
+    its token vectors, in chunk order, to `colbert_store`. A book already in one of the
+    stores (an earlier run without `colbert_store`) is only appended to the other.
+    """
+    book = pending.book
+    if colbert_store is not None and book.book_id not in colbert_store:
+        colbert_store.append(
+            book.book_id,
+            np.concatenate(pending.colbert),
+            {"chunk_index": np.repeat(np.arange(len(pending.colbert)), [len(v) for v in pending.colbert])},
+        )
+    if book.book_id not in store:
+        metadata = pd.DataFrame(book.metadata)
+        store.append(
+            book.book_id,
+            np.stack(pending.vectors),
+            {name: metadata[name].to_numpy() for name in store.columns if name in metadata},
+        )
+    logger.info(f"Saved book {book.book_id}: {len(book.chunks)} chunks.")
+
+
+def encode_batch(
+    model: "BGEM3FlagModel", pending: dict[str, PendingBook], batch: list[tuple[str, int]], colbert: bool = False
+) -> list[str]:
+    """
+    Encodes a batch of (book_id, chunk_index) into the pending books and returns the ids
+    of the books that are complete, with `colbert` their token vectors as well. The batch
+    is not truncated below its longest chunk, a single long sentence can make a chunk
+    longer than max_tokens.
+
+    If the encoder fails, the books of the batch are dropped from `pending` (their
+    later chunks are ignored) and the other books carry on.
+    """
+    batch = [(book_id, i) for book_id, i in batch if book_id in pending]
+    if not batch:
+        return []
+    texts = [pending[book_id].book.chunks[i] for book_id, i in batch]
+    longest = max(pending[book_id].book.metadata[i]["num_tokens"] for book_id, i in batch)
+    try:
+        output = model.encode(
+            texts,
+            batch_size=len(texts),
+            max_length=min(longest + 2, MODEL_MAX_LENGTH),
+            return_dense=True,
+            return_colbert_vecs=colbert,
+        )
+    except Exception as e:
+        failed = sorted({book_id for book_id, _ in batch})
+        logger.error(f"Error encoding books {failed}, skipping them: {e}")
+        for book_id in failed:
+            pending.pop(book_id)
+        return []
+
+    finished = []
+    for k, ((book_id, i), vector) in enumerate(zip(batch, output["dense_vecs"])):
+        book = pending[book_id]
+        book.vectors[i] = vector
+        if colbert:
+            book.colbert[i] = output["colbert_vecs"][k]
+        book.remaining -= 1
+        if book.remaining == 0:
+            finished.append(book_id)
+    return finished
+
+
+def embed_books(
+    model: "BGEM3FlagModel",
+    store: EmbeddingStore,
+    skipped_books: Manifest,
+    book_ids: list[str],
+    books_dir: Path,
+    max_tokens: int = 512,
+    overlap_tokens: int = 64,
+    token_budget: int = 32768,
+    workers: int = 4,
+    prefetch: int = 16,
+    colbert_store: EmbeddingStore | None = None,
+):
+    """
+    Embeds all chunks of the given books into the store, and their token vectors into
+    `colbert_store` if given.
+
+    Parse/chunk (worker processes), encode (this process) and write (background thread)
+    run concurrently. Books already in the stores or in `skipped_books` must be filtered
+    out by the caller.
+    """
+    pending: dict[str, PendingBook] = {}
+    writes: list[Future] = []
+
+    def chunk_stream(books: Iterator[PreparedBook]) -> Iterator[tuple[tuple[str, int], int]]:
+        for book in books:
+            if book.skip_reason is not None:
+                logger.info(f"Skipping {book.book_id}: {book.skip_reason}")
+                skipped_books.record(book.book_id, reason=book.skip_reason)
+                continue
+            pending[book.book_id] = PendingBook(
+                book=book,
+                vectors=[None] * len(book.chunks),
+                remaining=len(book.chunks),
+                colbert=[None] * len(book.chunks) if colbert_store is not None else None,
+            )
+            for meta in book.metadata:
+                yield (book.book_id, meta["chunk_index"]), meta["num_tokens"]
+
+    with (
+        ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(MODEL_NAME,)
+        ) as executor,
+        ThreadPoolExecutor(max_workers=1) as writer,
+    ):
+        books = prepared_books(
+            executor,
+            book_ids,
+            prefetch=prefetch,
+            books_dir=books_dir,
+            max_tokens=max_tokens,
+            overlap_tokens=overlap_tokens,
+        )
+        # small pool so books leave the encoder soon after their chunks are parsed
+        for batch in token_budget_batches(
+            chunk_stream(books), token_budget=token_budget, pool_size=4 * token_budget // max_tokens
+        ):
+            for book_id in encode_batch(model, pending, batch, colbert=colbert_store is not None):
+                writes.append(writer.submit(write_book, store, pending.pop(book_id), colbert_store))
+
+        for future in writes:
+            future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed book chunks into the embedding store")
+    parser.add_argument(
+        "--books_csv",
+        type=Path,
+        default=Path("notebooks/books_downloaded.csv"),
+        help="CSV with a 'title_id' column of books to embed. If missing, all .txt files in the books dir are used.",
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Max number of books to embed")
+    parser.add_argument("--max_tokens", type=int, default=512, help="Max tokens per chunk")
+    parser.add_argument("--overlap_tokens", type=int, default=64, help="Tokens shared by consecutive chunks")
+    parser.add_argument("--token_budget", type=int, default=32768, help="Max padded tokens per encoder batch")
+    parser.add_argument("--workers", type=int, default=4, help="Number of parse/chunk worker processes")
+    parser.add_argument("--prefetch", type=int, default=16, help="Max number of books parsed ahead of the encoder")
+    parser.add_argument(
+        "--colbert_store",
+        type=Path,
+        default=None,
+        help="Also store the ColBERT token vectors of every chunk in this directory (LocalRetriever's colbert profile)",
+    )
+    args = parser.parse_args()
+
+    books_dir = settings.books.dir
+    if args.books_csv.exists():
+        book_ids = pd.read_csv(args.books_csv)["title_id"].tolist()
+    else:
+        book_ids = [f.stem for f in books_dir.iterdir() if f.is_file() and f.suffix == ".txt"]
+    logger.info(f"Found {len(book_ids)} books.")
+
+    store = EmbeddingStore.open(
+        settings.embeddings.dir,
+        dim=settings.embeddings.dim,
+        shard_size=settings.embeddings.shard_size,
+        dtype=settings.embeddings.dtype,
+    )
+    colbert_store = None
+    if args.colbert_store is not None:
+        colbert_store = EmbeddingStore.open(
+            args.colbert_store,
+            dim=settings.embeddings.dim,
+            shard_size=settings.embeddings.shard_size,
+            dtype=settings.embeddings.dtype,
+            columns=COLBERT_COLUMNS,
+        )
+    # Books that were processed but produced no embeddings (no text, no chunks), loaded once.
+    # Embedded books are recorded in the store's own manifest.
+    skipped_books = Manifest.load(settings.embeddings.dir / "skipped_books.json")
+
+    todo = [
+        book_id
+        for book_id in book_ids
+        if (book_id not in store or (colbert_store is not None and book_id not in colbert_store))
+        and book_id not in skipped_books
+        and (books_dir / f"{book_id}.epub").exists()
+    ][: args.limit]
+    logger.info(f"{len(todo)} books left to embed.")
+
+    import nltk
+    from FlagEmbedding import BGEM3FlagModel
+
+    nltk.download("punkt")
+    model = BGEM3FlagModel(MODEL_NAME, use_fp16=True)
+    with store, colbert_store or nullcontext():
+        embed_books(
+            model,
+            store,
+            skipped_books,
+            todo,
+            books_dir,
+            max_tokens=args.max_tokens,
+            overlap_tokens=args.overlap_tokens,
+            token_budget=args.token_budget,
+            workers=args.workers,
+            prefetch=args.prefetch,
+            colbert_store=colbert_store,
+        )
+    logger.info(f"Done. The embedding store in '{store.dir}' has {len(store)} chunks.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -2,6 +2,48 @@ from app.config import BooksConfig
 from app.models.documents import Document
 from app.utils.document_processing import epub_to_documents, word_chunk
 from dataclasses import dataclass
+from pathlib import Path
+import logging
+import mmap
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def read_chunk_texts(rows: pd.DataFrame, books_dir: Path) -> list[str | None]:
+    """
+    Texts of the chunks in `rows` (chunk metadata with 'book_id' and offset columns),
+    in the order of the rows. Every book's `<book_id>.txt` is memory-mapped once and
+    the chunks are sliced by their 'start_byte'/'end_byte' offsets. Rows without byte
+    offsets (chunked before they were recorded) fall back to 'start_index'/'end_index'
+    on the decoded text. Chunks of missing books are None.
+    """
+    texts: list[str | None] = [None] * len(rows)
+    has_bytes = {"start_byte", "end_byte"} <= set(rows.columns)
+    starts = rows["start_byte" if has_bytes else "start_index"].to_numpy()
+    ends = rows["end_byte" if has_bytes else "end_index"].to_numpy()
+    char_starts, char_ends = rows["start_index"].to_numpy(), rows["end_index"].to_numpy()
+
+    for book_id, positions in rows.groupby("book_id", sort=False, observed=True).indices.items():
+        text_file = books_dir / f"{book_id}.txt"
+        if not text_file.exists():
+            logger.warning(f"Text file {text_file} not found, skipping {len(positions)} chunks.")
+            continue
+        if text_file.stat().st_size == 0:
+            for i in positions:
+                texts[i] = ""
+            continue
+        with open(text_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            full_text = None
+            for i in positions:
+                if has_bytes and ends[i] > starts[i]:
+                    texts[i] = data[starts[i] : ends[i]].decode("utf-8")
+                else:
+                    if full_text is None:
+                        full_text = data[:].decode("utf-8")
+                    texts[i] = full_text[char_starts[i] : char_ends[i]]
+    return texts
 
 
 @dataclass
@@ -20,6 +62,9 @@ class DocumentsCRUD:
     ):
         return [epub.stem for epub in self.get_epub_paths(limit, offset, exclude_ids)]
 
+    def get_chunk_texts(self, rows: pd.DataFrame) -> list[str | None]:
+        return read_chunk_texts(rows, self.config.dir)
+
     def get_documents_from_epub(self, document_id) -> list[Document]:
         epub_path = self.config.dir / f"{document_id}.epub"
         extracted_text = epub_to_documents(epub_path)
@@ -0,0 +1,381 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Mapping
+
+import numpy as np
+import pandas as pd
+from numpy.typing import ArrayLike, NDArray
+
+from app.utils.manifest import append_journal, atomic_write_bytes, read_journal
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+JOURNAL_FILE = "manifest.json.journal"
+BOOK_COLUMN = "book"
+
+# metadata columns written by create_embeddings for every chunk
+DEFAULT_COLUMNS = {
+    "chunk_index": "int32",
+    "start_index": "int64",
+    "end_index": "int64",
+    "start_byte": "int64",
+    "end_byte": "int64",
+}
+
+
+class ShardedArray:
+    """
+    Read-only row-wise concatenation of equally sized shards.
+
+    Indexing a range that lies inside one shard returns a view of the memory-mapped
+    shard, only ranges spanning several shards and fancy indexing copy data.
+    """
+
+    def __init__(self, shards: list[np.ndarray], num_rows: int, shard_size: int):
+        self.shards = shards
+        self.num_rows = num_rows
+        self.shard_size = shard_size
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return (self.num_rows, *self.shards[0].shape[1:]) if self.shards else (0,)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.shards[0].dtype if self.shards else np.dtype("float16")
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = self[0 : self.num_rows]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.num_rows
+            if not 0 <= key < self.num_rows:
+                raise IndexError(f"Row {key} out of range for {self.num_rows} rows")
+            return self.shards[key // self.shard_size][key % self.shard_size]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.num_rows)
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            return self._range(start, stop)
+        return self._take(np.asarray(key))
+
+    def _range(self, start: int, stop: int) -> np.ndarray:
+        if stop <= start:
+            return self.shards[0][0:0] if self.shards else np.empty((0,))
+        first, last = start // self.shard_size, (stop - 1) // self.shard_size
+        if first == last:
+            offset = first * self.shard_size
+            return self.shards[first][start - offset : stop - offset]
+        return np.concatenate([block for _, block in self.blocks(start=start, stop=stop)])
+
+    def _take(self, rows: np.ndarray) -> np.ndarray:
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = np.where(rows < 0, rows + self.num_rows, rows)
+        if rows.size and (rows.min() < 0 or rows.max() >= self.num_rows):
+            raise IndexError(f"Rows out of range for {self.num_rows} rows")
+        out = np.empty((len(rows), *self.shape[1:]), dtype=self.dtype)
+        shard_ids = rows // self.shard_size
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self.shards[shard_id][rows[mask] % self.shard_size]
+        return out
+
+    def blocks(
+        self, block_size: int | None = None, start: int = 0, stop: int | None = None
+    ) -> Iterator[tuple[int, np.ndarray]]:
+        """
+        Yields (first_row, view) pairs covering rows [start, stop) without copying.
+        Blocks never cross a shard boundary and have at most block_size rows.
+        """
+        stop = self.num_rows if stop is None else min(stop, self.num_rows)
+        block_size = block_size or self.shard_size
+        row = start
+        while row < stop:
+            shard_id, offset = divmod(row, self.shard_size)
+            end = min(stop, (shard_id + 1) * self.shard_size, row + block_size)
+            yield row, self.shards[shard_id][offset : offset + end - row]
+            row = end
+
+
+@dataclass
+class EmbeddingStore:
+    """
+    Append-only store of chunk embeddings in fixed-size memory-mapped shards.
+
+    Layout of `dir`:
+        manifest.json              - dim, dtype, shard size, row count and book row ranges
+        manifest.json.journal      - row ranges of the books appended since the last close
+        00000.embeddings.npy       - (shard_size, dim) embeddings of the first shard
+        00000.<column>.npy         - (shard_size,) metadata column of the first shard
+        ...
+
+    Rows of a book are contiguous, so a book maps to one (start, end) row range.
+    Metadata is columnar, the book of every row is stored as an index into the
+    manifest's book list. An append journals only the row range of its book, `close`
+    (or leaving the store's `with` block) compacts the journal into the manifest.
+    """
+
+    dir: Path
+    dim: int = 1024
+    shard_size: int = 65536
+    dtype: str = "float16"
+    columns: dict[str, str] = field(default_factory=lambda: dict(DEFAULT_COLUMNS))
+    num_rows: int = 0
+    books: dict[str, tuple[int, int]] = field(default_factory=dict)
+    _book_ids: list[str] = field(default_factory=list, repr=False)
+    _shards: dict[tuple[int, str], np.ndarray] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def open(
+        cls,
+        dir: Path | str,
+        dim: int = 1024,
+        shard_size: int = 65536,
+        dtype: str = "float16",
+        columns: Mapping[str, str] | None = None,
+    ) -> "EmbeddingStore":
+        """
+        Opens the store in `dir`, creating an empty one with the given layout if there is none.
+        The layout of an existing store is read from its manifest.
+        """
+        dir = Path(dir)
+        manifest_path = dir / MANIFEST_FILE
+        if not manifest_path.exists():
+            dir.mkdir(parents=True, exist_ok=True)
+            store = cls(
+                dir=dir,
+                dim=dim,
+                shard_size=shard_size,
+                dtype=dtype,
+                columns=dict(DEFAULT_COLUMNS if columns is None else columns),
+            )
+            store._write_manifest()
+            return store
+
+        manifest = json.loads(manifest_path.read_text())
+        store = cls(
+            dir=dir,
+            dim=manifest["dim"],
+            shard_size=manifest["shard_size"],
+            dtype=manifest["dtype"],
+            columns=manifest["columns"],
+            num_rows=manifest["num_rows"],
+        )
+        for book_id, start, end in manifest["books"]:
+            store._add_book(book_id, start, end)
+        if store.journal_path.exists():
+            for entry in read_journal(store.journal_path):
+                store._add_book(entry["book_id"], entry["start"], entry["end"])
+            store.close()
+        return store
+
+    def __enter__(self) -> "EmbeddingStore":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Compacts the journal of appended books into the manifest."""
+        self._write_manifest()
+        self.journal_path.unlink(missing_ok=True)
+
+    @property
+    def journal_path(self) -> Path:
+        return self.dir / JOURNAL_FILE
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __contains__(self, book_id: str) -> bool:
+        return book_id in self.books
+
+    @property
+    def num_shards(self) -> int:
+        return -(-self.num_rows // self.shard_size)
+
+    def book_ids(self) -> list[str]:
+        """Book ids in the order they were appended."""
+        return list(self._book_ids)
+
+    def book_range(self, book_id: str) -> tuple[int, int]:
+        """(start, end) row range of a book."""
+        return self.books[book_id]
+
+    def append(
+        self,
+        book_id: str,
+        embeddings: ArrayLike,
+        metadata: Mapping[str, ArrayLike] | None = None,
+    ) -> tuple[int, int]:
+        """
+        Appends all chunk embeddings of a book and returns their (start, end) row range.
+        Metadata columns missing from `metadata` are filled with zeros.
+        """
+        if book_id in self.books:
+            raise ValueError(f"Book {book_id} is already in the store")
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(
+                f"Expected embeddings of shape (n, {self.dim}), got {embeddings.shape}"
+            )
+        metadata = metadata or {}
+        unknown = set(metadata) - set(self.columns)
+        if unknown:
+            raise ValueError(f"Unknown metadata columns: {sorted(unknown)}")
+
+        start, end = self.num_rows, self.num_rows + len(embeddings)
+        values = {name: np.asarray(metadata[name]) for name in metadata}
+        values[BOOK_COLUMN] = np.full(len(embeddings), len(self._book_ids))
+        for row, stop in self._shard_ranges(start, end):
+            shard_id, offset = divmod(row, self.shard_size)
+            length = stop - row
+            src = slice(row - start, stop - start)
+            self._shard(shard_id, "embeddings", writable=True)[offset : offset + length] = embeddings[src]
+            for name in self._column_dtypes():
+                column = self._shard(shard_id, name, writable=True)
+                column[offset : offset + length] = values[name][src] if name in values else 0
+        self._flush()
+
+        # shards are flushed before the book is journaled, rows past num_rows of an
+        # interrupted append are ignored on open and overwritten by the next append
+        self._add_book(book_id, start, end)
+        append_journal(self.journal_path, {"book_id": book_id, "start": start, "end": end})
+        return start, end
+
+    @property
+    def embeddings(self) -> ShardedArray:
+        """All embeddings as one virtual (num_rows, dim) array over the memory-mapped shards."""
+        return self.column("embeddings")
+
+    def column(self, name: str) -> ShardedArray:
+        """A metadata column (or "embeddings") as one virtual array over all shards."""
+        shards = [self._shard(shard_id, name) for shard_id in range(self.num_shards)]
+        return ShardedArray(shards, self.num_rows, self.shard_size)
+
+    def get_book(self, book_id: str) -> tuple[NDArray, dict[str, NDArray]]:
+        """Embeddings and metadata columns of one book."""
+        start, end = self.books[book_id]
+        metadata = {name: self.column(name)[start:end] for name in self.columns}
+        return self.embeddings[start:end], metadata
+
+    def metadata(
+        self, columns: list[str] | None = None, rows: ArrayLike | None = None
+    ) -> pd.DataFrame:
+        """
+        Metadata of all rows (or of `rows`, in their order) as a DataFrame with a
+        categorical `book_id` column.
+        """
+        columns = list(self.columns) if columns is None else columns
+
+        def read(name: str) -> NDArray:
+            column = self.column(name)
+            return np.asarray(column) if rows is None else column[np.asarray(rows, dtype=np.int64)]
+
+        codes = read(BOOK_COLUMN).astype(np.int32, copy=False)
+        df = pd.DataFrame({name: read(name) for name in columns})
+        df.insert(0, "book_id", pd.Categorical.from_codes(codes, categories=self._book_ids))
+        return df
+
+    def _add_book(self, book_id: str, start: int, end: int):
+        self.books[book_id] = (start, end)
+        self._book_ids.append(book_id)
+        self.num_rows = max(self.num_rows, end)
+
+    def _column_dtypes(self) -> dict[str, str]:
+        return {BOOK_COLUMN: "int32", **self.columns}
+
+    def _shard_path(self, shard_id: int, name: str) -> Path:
+        return self.dir / f"{shard_id:05d}.{name}.npy"
+
+    def _shard_ranges(self, start: int, end: int) -> Iterator[tuple[int, int]]:
+        row = start
+        while row < end:
+            stop = min(end, (row // self.shard_size + 1) * self.shard_size)
+            yield row, stop
+            row = stop
+
+    def _shard(self, shard_id: int, name: str, writable: bool = False) -> np.ndarray:
+        key = (shard_id, name)
+        shard = self._shards.get(key)
+        if shard is not None and (not writable or shard.flags.writeable):
+            return shard
+        path = self._shard_path(shard_id, name)
+        if name == "embeddings":
+            shape, dtype = (self.shard_size, self.dim), self.dtype
+        else:
+            shape, dtype = (self.shard_size,), self._column_dtypes()[name]
+        if not path.exists():
+            shard = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        else:
+            shard = np.load(path, mmap_mode="r+" if writable else "r")
+        self._shards[key] = shard
+        return shard
+
+    def _flush(self):
+        for shard in self._shards.values():
+            if shard.flags.writeable:
+                shard.flush()
+
+    def _write_manifest(self):
+        manifest = {
+            "dim": self.dim,
+            "shard_size": self.shard_size,
+            "dtype": self.dtype,
+            "columns": self.columns,
+            "num_rows": self.num_rows,
+            "books": [[book_id, *self.books[book_id]] for book_id in self._book_ids],
+        }
+        atomic_write_bytes(self.dir / MANIFEST_FILE, json.dumps(manifest).encode())
+
+
+def import_book_files(store: EmbeddingStore, files_dir: Path) -> int:
+    """
+    Imports per-book `<book>_embeddings.npy` / `<book>_metadata.csv` pairs written by the
+    previous version of create_embeddings. Books already in the store are skipped.
+    Returns the number of imported books.
+    """
+    imported = 0
+    for embeddings_file in sorted(files_dir.glob("*_embeddings.npy")):
+        book_id = embeddings_file.stem.split("_")[0]
+        metadata_file = files_dir / f"{book_id}_metadata.csv"
+        if book_id in store or not metadata_file.exists():
+            continue
+        meta_df = pd.read_csv(metadata_file)
+        metadata = {name: meta_df[name].to_numpy() for name in store.columns if name in meta_df}
+        store.append(book_id, np.load(embeddings_file), metadata)
+        imported += 1
+    return imported
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description="Import per-book embedding files into the embedding store")
+    parser.add_argument(
+        "--files_dir",
+        type=Path,
+        default=settings.embeddings.dir,
+        help="Directory with <book>_embeddings.npy and <book>_metadata.csv files",
+    )
+    args = parser.parse_args()
+
+    with EmbeddingStore.open(
+        settings.embeddings.dir,
+        dim=settings.embeddings.dim,
+        shard_size=settings.embeddings.shard_size,
+        dtype=settings.embeddings.dtype,
+    ) as store:
+        imported = import_book_files(store, args.files_dir)
+    logger.info(f"Imported {imported} books, store has {len(store)} rows in {store.num_shards} shards")
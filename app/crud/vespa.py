@@ -1,14 +1,38 @@
 import logging
+import threading
 from dataclasses import dataclass, asdict, field
-from typing import List, Callable, Dict, Tuple, Generator
+from typing import List, Callable, Dict, Tuple, Generator, Optional, Literal
+import numpy as np
 from vespa.application import Vespa, VespaResponse
 from app.models.tvtropes import TropeExample
 from app.models.embeddings import Embedding
 from app.models.documents import Document
+from app.quantization import DenseQuantizer
 from utils.string import camel_to_string
 
 logger = logging.getLogger(__name__)
 
+_write_generation = 0
+_write_generation_lock = threading.Lock()
+
+
+def write_generation() -> int:
+    """
+    Number of feed operations run by the CRUDs in this process.
+    Query results cached at an older generation may be stale.
+    """
+    return _write_generation
+
+
+def bump_write_generation() -> int:
+    """
+    Marks all cached query results as stale, called after every feed operation.
+    """
+    global _write_generation
+    with _write_generation_lock:
+        _write_generation += 1
+        return _write_generation
+
 
 @dataclass
 class ConcurrencyParams:
@@ -49,6 +73,7 @@ class BaseVespaCRUD:
         docs: List[Dict],
         operation_type: str = "feed",
         auto_assign: bool = True,
+        schema: Optional[str] = None,
         **kwargs,
     ):
         """
@@ -56,26 +81,33 @@ class BaseVespaCRUD:
         - docs must be a list of dicts, each with "id" and "fields".
         - operation_type is one of "feed", "update", or "delete".
         - auto_assign indicates if we do partial updates automatically or not.
+        - schema overrides schema_name, for CRUDs that feed more than one schema.
 
         We pass down feedParams as **asdict(self.feed_params).
+        The write generation is bumped afterwards (also if feeding fails halfway),
+        which invalidates the query results cached by VespaRetriever.
         """
         all_params = asdict(self.feed_params)
         all_params.update(kwargs)
-        self.app.feed_iterable(
-            iter=docs,
-            schema=self.schema_name,
-            namespace=self.namespace,
-            operation_type=operation_type,
-            callback=self.feed_callback,
-            auto_assign=auto_assign,
-            **all_params,
-        )
+        try:
+            self.app.feed_iterable(
+                iter=docs,
+                schema=schema or self.schema_name,
+                namespace=self.namespace,
+                operation_type=operation_type,
+                callback=self.feed_callback,
+                auto_assign=auto_assign,
+                **all_params,
+            )
+        finally:
+            bump_write_generation()
 
     def visit_all(
         self,
         selection: str = "true",
         slices: int = 1,
         wanted_document_count: int = 100,
+        schema: Optional[str] = None,
         **kwargs,
     ):
         """
@@ -89,7 +121,7 @@ class BaseVespaCRUD:
         """
         return self.app.visit(
             content_cluster_name=self.content_cluster_name,
-            schema=self.schema_name,
+            schema=schema or self.schema_name,
             namespace=self.namespace,
             selection=selection,
             slices=slices,
@@ -247,6 +279,126 @@ class VespaDocumentsCRUD(BaseVespaCRUD):
                         yield Document.model_validate(doc["fields"])
 
 
+@dataclass
+class VespaBinaryDocumentsCRUD(VespaDocumentsCRUD):
+    """
+    Operations specific to the 'document_embeddings_binary' schema,
+    the ColBERT token vectors are fed binarized (see binarize).
+    """
+
+    schema_name: str = "document_embeddings_binary"
+
+    def update_embeddings(self, embeddings: List[Embedding], **kwargs):
+        update_docs = prepare_partial_update_doc_embeddings(embeddings, binary_colbert=True)
+        self.feed_iterable(
+            update_docs, operation_type="update", auto_assign=False, **kwargs
+        )
+
+
+@dataclass
+class VespaCompactDocumentsCRUD(VespaDocumentsCRUD):
+    """
+    Operations specific to the 'document_embeddings_compact' schema,
+    the dense vectors are fed with their int8 codes from the calibrated quantizer.
+    """
+
+    schema_name: str = "document_embeddings_compact"
+    quantizer: Optional[DenseQuantizer] = None
+
+    def update_embeddings(self, embeddings: List[Embedding], **kwargs):
+        if self.quantizer is None:
+            raise ValueError("The compact schema needs a quantizer, see app/quantization.py")
+        update_docs = prepare_partial_update_compact_doc_embeddings(embeddings, self.quantizer)
+        self.feed_iterable(
+            update_docs, operation_type="update", auto_assign=False, **kwargs
+        )
+
+
+@dataclass
+class VespaChunkDocumentsCRUD(VespaDocumentsCRUD):
+    """
+    Operations for the per chunk layout: the sections are fed to the global 'documents'
+    schema and every chunk is a document of 'chunk_embeddings' referencing its section,
+    with the id "<document_id>_<chunk_index>" (see chunk_document_id).
+    """
+
+    schema_name: str = "chunk_embeddings"
+    parent_schema_name: str = "documents"
+
+    def feed(self, docs: List[Document], **kwargs):
+        """
+        Feed the sections first, a chunk's reference must point to an existing section.
+        """
+        self.feed_iterable(
+            [prepare_document(d) for d in docs], operation_type="feed", schema=self.parent_schema_name, **kwargs
+        )
+        chunk_docs = [chunk for d in docs for chunk in prepare_chunk_documents(d, self.namespace, self.parent_schema_name)]
+        self.feed_iterable(chunk_docs, operation_type="feed", **kwargs)
+
+    def update_embeddings(self, embeddings: List[Embedding], **kwargs):
+        """
+        Partial update assigning the tensors of every embedded chunk.
+        auto_assign=False keeps the 'assign' operations from being wrapped again.
+        """
+        update_docs = prepare_partial_update_chunk_embeddings(embeddings)
+        self.feed_iterable(update_docs, operation_type="update", auto_assign=False, **kwargs)
+
+    def get_all_parent_ids(self) -> List[str]:
+        parent_ids = set()
+        for slice_res in self.visit_all(
+            selection="true", slices=4, wanted_document_count=500, schema=self.parent_schema_name
+        ):
+            for vespa_response in slice_res:
+                if vespa_response.is_successful():
+                    for doc in vespa_response.documents:
+                        if "fields" in doc and "parent_id" in doc["fields"]:
+                            parent_ids.add(doc["fields"]["parent_id"])
+                else:
+                    logger.warning(f"Visit response unsuccessful: {vespa_response.get_json()}")
+        return list(parent_ids)
+
+    def yield_without_embeddings(self) -> Generator[Document, None, None]:
+        """
+        Sections with at least one chunk without embeddings. The whole section is
+        yielded, so the embedder sees every chunk with its index.
+        """
+        selection = f"{self.schema_name}.model == null"
+        seen = set()
+        for slice_res in self.visit_all(selection=selection, slices=1, wanted_document_count=100):
+            for vespa_response in slice_res:
+                if not vespa_response.is_successful():
+                    continue
+                for doc in vespa_response.documents:
+                    document_id = doc["fields"]["document_id"]
+                    if document_id in seen:
+                        continue
+                    seen.add(document_id)
+                    response = self.app.get_data(
+                        schema=self.parent_schema_name, data_id=document_id, namespace=self.namespace
+                    )
+                    if response.is_successful():
+                        yield Document.model_validate(response.get_json()["fields"])
+
+
+# CRUD of the document embeddings per layout, see app/vespa.py
+DOCUMENT_LAYOUTS: Dict[str, type[VespaDocumentsCRUD]] = {
+    "section": VespaDocumentsCRUD,
+    "chunk": VespaChunkDocumentsCRUD,
+}
+
+
+def documents_crud(layout: Literal["section", "chunk"] = "section", **kwargs) -> VespaDocumentsCRUD:
+    return DOCUMENT_LAYOUTS[layout](**kwargs)
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Sign bits of the last axis packed 8 per int8 (big-endian bit order, as unpack_bits in Vespa
+    expects), so (tokens, 1024) float vectors become (tokens, 128) int8.
+    """
+    return np.packbits(np.asarray(vectors) > 0, axis=-1).view(np.int8)
+
+
 def prepare_tvtrope_example(trope_example: TropeExample) -> dict:
     return {
         "id": f"{trope_example.title_id}_{trope_example.trope_id}",
@@ -278,7 +430,27 @@ def prepare_document(doc: Document) -> dict:
     }
 
 
-def prepare_partial_update_doc_embeddings(embeddings: list[Embedding]) -> list[dict]:
+def _colbert_blocks(e: Embedding, binary: bool) -> list[dict]:
+    colbert = binarize(e.colbert) if binary else e.colbert
+    return [
+        {
+            "address": {
+                "chunk": e.document_chunk_index,
+                "token": i,
+            },
+            "values": values,
+        }
+        for i, values in enumerate(colbert.tolist())
+    ]
+
+
+def prepare_partial_update_doc_embeddings(
+    embeddings: list[Embedding], binary_colbert: bool = False
+) -> list[dict]:
+    """
+    Adds the chunk of every embedding to dense_rep and colbert_rep,
+    with `binary_colbert` the token vectors are binarized.
+    """
     return [
         {
             "id": e.document_id,
@@ -300,22 +472,85 @@ def prepare_partial_update_doc_embeddings(embeddings: list[Embedding]) -> list[d
                     },
                 },
                 "colbert_rep": {
+                    "add": {
+                        "blocks": _colbert_blocks(e, binary_colbert),
+                    },
+                },
+            },
+        }
+        for e in embeddings
+    ]
+
+
+def chunk_document_id(document_id: str, chunk_index: int) -> str:
+    return f"{document_id}_{chunk_index}"
+
+
+def prepare_chunk_documents(doc: Document, namespace: str, parent_schema: str = "documents") -> list[dict]:
+    return [
+        {
+            "id": chunk_document_id(doc.document_id, i),
+            "fields": {
+                "document_ref": f"id:{namespace}:{parent_schema}::{doc.document_id}",
+                "document_id": doc.document_id,
+                "chunk_index": i,
+                "chunk": chunk,
+            },
+        }
+        for i, chunk in enumerate(doc.chunks)
+    ]
+
+
+def prepare_partial_update_chunk_embeddings(embeddings: list[Embedding]) -> list[dict]:
+    updates = []
+    for e in embeddings:
+        fields = {"model": {"assign": e.model}, "version": {"assign": e.version}}
+        if e.dense is not None:
+            fields["dense_rep"] = {"assign": e.dense.tolist()}
+        if e.colbert is not None:
+            fields["colbert_rep"] = {
+                "assign": {
+                    "blocks": [
+                        {"address": {"token": i}, "values": values}
+                        for i, values in enumerate(e.colbert.tolist())
+                    ],
+                }
+            }
+        updates.append({"id": chunk_document_id(e.document_id, e.document_chunk_index), "fields": fields})
+    return updates
+
+
+def prepare_partial_update_compact_doc_embeddings(
+    embeddings: list[Embedding], quantizer: DenseQuantizer
+) -> list[dict]:
+    """
+    Adds the chunk of every embedding to dense_rep and its int8 codes to dense_rep_int8,
+    the compact schema has no ColBERT vectors.
+    """
+    codes = quantizer.quantize(np.stack([e.dense for e in embeddings])) if embeddings else []
+    return [
+        {
+            "id": e.document_id,
+            "fields": {
+                "model": {"assign": e.model},
+                "version": {"assign": e.version},
+                "dense_rep": {
                     "add": {
                         "blocks": [
-                            {
-                                "address": {
-                                    "chunk": e.document_chunk_index,
-                                    "token": i,
-                                },
-                                "values": e.colbert[i].tolist(),
-                            }
-                            for i in range(e.colbert.shape[0])
+                            {"address": {"chunk": e.document_chunk_index}, "values": e.dense.tolist()},
+                        ],
+                    },
+                },
+                "dense_rep_int8": {
+                    "add": {
+                        "blocks": [
+                            {"address": {"chunk": e.document_chunk_index}, "values": code.tolist()},
                         ],
                     },
                 },
             },
         }
-        for e in embeddings
+        for e, code in zip(embeddings, codes)
     ]
 
 
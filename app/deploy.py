@@ -0,0 +1,62 @@
+"""
+Writes the Vespa application package to disk and deploys it.
+
+    python -m app.deploy --output data/vespa/application --no_deploy
+    python -m app.deploy --hnsw_max_links_per_node 32 --paged_colbert --variants compact
+"""
+import argparse
+import logging
+from pathlib import Path
+
+from app.vespa import APPLICATION_NAME, SCHEMA_VARIANTS, SchemaParams, write_application_package
+
+logger = logging.getLogger(__name__)
+
+
+def deploy_docker(root: Path):
+    """Deploys the package written to `root` to a local Vespa container."""
+    from vespa.deployment import VespaDocker
+
+    vespa_docker = VespaDocker()
+    return vespa_docker.deploy_from_disk(application_name=APPLICATION_NAME, application_root=root)
+
+
+if __name__ == "__main__":
+    from app.config import settings
+
+    logging.basicConfig(level=logging.INFO)
+    defaults = SchemaParams()
+    parser = argparse.ArgumentParser(description="Write the Vespa application package and deploy it")
+    parser.add_argument("--output", type=Path, default=settings.data_folder / "vespa" / "application")
+    parser.add_argument("--no_deploy", action="store_true", help="Only write the package")
+    parser.add_argument("--hnsw_max_links_per_node", type=int, default=defaults.hnsw_max_links_per_node)
+    parser.add_argument(
+        "--hnsw_neighbors_to_explore_at_insert", type=int, default=defaults.hnsw_neighbors_to_explore_at_insert
+    )
+    parser.add_argument("--paged_colbert", action="store_true", help="Keep the ColBERT vectors on disk")
+    parser.add_argument(
+        "--in_memory_full_precision",
+        action="store_true",
+        help="Keep the vectors the schema variants rescore with in memory",
+    )
+    parser.add_argument("--rerank_count", type=int, default=defaults.rerank_count)
+    parser.add_argument("--best_chunks", type=int, default=defaults.best_chunks)
+    parser.add_argument("--compact_dense_dims", type=int, default=defaults.compact_dense_dims)
+    parser.add_argument("--variants", nargs="*", choices=SCHEMA_VARIANTS, default=list(defaults.variants))
+    args = parser.parse_args()
+
+    params = SchemaParams(
+        hnsw_max_links_per_node=args.hnsw_max_links_per_node,
+        hnsw_neighbors_to_explore_at_insert=args.hnsw_neighbors_to_explore_at_insert,
+        paged_colbert=args.paged_colbert,
+        paged_full_precision=not args.in_memory_full_precision,
+        rerank_count=args.rerank_count,
+        best_chunks=args.best_chunks,
+        compact_dense_dims=args.compact_dense_dims,
+        variants=tuple(args.variants),
+    )
+    write_application_package(args.output, params)
+    logger.info(f"Wrote the application package with {params} to {args.output}")
+    if not args.no_deploy:
+        deploy_docker(args.output)
+        logger.info(f"Deployed {APPLICATION_NAME}")
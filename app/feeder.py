@@ -3,15 +3,19 @@ from app.models.documents import Document
 from app.crud.tvtropes import TropeExamplesCRUD
 from app.crud.documents import DocumentsCRUD
 from app.config import settings  
-from app.crud.vespa import VespaDocumentsCRUD, VespaTropesCRUD
+from app.crud.vespa import DOCUMENT_LAYOUTS, VespaTropesCRUD, documents_crud
 from vespa.application import Vespa
 from typing import Sequence
 import time
 
 import argparse
 from itertools import islice
+from functools import partial
 import logging
 from app.models.embeddings import Embedding
+from utils.chunking import late_chunking, pack_chunks_to_windows
+import numpy as np
+import torch
 
 
 basic_config = logging.basicConfig(level=logging.INFO)
@@ -99,6 +103,92 @@ def bgem3_embed_documents_with_chunks(
     return out
 
 
+def bgem3_late_chunk_embed_documents(
+    model: "BGEM3FlagModel",
+    data: Sequence[Document],
+    return_colbert=False,
+    return_dense=True,
+    return_lexical=False,
+    max_length: int = 8192,
+    overlap: int = 0,
+    batch_size: int = 1,
+) -> list[Embedding]:
+    """
+    Late-chunking variant of `bgem3_embed_documents_with_chunks`.
+
+    Consecutive chunks of a document are packed into windows of up to `max_length` tokens,
+    BGE-M3 runs once per window and every chunk is pooled from the token outputs of its span.
+    Dense vectors are the normalized mean of the chunk's token states, ColBERT vectors are the
+    normalized token vectors of the span. `overlap` is the number of words consecutive chunks
+    share (see `word_chunk`), these tokens are encoded only once per window.
+    """
+    if return_lexical:
+        raise ValueError("Lexical weights are not supported with late chunking.")
+
+    tokenizer = model.tokenizer
+    encoder = model.model
+    device = next(encoder.parameters()).device
+
+    windows = []
+    for document in data:
+        tokenized = tokenizer(
+            document.chunks, add_special_tokens=False, return_offsets_mapping=True
+        )
+        overlap_lengths = []
+        for chunk_index, (chunk, offsets) in enumerate(
+            zip(document.chunks, tokenized["offset_mapping"])
+        ):
+            if chunk_index == 0 or overlap == 0:
+                overlap_lengths.append(0)
+                continue
+            overlap_chars = len(" ".join(chunk.split(" ")[:overlap]))
+            overlap_lengths.append(sum(1 for start, _ in offsets if start < overlap_chars))
+
+        for window in pack_chunks_to_windows(
+            tokenized["input_ids"], overlap_lengths, max_length=max_length - 2
+        ):
+            windows.append((document.document_id, window))
+
+    out = []
+    for i in range(0, len(windows), batch_size):
+        batch = windows[i : i + batch_size]
+        input_ids = [
+            [tokenizer.cls_token_id] + window["input_ids"] + [tokenizer.sep_token_id]
+            for _, window in batch
+        ]
+        batch_data = tokenizer.pad(
+            {"input_ids": input_ids}, padding=True, return_tensors="pt"
+        ).to(device)
+        # +1 for [CLS] token offset in model outputs
+        spans = [[(start + 1, end + 1) for start, end in window["spans"]] for _, window in batch]
+
+        with torch.no_grad():
+            last_hidden_state = encoder.model(**batch_data, return_dict=True).last_hidden_state
+            dense = late_chunking((last_hidden_state,), spans) if return_dense else None
+            if return_colbert:
+                colbert = torch.nn.functional.normalize(
+                    encoder.colbert_linear(last_hidden_state), dim=-1
+                ).cpu().numpy()
+
+        for b, (document_id, window) in enumerate(batch):
+            if return_dense:
+                dense_vecs = dense[b] / np.linalg.norm(dense[b], axis=-1, keepdims=True)
+            for j, (chunk_index, (start, end)) in enumerate(
+                zip(window["chunk_indices"], spans[b])
+            ):
+                out.append(
+                    Embedding(
+                        model="BAAI/bge-m3",
+                        document_id=document_id,
+                        document_chunk_index=chunk_index,
+                        colbert=colbert[b, start:end] if return_colbert else None,
+                        dense=dense_vecs[j] if return_dense else None,
+                        lexical=None,
+                    )
+                )
+    return out
+
+
 if __name__ == "__main__":
     argparse = argparse.ArgumentParser()
     argparse.add_argument(
@@ -142,6 +232,28 @@ if __name__ == "__main__":
         help="Whether to encode text data in vespa",
     )
 
+    argparse.add_argument(
+        "--late_chunking",
+        action="store_true",
+        default=False,
+        help="Embed document chunks with late chunking over long context windows",
+    )
+
+    argparse.add_argument(
+        "--max_length",
+        type=int,
+        default=8192,
+        help="Max number of tokens per window when late chunking",
+    )
+
+    argparse.add_argument(
+        "--layout",
+        type=str,
+        choices=list(DOCUMENT_LAYOUTS),
+        default="section",
+        help="Document layout, one document per section with chunk tensors or one document per chunk",
+    )
+
     argparse.add_argument(
         "--title_ids_file",
         type=str,
@@ -172,8 +284,16 @@ if __name__ == "__main__":
     elif args.schema == "documents":
         data_crud = DocumentsCRUD(config=settings.books)
         tropes_crud = TropeExamplesCRUD.load_from_csv(config=settings.tvtropes, name="lit_goodreads_match")
-        vespa_crud = VespaDocumentsCRUD(app=vespa, namespace=settings.vespa.namespace, content_cluster_name=settings.vespa.content_cluster)
+        vespa_crud = documents_crud(
+            args.layout, app=vespa, namespace=settings.vespa.namespace, content_cluster_name=settings.vespa.content_cluster
+        )
         embedder = bgem3_embed_documents_with_chunks
+        if args.late_chunking:
+            embedder = partial(
+                bgem3_late_chunk_embed_documents,
+                max_length=args.max_length,
+                overlap=settings.books.overlap,
+            )
 
     if args.mode == "embed":
         from FlagEmbedding import BGEM3FlagModel
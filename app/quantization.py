@@ -0,0 +1,91 @@
+"""
+Compact int8 dense vectors for the HNSW index of the "document_embeddings_compact" schema.
+
+Vectors are (optionally) truncated to their first `dims` dimensions and scaled by a
+single factor into int8. The factor is calibrated on a sample of the corpus so that
+the `percentile` of the absolute values maps to 127 and only outliers are clipped.
+One factor for all dimensions keeps the codes proportional to the vectors, so the
+angular distance between codes approximates the one between the vectors.
+
+    python -m app.quantization --dims 512 --output data/quantizer.json
+"""
+import argparse
+import json
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.crud.embeddings import EmbeddingStore
+from app.utils.manifest import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DenseQuantizer:
+    """
+    dims:  number of leading dimensions kept
+    scale: value of one int8 step, vectors are divided by it and clipped to [-127, 127]
+    """
+
+    dims: int
+    scale: float
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dims: Optional[int] = None, percentile: float = 99.9) -> "DenseQuantizer":
+        """Calibrates the scale on (a sample of) the vectors."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dims = dims or vectors.shape[-1]
+        clip = float(np.percentile(np.abs(vectors[..., :dims]), percentile))
+        return cls(dims=dims, scale=clip / 127 if clip > 0 else 1.0)
+
+    def quantize(self, vectors: np.ndarray) -> np.ndarray:
+        """(..., dim) vectors to (..., dims) int8 codes."""
+        vectors = np.asarray(vectors, dtype=np.float32)[..., : self.dims]
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def dequantize(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32) * self.scale
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(path, json.dumps(asdict(self)).encode())
+
+    @classmethod
+    def load(cls, path: Path) -> "DenseQuantizer":
+        return cls(**json.loads(Path(path).read_text()))
+
+
+def calibrate(
+    store: EmbeddingStore,
+    sample_size: int = 100_000,
+    dims: Optional[int] = None,
+    percentile: float = 99.9,
+    seed: int = 42,
+) -> DenseQuantizer:
+    """
+    Fits a quantizer on a uniform sample of the chunk embeddings in the store.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(store), size=min(sample_size, len(store)), replace=False))
+    return DenseQuantizer.fit(store.embeddings[rows], dims=dims, percentile=percentile)
+
+
+if __name__ == "__main__":
+    from app.config import settings
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Calibrate the int8 quantizer of the compact dense vectors")
+    parser.add_argument("--sample_size", type=int, default=100_000)
+    parser.add_argument("--dims", type=int, default=None, help="Keep only the leading dimensions")
+    parser.add_argument("--percentile", type=float, default=99.9)
+    parser.add_argument("--output", type=Path, default=Path("data/quantizer.json"))
+    args = parser.parse_args()
+
+    store = EmbeddingStore.open(settings.embeddings.dir)
+    quantizer = calibrate(store, sample_size=args.sample_size, dims=args.dims, percentile=args.percentile)
+    quantizer.save(args.output)
+    logger.info(f"Saved {quantizer} to {args.output}")
@@ -1,8 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
+import hashlib
 import logging
-from typing import List, Literal, Optional, Any, Union
+import re
+import time
+from pathlib import Path
+from typing import Iterator, List, Literal, Optional, Any, Union
 
 import numpy as np
+import orjson
 
 from vespa.application import Vespa
 from vespa.io import VespaQueryResponse
@@ -21,8 +28,53 @@ from adalflow.core.types import (
     ModelType,
 )
 
+from app.crud.documents import read_chunk_texts
+from app.crud.embeddings import BOOK_COLUMN, EmbeddingStore, ShardedArray
+from app.crud.vespa import binarize, write_generation
+from app.quantization import DenseQuantizer
+from app.utils.cache import QueryCache
+
 log = logging.getLogger(__name__)
 
+# query embeddings each rank profile needs
+PROFILE_EMBEDDING_TYPES = {
+    "bm25": [],
+    "dense": ["dense"],
+    "colbert": ["colbert"],
+    "hybrid": ["dense", "colbert"],
+}
+
+# profile to fall back to when a query would miss its latency budget
+FALLBACK_PROFILES = {"hybrid": "dense", "colbert": "bm25", "dense": "bm25"}
+# seconds the HTTP client waits beyond the Vespa timeout, for Vespa's own timeout response
+HTTP_TIMEOUT_GRACE = 0.05
+
+# schema of the document embeddings in each layout, see app/vespa.py
+LAYOUT_SCHEMAS = {"section": "document_embeddings", "chunk": "chunk_embeddings"}
+
+
+@dataclass
+class BudgetedRetrieverOutput(RetrieverOutput):
+    """
+    RetrieverOutput with the rank profile that served it and the seconds left of the
+    query's latency budget (None without a budget).
+    """
+
+    served_profile: Optional[str] = None
+    budget_left: Optional[float] = None
+
+
+@dataclass
+class _Page:
+    """Window of a paginated result list: hits from `offset` of the best `depth`."""
+
+    offset: int
+    depth: int
+
+
+def _offset(page: Optional[_Page]) -> Optional[int]:
+    return page.offset if page is not None and page.offset else None
+
 
 class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
     """
@@ -42,6 +94,21 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         vespa_port: int = 8080,
         schema: str = "*",
         rank_profile: str = "dense",
+        cache: Optional[QueryCache] = None,
+        group_by_book: bool = False,
+        sections_per_book: int = 3,
+        summary: Optional[str] = None,
+        binary_colbert: bool = False,
+        quantizer: Optional[DenseQuantizer] = None,
+        layout: Optional[Literal["section", "chunk"]] = None,
+        fusion_profiles: List[str] = ("bm25", "dense", "colbert"),
+        fusion: Literal["rrf", "weighted"] = "rrf",
+        fusion_weights: Optional[dict[str, float]] = None,
+        fusion_depth: Optional[int] = None,
+        fusion_timeout: Optional[float] = None,
+        rrf_k: int = 60,
+        budget: Optional[float] = None,
+        fallback_share: float = 0.3,
     ):
         """
         Args:
@@ -50,7 +117,40 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
             vespa_url (str, optional): URL of your Vespa endpoint.
             vespa_port (int, optional): Port of your Vespa endpoint.
             schema (str, optional): Vespa schema name to query.
-            rank_profile (str, optional): "bm25", "dense" or "colbert"
+            rank_profile (str, optional): "bm25", "dense", "colbert", "hybrid" or "fusion" (client
+                side fusion of a query per profile in `fusion_profiles`)
+            cache (QueryCache, optional): Cache of successful responses keyed by the normalized
+                request. Share one cache between retrievers to dedupe across them. Cached
+                responses are dropped once a CRUD feeds documents in this process.
+            group_by_book (bool, optional): Group the hits on parent_id in Vespa, top_k is then the
+                number of books, each with its best `sections_per_book` sections.
+            sections_per_book (int, optional): Sections returned per book when grouping.
+            summary (str, optional): Document summary of the hits (see app/vespa.py): "best" (lean
+                and the best scoring chunks of the rank profile, the matching chunks with bm25),
+                "lean" (ids, title, authors), "text" (lean and all chunks) or "tensors" (lean and
+                the embeddings). "default" or None (the default) returns all summary fields.
+                Only the document and embedding schemas define these summaries, set one with a
+                schema that has it rather than "*".
+            binary_colbert (bool, optional): The schema stores binarized ColBERT vectors
+                ("document_embeddings_binary"), colbert queries also send the binarized query.
+            quantizer (DenseQuantizer, optional): Quantizer of the int8 dense vectors of the
+                "document_embeddings_compact" schema, dense queries then search its HNSW index
+                with the quantized query and rescore with the full precision one.
+            layout (str, optional): Document layout to query unless a schema is given, "section"
+                (document_embeddings) or "chunk" (chunk_embeddings, one document per chunk).
+            fusion_profiles (list, optional): Rank profiles queried concurrently by "fusion".
+            fusion (str, optional): "rrf" (reciprocal rank fusion) or "weighted" (weighted sum of
+                the min-max normalized scores of every profile).
+            fusion_weights (dict, optional): Weight of every fusion profile, 1 by default.
+            fusion_depth (int, optional): Hits fetched per fusion profile, at least top_k.
+            fusion_timeout (float, optional): Latency budget in seconds, the profiles that did not
+                answer by then are left out of the fusion. None waits for all.
+            rrf_k (int, optional): Rank constant of reciprocal rank fusion.
+            budget (float, optional): Latency budget per query in seconds, passed to Vespa as
+                the query timeout. A profile that fails or would miss the budget falls back along
+                FALLBACK_PROFILES (hybrid -> dense -> bm25). None waits as long as Vespa does.
+            fallback_share (float, optional): Share of the remaining budget kept for the
+                fallbacks while a profile that has one runs.
         """
         super().__init__()
         self.embedder = embedder
@@ -58,7 +158,28 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         self.vespa_url = vespa_url
         self.vespa_port = vespa_port
         self.rank_profile = rank_profile
-        self.schema = schema
+        self.schema = LAYOUT_SCHEMAS[layout] if layout is not None and schema == "*" else schema
+        self.cache = cache
+        self.group_by_book = group_by_book
+        self.sections_per_book = sections_per_book
+        self.summary = summary
+        self.binary_colbert = binary_colbert
+        self.quantizer = quantizer
+        self.fusion_profiles = list(fusion_profiles)
+        self.fusion = fusion
+        self.fusion_weights = fusion_weights
+        self.fusion_depth = fusion_depth
+        self.fusion_timeout = fusion_timeout
+        self.rrf_k = rrf_k
+        self.budget = budget
+        self.fallback_share = fallback_share
+        self._executor = None
+        if rank_profile.lower() == "fusion":
+            if group_by_book:
+                raise ValueError("Grouping by book is not supported with fusion")
+            unknown = set(self.fusion_profiles) - set(PROFILE_EMBEDDING_TYPES)
+            if unknown:
+                raise ValueError(f"Unsupported fusion profiles: {sorted(unknown)}")
 
         # Create a Vespa object, used via context manager in the query methods:
         self.app = Vespa(url=self.vespa_url, port=self.vespa_port)
@@ -68,56 +189,286 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         input: RetrieverStrQueriesType,
         top_k: Optional[int] = None,
         embedding_type: Optional[str] = None,
+        summary: Optional[str] = None,
+        budget: Optional[float] = None,
         **kwargs,
-    ) -> List[RetrieverOutput]:
+    ) -> List[BudgetedRetrieverOutput]:
         """
         Handle single or batch queries, using the rank_profile to either utilize a text-based or vector-based method.
+        `summary` overrides the document summary of the retriever for this call and `budget` its
+        latency budget, which starts for every query when its retrieval starts (after embedding).
         """
+        budget = budget if budget is not None else self.budget
         top_k = top_k or self.top_k
         queries = input if isinstance(input, list) else [input]
-        query_embeddings = None
-        if self.embedder is not None and embedding_type is not None:
-            query_embeddings = self.embedder(queries, embedding_type=embedding_type, **kwargs)
-
-        # If you have an embedder, embed all queries up-front (used in "dense"/"colbert" retrievals)
-
-        outputs: List[RetrieverOutput] = []
-        for i, query_text in enumerate(queries):
-            # Switch based on your rank_profile
-            if self.rank_profile.lower() == "bm25":
-                response = self._query_text(query_text=query_text, top_k=top_k)
-            elif self.rank_profile.lower() == "dense":
-                # If user already passed in a dense vector, or embedder is used:
-                # If you want to read from "kwargs", you could do:
-                # dense_vector = kwargs.get("dense_rep") or ...
-                # otherwise we rely on `query_embeddings.data[i]`.
-                if query_embeddings is None:
-                    raise ValueError(
-                        "No embedder found for 'dense' rank profile. Provide an embedder or pass precomputed vectors."
-                    )
-                dense_vector = query_embeddings.data[i].embedding
-                response = self._query_dense(query_text, dense_vector, top_k=top_k)
-
-            elif self.rank_profile.lower() == "colbert":
-                # ColBERT is multi-vector. We assume embedder returns a shape [#tokens, 1024]
-                # plus we need query length for normalization.
-                # Adjust according to how your embedder returns multi-vector outputs.
-                if query_embeddings is None:
-                    raise ValueError(
-                        "No embedder found for 'colbert' rank profile. "
-                        "Provide an embedder that returns multi-vector embeddings or pass them explicitly."
-                    )
-                colbert_tensor = query_embeddings.data[i].embedding  # shape [qt, 1024]
-                query_len = float(len(colbert_tensor))  # number of tokens
-                response = self._query_colbert(query=query_text, colbert_tensor=colbert_tensor, query_len=query_len, top_k=top_k)
-            else:
-                raise ValueError(f"Unsupported rank profile: {self.rank_profile}")
+        profile = self.rank_profile.lower()
+        if profile != "fusion" and profile not in PROFILE_EMBEDDING_TYPES:
+            raise ValueError(f"Unsupported rank profile: {self.rank_profile}")
 
-            # Build output
-            outputs.append(self._build_retriever_output(query_text, response))
+        # embed all queries up-front, with every embedding type the profile (or its legs) needs
+        vectors = self._embed(queries, self._embedding_types(profile, embedding_type), **kwargs)
+
+        outputs: List[BudgetedRetrieverOutput] = []
+        for query_text, query_vectors in zip(queries, vectors):
+            deadline = time.monotonic() + budget if budget is not None else None
+            if profile == "fusion":
+                output = self._fused_output(query_text, query_vectors, top_k, summary, deadline)
+                served_profile = profile
+            else:
+                served_profile, response = self._query_with_fallback(
+                    profile, query_text, query_vectors, top_k, summary, deadline
+                )
+                # Build output
+                if self.group_by_book:
+                    output = self._build_grouped_output(query_text, response)
+                else:
+                    output = self._build_retriever_output(query_text, response)
+            outputs.append(
+                BudgetedRetrieverOutput(
+                    doc_indices=output.doc_indices,
+                    doc_scores=output.doc_scores,
+                    query=output.query,
+                    documents=output.documents,
+                    served_profile=served_profile,
+                    budget_left=deadline - time.monotonic() if deadline is not None else None,
+                )
+            )
 
         return outputs
 
+    def pages(
+        self,
+        query: str,
+        page_size: int = 100,
+        depth: int = 1000,
+        embedding_type: Optional[str] = None,
+        summary: Optional[str] = None,
+        **kwargs,
+    ) -> Iterator[RetrieverOutput]:
+        """
+        Yields the best `depth` hits of one query in pages of `page_size`, for result lists
+        too deep for a single response. The query is embedded once, and every page queries
+        with the same nearest neighbour candidates (targetHits=depth), so the pages are
+        windows (hits/offset) of one stable ranking. Stops early at a short or failed page.
+        Vespa caps offset and hits (maxOffset 1000, maxHits 400 by default).
+        """
+        profile = self.rank_profile.lower()
+        if profile not in PROFILE_EMBEDDING_TYPES:
+            raise ValueError(f"Pagination is not supported with the '{self.rank_profile}' rank profile")
+        if self.group_by_book:
+            raise ValueError("Pagination is not supported when grouping by book")
+
+        vectors = self._embed([query], self._embedding_types(profile, embedding_type), **kwargs)[0]
+        seen = set()
+        for offset in range(0, depth, page_size):
+            size = min(page_size, depth - offset)
+            page = _Page(offset=offset, depth=depth)
+            response = self._query_profile(profile, query, vectors, size, summary, page=page)
+            output = self._build_retriever_output(query, response)
+            # a document that moved between pages (a feed in between) is only yielded once
+            keep = [i for i, doc_id in enumerate(output.doc_indices) if doc_id not in seen]
+            seen.update(output.doc_indices)
+            yield RetrieverOutput(
+                doc_indices=[output.doc_indices[i] for i in keep],
+                doc_scores=[output.doc_scores[i] for i in keep],
+                query=query,
+                documents=[output.documents[i] for i in keep],
+            )
+            if len(output.doc_indices) < size:
+                return
+
+    def _embedding_types(self, profile: str, embedding_type: Optional[str] = None) -> List[str]:
+        """Every embedding type the profile (or its fusion legs) needs, unless one is given."""
+        if embedding_type is not None:
+            return [embedding_type]
+        profiles = self.fusion_profiles if profile == "fusion" else [profile]
+        return sorted({t for p in profiles for t in PROFILE_EMBEDDING_TYPES[p]})
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """Threads running the queries of fusion legs."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.fusion_profiles))
+        return self._executor
+
+    def close(self):
+        """Shut down the fusion threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> "VespaRetriever":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _query_with_fallback(
+        self,
+        profile: str,
+        query_text: str,
+        vectors: dict[str, Any],
+        top_k: int,
+        summary: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> tuple[Optional[str], Optional[VespaQueryResponse]]:
+        """
+        (served profile, response) of the first profile along FALLBACK_PROFILES that answers
+        within the deadline. While a profile with a fallback runs, `fallback_share` of the
+        remaining time is kept for the fallback. The time given to a profile is its Vespa
+        timeout and the timeout of its HTTP client, so a slow query does not outlive it.
+        Profiles without their query vectors, or that fail, are skipped. Without a deadline
+        only `profile` is queried.
+        """
+        if deadline is None:
+            return profile, self._query_profile(profile, query_text, vectors, top_k, summary)
+
+        response = None
+        while profile is not None:
+            fallback = FALLBACK_PROFILES.get(profile)
+            if all(t in vectors for t in PROFILE_EMBEDDING_TYPES[profile]):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = remaining * (1 - self.fallback_share) if fallback else remaining
+                try:
+                    response = self._query_profile(profile, query_text, vectors, top_k, summary, timeout)
+                except Exception as e:
+                    log.warning(f"The '{profile}' query failed within its budget of {timeout:.3f}s: {e}")
+                    response = None
+                if _answered(response):
+                    return profile, response
+            profile = fallback
+        log.warning(f"No profile answered within the budget: {query_text}")
+        return None, response
+
+    def _embed(self, queries: List[str], embedding_types: List[str], **kwargs) -> List[dict[str, Any]]:
+        """Query vectors of every query by embedding type, empty without an embedder."""
+        vectors = [{} for _ in queries]
+        if self.embedder is None:
+            return vectors
+        for embedding_type in embedding_types:
+            output = self.embedder(queries, embedding_type=embedding_type, **kwargs)
+            for query_vectors, embedding in zip(vectors, output.data):
+                query_vectors[embedding_type] = embedding.embedding
+        return vectors
+
+    def _query_profile(
+        self,
+        profile: str,
+        query_text: str,
+        vectors: dict[str, Any],
+        top_k: int,
+        summary: Optional[str] = None,
+        timeout: Optional[float] = None,
+        page: Optional[_Page] = None,
+    ) -> Optional[VespaQueryResponse]:
+        """
+        Query with one rank profile, `vectors` are the query's embeddings by embedding type
+        and `timeout` the Vespa query timeout in seconds. With a `page` the top_k hits start
+        at its offset.
+        """
+        if profile == "bm25":
+            return self._query_text(
+                query_text=query_text, top_k=top_k, summary=summary, rank_profile="bm25", timeout=timeout, page=page
+            )
+        if profile == "dense":
+            if "dense" not in vectors:
+                raise ValueError(
+                    "No embedder found for 'dense' rank profile. Provide an embedder or pass precomputed vectors."
+                )
+            return self._query_dense(
+                query_text, vectors["dense"], top_k=top_k, summary=summary, timeout=timeout, page=page
+            )
+        if profile == "colbert":
+            # ColBERT is multi-vector. We assume embedder returns a shape [#tokens, 1024]
+            # plus we need query length for normalization.
+            if "colbert" not in vectors:
+                raise ValueError(
+                    "No embedder found for 'colbert' rank profile. "
+                    "Provide an embedder that returns multi-vector embeddings or pass them explicitly."
+                )
+            colbert_tensor = vectors["colbert"]  # shape [qt, 1024]
+            query_len = float(len(colbert_tensor))  # number of tokens
+            return self._query_colbert(
+                query=query_text,
+                colbert_tensor=colbert_tensor,
+                query_len=query_len,
+                top_k=top_k,
+                timeout=timeout,
+                summary=summary,
+                page=page,
+            )
+        if profile == "hybrid":
+            # hybrid ranks by both the dense and the multi-vector query embeddings
+            if "dense" not in vectors or "colbert" not in vectors:
+                raise ValueError(
+                    "No embedder found for 'hybrid' rank profile. "
+                    "Provide an embedder that returns dense and multi-vector embeddings."
+                )
+            colbert_tensor = np.asarray(vectors["colbert"])
+            return self._query_hybrid(
+                query_text,
+                vectors["dense"],
+                colbert_tensor,
+                query_len=float(len(colbert_tensor)),
+                top_k=top_k,
+                timeout=timeout,
+                summary=summary,
+                page=page,
+            )
+        raise ValueError(f"Unsupported rank profile: {profile}")
+
+    def _fused_output(
+        self,
+        query_text: str,
+        vectors: dict[str, Any],
+        top_k: int,
+        summary: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> RetrieverOutput:
+        """
+        Runs a query per fusion profile concurrently and fuses the hits of the legs that
+        answered within `fusion_timeout` (or the deadline, if earlier), so the latency is the
+        one of the slowest leg.
+        """
+        depth = max(top_k, self.fusion_depth or 0)
+        timeout = self.fusion_timeout
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        futures = {
+            self._pool().submit(self._query_profile, profile, query_text, vectors, depth, summary, timeout): profile
+            for profile in self.fusion_profiles
+        }
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+            log.warning(f"The '{futures[future]}' leg missed the fusion budget: {query_text}")
+
+        rankings = {}
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                log.error(f"The '{futures[future]}' leg failed: {e}")
+                continue
+            if response is not None and response.is_successful():
+                rankings[futures[future]] = response.hits
+        if not rankings:
+            log.warning(f"No fusion leg answered: {query_text}")
+            return RetrieverOutput(doc_indices=[], doc_scores=[], query=query_text, documents=[])
+
+        fused = fuse_rankings(rankings, method=self.fusion, weights=self.fusion_weights, rrf_k=self.rrf_k)[:top_k]
+        documents = self._format_docs([hit for hit, _, _ in fused])
+        for document, (_, _, ranks) in zip(documents, fused):
+            document.meta_data["fusion_ranks"] = ranks
+        return RetrieverOutput(
+            doc_indices=[hit["id"] for hit, _, _ in fused],
+            doc_scores=[score for _, score, _ in fused],
+            query=query_text,
+            documents=documents,
+        )
+
     def _build_retriever_output(
         self, query_text: str, response: Optional[VespaQueryResponse]
     ) -> RetrieverOutput:
@@ -153,17 +504,167 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         docs: List[Document] = []
         for hit in hits:
             # The entire record is in hit["fields"] - parse as needed.
+            # Chunks are only there with a summary that includes them ("best", "text").
+            chunks = best_chunks(hit)
+            # store everything in metadata, copied so the response (or a cached one) stays as is
+            meta_data = dict(hit["fields"])
+            if chunks and chunks[0][0] is not None:
+                meta_data["best_chunks"] = [index for index, _ in chunks]
             doc_dict = {
                 "id": hit["id"],  # or a unique doc field
-                "text": hit["fields"].get("chunks", [""])[0],
-                "meta_data": hit["fields"],  # store everything in metadata
+                "text": chunks[0][1] if chunks else "",
+                "meta_data": meta_data,
                 "score": hit["relevance"],
             }
-            print(hit["fields"]) 
             docs.append(Document.from_dict(doc_dict))
         return docs
 
-    def _query_text(self, query_text: str, top_k: int) -> Optional[VespaQueryResponse]:
+    def _search(self, body: dict, **params) -> VespaQueryResponse:
+        """
+        Send the query, or serve it from the cache. Only successful responses are cached,
+        as their JSON bytes, so every hit gets a fresh response that callers may modify.
+        A `timeout` in seconds is sent to Vespa in milliseconds and bounds the HTTP request.
+        """
+        timeout = params.get("timeout")
+        if timeout is not None:
+            params["timeout"] = f"{max(int(timeout * 1000), 1)}ms"
+        params = {key: value for key, value in params.items() if value is not None}
+        if self.cache is None:
+            with self._session(timeout) as session:
+                return session.query(body=body, **params)
+
+        key = self._cache_key(body, params)
+        # read before querying, so a feed during the query invalidates the response
+        generation = write_generation()
+        cached = self.cache.get(key, generation)
+        if cached is not None:
+            status_code, url, data = cached
+            return VespaQueryResponse(json=orjson.loads(data), status_code=status_code, url=url)
+        with self._session(timeout) as session:
+            response = session.query(body=body, **params)
+        # a query that timed out answers with errors and partial hits, so it is not cached
+        if _answered(response) and not response.json.get("root", {}).get("errors"):
+            data = orjson.dumps(response.json)
+            self.cache.put(key, (response.status_code, response.url, data), size=len(data), generation=generation)
+        return response
+
+    @contextmanager
+    def _session(self, timeout: Optional[float] = None):
+        """
+        Sync Vespa session. With a timeout its HTTP client gives up shortly after Vespa's
+        query timeout and does not retry, so the request cannot outlive its budget.
+        """
+        if timeout is None:
+            with self.app.syncio() as session:
+                yield session
+            return
+        client = self.app.get_sync_session()
+        client.timeout = timeout + HTTP_TIMEOUT_GRACE
+        try:
+            with self.app.syncio(session=client, num_retries_429=0) as session:
+                yield session
+        finally:
+            client.close()
+
+    def _cache_key(self, body: dict, params: dict) -> str:
+        """
+        Digest of the endpoint and the request with whitespace in the YQL and query text
+        collapsed and the timeout left out, so formatting and budget differences do not miss the cache.
+        """
+        normalized = {
+            key: re.sub(r"\s+", " ", value).strip() if key in ("yql", "query") and isinstance(value, str) else value
+            for key, value in body.items()
+        }
+        request = {
+            "url": f"{self.vespa_url}:{self.vespa_port}",
+            "body": normalized,
+            "params": {key: value for key, value in params.items() if value is not None and key != "timeout"},
+        }
+        data = orjson.dumps(request, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return hashlib.sha1(data).hexdigest()
+
+    def _resolve_summary(self, summary: Optional[str], rank_profile: Optional[str] = None) -> Optional[str]:
+        """
+        The retriever's summary unless given. bm25 computes no per chunk scores, so "best"
+        becomes "matched", the chunks matching the query terms.
+        """
+        summary = summary or self.summary
+        if summary == "best" and (rank_profile or self.rank_profile).lower() == "bm25":
+            return "matched"
+        return summary
+
+    def _set_summary(self, body: dict, summary: Optional[str]):
+        """Select the document summary of the hits, the retriever's summary unless given."""
+        summary = self._resolve_summary(summary, body.get("ranking"))
+        if summary:
+            body["presentation.summary"] = summary
+
+    def _grouping(self, top_k: int, summary: Optional[str] = None) -> str:
+        """
+        Grouping expression of the top_k books (by their best section) with their best
+        sections, empty unless grouping by book.
+        """
+        if not self.group_by_book:
+            return ""
+        return (
+            f" | all(group(parent_id) max({top_k}) order(-max(relevance())) "
+            f"each(max({self.sections_per_book}) each(output(summary({self._resolve_summary(summary) or ''})))))"
+        )
+
+    def _hits(self, top_k: int) -> int:
+        """Plain hits to request, the grouped query returns its hits in the grouping result."""
+        return 0 if self.group_by_book else top_k
+
+    def _target_hits(self, top_k: int, page: Optional[_Page] = None) -> int:
+        """
+        Nearest neighbour candidates, enough to fill every book with its sections when grouping.
+        Pages search the candidates of the whole result list, so every page ranks the same hits.
+        """
+        if page is not None:
+            return page.depth
+        return top_k * self.sections_per_book if self.group_by_book else top_k
+
+    def _build_grouped_output(
+        self, query_text: str, response: Optional[VespaQueryResponse]
+    ) -> RetrieverOutput:
+        """
+        Convert a grouped Vespa response into `RetrieverOutput` with one entry per book:
+        doc_indices are the parent_ids and doc_scores the scores of their best sections.
+        `documents` holds the best sections of every book in book order, each with the
+        chunk indices of its best matching chunks (best first) in meta_data["matched_chunks"].
+        """
+        if response is None or not response.is_successful():
+            log.warning(f"Query failed or response is None: {query_text}")
+            return RetrieverOutput(doc_indices=[], doc_scores=[], query=query_text, documents=[])
+
+        doc_indices, doc_scores, documents = [], [], []
+        for group in _book_groups(response.json):
+            hits = [
+                hit
+                for hitlist in group.get("children", [])
+                for hit in hitlist.get("children", [])
+            ]
+            doc_indices.append(group["value"])
+            doc_scores.append(group["relevance"])
+            for document, hit in zip(self._format_docs(hits), hits):
+                document.meta_data["matched_chunks"] = matched_chunks(hit)
+                documents.append(document)
+        return RetrieverOutput(
+            doc_indices=doc_indices,
+            doc_scores=doc_scores,
+            query=query_text,
+            documents=documents,
+        )
+
+    def _query_text(
+        self,
+        query_text: str,
+        top_k: int,
+        summary: Optional[str] = None,
+        rank_profile: Optional[str] = None,
+        timeout: Optional[float] = None,
+        page: Optional[_Page] = None,
+    ) -> Optional[VespaQueryResponse]:
         """
         BM25 or textual retrieval, using userQuery().
         Example:
@@ -171,21 +672,26 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         """
         # yql = f"select * from {self.schema} * where userQuery()"
         yql = f"select * from sources {self.schema} where userQuery()"
+        body = {
+            "yql": yql + self._grouping(top_k, summary),
+            "query": query_text,
+            "ranking": rank_profile or self.rank_profile,
+        }
+        self._set_summary(body, summary)
         try:
-            with self.app.syncio() as session:
-                response = session.query(
-                    yql=yql,
-                    query=query_text,
-                    hits=top_k,
-                    ranking=self.rank_profile,
-                )
-            return response
+            return self._search(body, hits=self._hits(top_k), offset=_offset(page), timeout=timeout)
         except VespaError as e:
             log.error(f"BM25 query failed: {str(e)}")
             return None
 
     def _query_dense(
-        self, query: str, dense_vector: Union[np.ndarray, list], top_k: int = None
+        self,
+        query: str,
+        dense_vector: Union[np.ndarray, list],
+        top_k: int = None,
+        summary: Optional[str] = None,
+        timeout: Optional[float] = None,
+        page: Optional[_Page] = None,
     ) -> Optional[VespaQueryResponse]:
         """
          Vector-based query using 'dense' rank_profile.
@@ -193,21 +699,25 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
             inputs=[("query(q_dense)", "tensor<bfloat16>(x[1024])")]
             first_phase="closeness(dense_rep)"
         "input.query(q_dense)" in the request body.
+        With a quantizer the nearest neighbours are searched in dense_rep_int8 with
+        "input.query(q_dense_int8)".
         """
+        field, query_tensor = "dense_rep", "q_dense"
+        if self.quantizer is not None:
+            field, query_tensor = "dense_rep_int8", "q_dense_int8"
         body = {
-            "yql": f"select * from sources {self.schema} where  {{targetHits: {top_k}}} nearestNeighbor(dense_rep, q_dense)",
+            "yql": f"select * from sources {self.schema} where  {{targetHits: {self._target_hits(top_k, page)}}} nearestNeighbor({field}, {query_tensor})"
+            + self._grouping(top_k, summary),
             "query": query,
             "ranking": "dense",  # "dense"
             "input.query(q_dense)": self._to_vespa_tensor_string(dense_vector),
         }
+        if self.quantizer is not None:
+            body["input.query(q_dense_int8)"] = self.quantizer.quantize(dense_vector).tolist()
+        self._set_summary(body, summary)
 
         try:
-            with self.app.syncio() as session:
-                response = session.query(
-                    hits=top_k if top_k else self.top_k,
-                    body=body,
-                )
-            return response
+            return self._search(body, hits=self._hits(top_k), offset=_offset(page), timeout=timeout)
         except VespaError as e:
             log.error(f"Dense query failed: {str(e)}")
             return None
@@ -218,7 +728,9 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         colbert_tensor: Union[np.ndarray, list],
         query_len: float,
         top_k: int,
-        timeout: int = 1500,
+        timeout: Optional[float] = None,
+        summary: Optional[str] = None,
+        page: Optional[_Page] = None,
     ) -> Optional[VespaQueryResponse]:
         """
         Vector-based query using 'colbert' rank_profile.
@@ -230,19 +742,24 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
           first_phase="max_sim"
         Pass "input.query(q_colbert)" with shape [qt, 1024], and
         "query(q_len_colbert)" with the number of tokens for normalization.
+        With binary_colbert also "input.query(q_colbert_binary)" with shape [qt, 128].
         """
         body = {
-            "yql": f"select * from sources {self.schema} where true",
+            "yql": f"select * from sources {self.schema} where true" + self._grouping(top_k, summary),
             "query": query,
             "ranking": "colbert",  # "colbert"
             "input.query(q_colbert)": self._to_vespa_colbert_tensor(colbert_tensor),
             "input.query(q_len_colbert)": query_len,
         }
+        if self.binary_colbert:
+            # first phase Hamming MaxSim, the second phase rescoring uses q_colbert
+            body["input.query(q_colbert_binary)"] = self._to_vespa_colbert_tensor(
+                binarize(colbert_tensor)
+            )
+        self._set_summary(body, summary)
 
         try:
-            with self.app.syncio() as session:
-                response = session.query(hits=top_k, body=body, timeout=timeout)
-            return response
+            return self._search(body, hits=self._hits(top_k), offset=_offset(page), timeout=timeout)
         except VespaError as e:
             log.error(f"ColBERT query failed: {str(e)}")
             return None
@@ -254,7 +771,9 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         colbert_tensor: Union[np.ndarray, list],
         query_len: float,
         top_k: int,
-        timeout: int = None,
+        timeout: Optional[float] = None,
+        summary: Optional[str] = None,
+        page: Optional[_Page] = None,
     ) -> Optional[VespaQueryResponse]:
         """
         Vector-based query using 'hybrid' rank_profile.
@@ -270,18 +789,18 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         "query(q_len_colbert)" with the number of tokens for normalization.
         """
         body = {
-            "yql": f"select * from sources {self.schema} where {{targetHits: {top_k}}}nearestNeighbor(dense_rep, q_dense)",
+            "yql": f"select * from sources {self.schema} where {{targetHits: {self._target_hits(top_k, page)}}}nearestNeighbor(dense_rep, q_dense)"
+            + self._grouping(top_k, summary),
             "query": query,
             "ranking": "hybrid",  # "hybrid"
             "input.query(q_dense)": self._to_vespa_tensor_string(dense_vector),
             "input.query(q_colbert)": self._to_vespa_colbert_tensor(colbert_tensor),
             "input.query(q_len_colbert)": query_len,
         }
+        self._set_summary(body, summary)
 
         try:
-            with self.app.syncio() as session:
-                response = session.query(hits=top_k, body=body, timeout=timeout)
-            return response
+            return self._search(body, hits=self._hits(top_k), offset=_offset(page), timeout=timeout)
         except VespaError as e:
             log.error(f"Hybrid query failed: {str(e)}")
             return None
@@ -327,6 +846,351 @@ class VespaRetriever(Retriever[Any, RetrieverStrQueryType]):
         return {"blocks": blocks}
 
 
+def exact_top_k(
+    embeddings: ShardedArray,
+    queries: np.ndarray,
+    top_k: int,
+    block_size: Optional[int] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact inner product search of the (q, dim) queries over the memory-mapped embeddings.
+    The store is scanned block by block: every block is scored with one matrix multiply
+    and only its top_k rows per query (argpartition) are merged into the running result.
+
+    Returns (rows, scores), both of shape (q, min(top_k, num_rows)), best first.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start, block in embeddings.blocks(block_size):
+        scores = queries @ np.asarray(block, dtype=np.float32).T
+        rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+        if scores.shape[1] > top_k:
+            part = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            scores, rows = np.take_along_axis(scores, part, 1), np.take_along_axis(rows, part, 1)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        if scores.shape[1] > top_k:
+            part = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            scores, rows = np.take_along_axis(scores, part, 1), np.take_along_axis(rows, part, 1)
+        best_scores, best_rows = scores, rows
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, 1), np.take_along_axis(best_scores, order, 1)
+
+
+def max_sim(query_vecs: np.ndarray, doc_vecs: np.ndarray) -> float:
+    """
+    ColBERT MaxSim normalized by the query length, as in the Vespa colbert profile.
+    """
+    if len(doc_vecs) == 0:
+        return 0.0
+    sim = np.asarray(query_vecs, dtype=np.float32) @ np.asarray(doc_vecs, dtype=np.float32).T
+    return float(sim.max(axis=1).sum() / len(query_vecs))
+
+
+def build_hnsw_index(
+    store: EmbeddingStore,
+    path: Path,
+    M: int = 16,
+    ef_construction: int = 200,
+    block_size: Optional[int] = None,
+) -> "hnswlib.Index":
+    """
+    Builds an inner product HNSW index over the store embeddings, labelled by store row,
+    and saves it to path. Requires the optional `hnswlib` package (poetry install --with hnsw).
+    """
+    import hnswlib
+
+    index = hnswlib.Index(space="ip", dim=store.dim)
+    index.init_index(max_elements=len(store), M=M, ef_construction=ef_construction)
+    for start, block in store.embeddings.blocks(block_size):
+        index.add_items(np.asarray(block, dtype=np.float32), np.arange(start, start + len(block)))
+    index.save_index(str(path))
+    return index
+
+
+def _answered(response: Optional[VespaQueryResponse]) -> bool:
+    """Successful response, a timed out Vespa query answers with errors and no hits."""
+    if response is None or not response.is_successful():
+        return False
+    root = response.json.get("root", {})
+    return not root.get("errors") or bool(root.get("children"))
+
+
+def fuse_rankings(
+    rankings: dict[str, List[dict]],
+    method: Literal["rrf", "weighted"] = "rrf",
+    weights: Optional[dict[str, float]] = None,
+    rrf_k: int = 60,
+) -> List[tuple[dict, float, dict[str, int]]]:
+    """
+    Fuses the hits of every rank profile into (hit, score, rank per profile), best first.
+    Hits are deduped by id, keeping the hit of the profile that ranks it best.
+
+    rrf:      sum over profiles of weight / (rrf_k + rank), ranks start at 1
+    weighted: sum over profiles of weight * relevance min-max normalized within the profile
+    """
+    weights = weights or {}
+    scores: dict[str, float] = {}
+    best: dict[str, tuple[int, dict]] = {}
+    ranks: dict[str, dict[str, int]] = {}
+    for profile, hits in rankings.items():
+        weight = weights.get(profile, 1.0)
+        relevance = [hit.get("relevance", 0.0) for hit in hits]
+        low, high = (min(relevance), max(relevance)) if relevance else (0.0, 0.0)
+        for rank, hit in enumerate(hits, 1):
+            doc_id = hit["id"]
+            if doc_id in ranks.get(profile, {}):
+                continue
+            if method == "rrf":
+                score = weight / (rrf_k + rank)
+            elif method == "weighted":
+                score = weight * ((hit.get("relevance", 0.0) - low) / (high - low) if high > low else 1.0)
+            else:
+                raise ValueError(f"Unsupported fusion method: {method}")
+            scores[doc_id] = scores.get(doc_id, 0.0) + score
+            ranks.setdefault(profile, {})[doc_id] = rank
+            if doc_id not in best or rank < best[doc_id][0]:
+                best[doc_id] = (rank, hit)
+
+    order = sorted(scores, key=lambda doc_id: -scores[doc_id])
+    return [
+        (
+            best[doc_id][1],
+            scores[doc_id],
+            {profile: profile_ranks[doc_id] for profile, profile_ranks in ranks.items() if doc_id in profile_ranks},
+        )
+        for doc_id in order
+    ]
+
+
+def _book_groups(response_json: dict) -> List[dict]:
+    """Groups of the parent_id grouplist in a grouped Vespa response, in rank order."""
+    for child in response_json.get("root", {}).get("children", []):
+        if child.get("id", "").startswith("group:root"):
+            for grouplist in child.get("children", []):
+                if grouplist.get("label") == "parent_id":
+                    return grouplist.get("children", [])
+    return []
+
+
+def _tensor_cells(tensor: Any) -> dict[str, float]:
+    """
+    Cells of a rendered mapped tensor with one dimension, in any of the JSON formats
+    Vespa renders match-features in (short, short-value or long).
+    """
+    if not isinstance(tensor, dict):
+        return {}
+    cells = tensor.get("cells", tensor)
+    if isinstance(cells, list):
+        return {next(iter(cell["address"].values())): cell["value"] for cell in cells}
+    return {key: value for key, value in cells.items() if key != "type"}
+
+
+PER_CHUNK_FEATURES = ("per_chunk_max_sim", "per_chunk_dense")
+
+
+def matched_chunks(hit: dict) -> List[int]:
+    """
+    Chunk indices of a hit ordered by their per chunk score (best first), taken from
+    the per_chunk_max_sim or per_chunk_dense match-feature. A hit of the chunk layout is
+    its own chunk.
+    """
+    fields = hit.get("fields", {})
+    features = fields.get("matchfeatures", {})
+    for name in PER_CHUNK_FEATURES:
+        if name in features:
+            cells = _tensor_cells(features[name])
+            return [int(chunk) for chunk, _ in sorted(cells.items(), key=lambda cell: -cell[1])]
+    if "chunk_index" in fields:
+        return [int(fields["chunk_index"])]
+    return []
+
+
+def best_chunks(hit: dict) -> List[tuple[Optional[int], str]]:
+    """
+    (chunk index, text) of the chunks returned with a hit, best first.
+
+    The "best" summary returns only the chunks selected by the best_chunks summary-feature,
+    in document order, so they are matched to its labels in that order and sorted by its
+    scores. With all chunks returned ("text") they are ordered by the per chunk
+    match-feature. Otherwise (e.g. "matched") the indices are unknown and the order kept.
+    A hit of the chunk layout has its single chunk in "chunk".
+    """
+    fields = hit.get("fields", {})
+    if "chunk" in fields:
+        return [(fields.get("chunk_index"), fields["chunk"])]
+    chunks = fields.get("chunks") or []
+    selected = _tensor_cells(fields.get("summaryfeatures", {}).get("best_chunks"))
+    if selected and len(selected) == len(chunks):
+        indices = sorted(int(chunk) for chunk in selected)
+        scores = {int(chunk): score for chunk, score in selected.items()}
+        return sorted(zip(indices, chunks), key=lambda chunk: -scores[chunk[0]])
+    order = [index for index in matched_chunks(hit) if index < len(chunks)]
+    if order and len(order) == len(chunks):
+        return [(index, chunks[index]) for index in order]
+    return [(None, chunk) for chunk in chunks]
+
+
+class LocalRetriever(Retriever[Any, RetrieverStrQueryType]):
+    """
+    An in-process retriever over the sharded embedding store, with the interface of
+    VespaRetriever and no Vespa node:
+      - "dense": exact search over the chunk embeddings (or an HNSW index when given)
+      - "colbert": dense candidates re-ranked by MaxSim over stored ColBERT token vectors
+
+    The exact dense search doubles as a reference to measure Vespa recall against.
+    """
+
+    def __init__(
+        self,
+        store: EmbeddingStore,
+        embedder: Any = None,
+        top_k: int = 3,
+        rank_profile: str = "dense",
+        colbert_store: Optional[EmbeddingStore] = None,
+        hnsw_index_path: Optional[Path] = None,
+        hnsw_ef: int = 128,
+        rerank_depth: int = 100,
+        books_dir: Optional[Path] = None,
+        block_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            store (EmbeddingStore): Store with the chunk embeddings, see app.create_embeddings.
+            embedder (Embedder, optional): Embedder of the queries, e.g. M3Embdder.
+            top_k (int, optional): How many chunks to retrieve. Defaults to 3.
+            rank_profile (str, optional): "dense" or "colbert"
+            colbert_store (EmbeddingStore, optional): Store with one row per token vector and
+                the token's chunk in the 'chunk_index' column, required by "colbert". Written
+                by `python -m app.create_embeddings --colbert_store <dir>`.
+            hnsw_index_path (Path, optional): Index from `build_hnsw_index`, searched instead of
+                the exact scan.
+            hnsw_ef (int, optional): HNSW search breadth.
+            rerank_depth (int, optional): Dense candidates re-ranked by "colbert".
+            books_dir (Path, optional): Folder with the books' .txt files to fill document texts.
+            block_size (int, optional): Rows scored per matrix multiply, defaults to the shard size.
+        """
+        super().__init__()
+        if rank_profile == "colbert" and colbert_store is None:
+            raise ValueError("The 'colbert' rank profile needs a colbert_store with token vectors.")
+        self.store = store
+        self.embedder = embedder
+        self.top_k = top_k
+        self.rank_profile = rank_profile
+        self.colbert_store = colbert_store
+        self.rerank_depth = rerank_depth
+        self.books_dir = books_dir
+        self.block_size = block_size
+
+        self.index = None
+        if hnsw_index_path is not None:
+            import hnswlib
+
+            self.index = hnswlib.Index(space="ip", dim=store.dim)
+            self.index.load_index(str(hnsw_index_path), max_elements=len(store))
+            self.index.set_ef(hnsw_ef)
+
+    def call(
+        self,
+        input: RetrieverStrQueriesType,
+        top_k: Optional[int] = None,
+        embedding_type: Optional[str] = None,
+        **kwargs,
+    ) -> List[RetrieverOutput]:
+        """
+        Embed the queries and search the store, using the rank_profile.
+        `embedding_type` is accepted for compatibility with VespaRetriever, the
+        embeddings needed by the rank profile are always computed.
+        """
+        top_k = top_k or self.top_k
+        queries = input if isinstance(input, list) else [input]
+        if self.embedder is None:
+            raise ValueError("LocalRetriever needs an embedder for the query vectors.")
+        dense = np.array([e.embedding for e in self.embedder(queries, embedding_type="dense", **kwargs).data])
+
+        profile = self.rank_profile.lower()
+        if profile == "dense":
+            rows, scores = self.search(dense, top_k)
+        elif profile == "colbert":
+            colbert = [np.asarray(e.embedding) for e in self.embedder(queries, embedding_type="colbert", **kwargs).data]
+            rows, scores = self.search(dense, max(top_k, self.rerank_depth))
+            rows, scores = self.rerank_colbert(colbert, rows, top_k)
+        else:
+            raise ValueError(f"Unsupported rank profile: {self.rank_profile}")
+
+        return [
+            self._build_retriever_output(query_text, query_rows, query_scores)
+            for query_text, query_rows, query_scores in zip(queries, rows, scores)
+        ]
+
+    def search(self, query_vectors: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Dense search, returns (rows, scores) of shape (q, top_k), best first.
+        """
+        top_k = min(top_k, len(self.store))
+        if self.index is None:
+            return exact_top_k(self.store.embeddings, query_vectors, top_k, self.block_size)
+        rows, distances = self.index.knn_query(np.asarray(query_vectors, dtype=np.float32), k=top_k)
+        # hnswlib's inner product distance is 1 - <q, x>
+        return rows.astype(np.int64), 1.0 - distances
+
+    def rerank_colbert(
+        self, query_vecs: List[np.ndarray], rows: np.ndarray, top_k: int
+    ) -> tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Re-ranks the candidate rows of every query by MaxSim over their token vectors.
+        """
+        book_codes = self.store.column(BOOK_COLUMN)
+        chunk_indices = self.store.column("chunk_index")
+        book_ids = self.store.book_ids()
+        token_chunks = self.colbert_store.column("chunk_index")
+        token_vectors = self.colbert_store.embeddings
+
+        reranked_rows, reranked_scores = [], []
+        for q, candidates in zip(query_vecs, rows):
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            for i, (code, chunk_index) in enumerate(zip(book_codes[candidates], chunk_indices[candidates])):
+                book_id = book_ids[code]
+                if book_id not in self.colbert_store:
+                    continue
+                # token rows of a book are appended in chunk order
+                start, end = self.colbert_store.book_range(book_id)
+                chunks = np.asarray(token_chunks[start:end])
+                lo, hi = np.searchsorted(chunks, [chunk_index, chunk_index + 1])
+                scores[i] = max_sim(q, token_vectors[start + lo : start + hi])
+            order = np.argsort(-scores, kind="stable")[:top_k]
+            reranked_rows.append(candidates[order])
+            reranked_scores.append(scores[order])
+        return reranked_rows, reranked_scores
+
+    def _build_retriever_output(
+        self, query_text: str, rows: np.ndarray, scores: np.ndarray
+    ) -> RetrieverOutput:
+        """
+        Convert store rows into `RetrieverOutput`, document ids are `<book_id>_<chunk_index>`.
+        """
+        metadata = self.store.metadata(rows=rows)
+        texts = read_chunk_texts(metadata, self.books_dir) if self.books_dir else [""] * len(rows)
+        documents = []
+        for (_, meta), text, score in zip(metadata.iterrows(), texts, scores):
+            meta_data = {key: (value.item() if hasattr(value, "item") else value) for key, value in meta.items()}
+            documents.append(
+                Document(
+                    id=f"{meta_data['book_id']}_{meta_data['chunk_index']}",
+                    text=text or "",
+                    meta_data=meta_data,
+                    score=float(score),
+                )
+            )
+        return RetrieverOutput(
+            doc_indices=[int(row) for row in rows],
+            doc_scores=[float(score) for score in scores],
+            query=query_text,
+            documents=documents,
+        )
+
+
 class M3Embdder:
     _model_name = "BAAI/bge-m3"
     def __init__(self, max_length=512, batch_size=64):
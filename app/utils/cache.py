@@ -0,0 +1,97 @@
+"""LRU result cache bounded by entries and bytes, with TTL and generation invalidation"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    size: int
+    expires_at: float
+    generation: int
+
+
+class QueryCache:
+    """Thread-safe LRU cache for query results.
+
+    Entries expire after `ttl` seconds and are dropped when they were stored under an
+    older generation than the one passed to `get`, so a writer can invalidate every
+    cached result at once by bumping its generation counter. The least recently used
+    entries are evicted when either `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def num_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: Hashable, generation: int = 0) -> Any | None:
+        """Cached value of key, or None if missing, expired or from an older generation.
+
+        Args:
+            key: Cache key
+            generation: Current write generation
+
+        Returns:
+            Cached value or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.expires_at <= self.clock() or entry.generation != generation):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, size: int, generation: int = 0):
+        """Store value under key, evicting least recently used entries over the limits.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+            size: Approximate size of value in bytes
+            generation: Write generation the value was computed at
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(value, size, self.clock() + self.ttl, generation)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable):
+        self._bytes -= self._entries.pop(key).size
@@ -3,6 +3,7 @@ import re
 from ebooklib import epub, ITEM_DOCUMENT
 import logging
 import os
+import nltk
 
 logger = logging.getLogger(__name__)
 
@@ -46,4 +47,101 @@ def word_chunk(text: str, chunk_size: int, overlap: int) -> list[str]:
         chunk = words[i:i+chunk_size]
         if len(chunk) < overlap:
             continue
-        yield ' '.join(chunk) 
\ No newline at end of file
+        yield ' '.join(chunk) 
+
+def epub_to_text(epub_path) -> str:
+    """Read an EPUB file and extract the plain text of all document items.
+
+    Args:
+        epub_path: Path to the EPUB file
+
+    Returns:
+        Text of the book with runs of whitespace collapsed to a single space,
+        empty string if the EPUB cannot be read
+    """
+    try:
+        book = epub.read_epub(str(epub_path))
+    except Exception as e:
+        logger.error(f"Error reading EPUB {epub_path}: {e}")
+        return ""
+
+    texts = []
+    for item in book.get_items():
+        if item.get_type() == ITEM_DOCUMENT:
+            try:
+                soup = BeautifulSoup(item.get_content(), features="html.parser")
+                texts.append(soup.get_text(separator="\n"))
+            except Exception as e:
+                logger.error(f"Error parsing an item in {epub_path}: {e}")
+    return re.sub(r'\s+', ' ', "\n".join(texts))
+
+
+def chunk_text_with_overlap(text: str, tokenizer, max_tokens: int = 512, overlap_tokens: int = 64) -> tuple[list[str], list[dict]]:
+    """Split text into sentence aligned chunks of up to max_tokens tokens with overlap.
+
+    Sentence boundaries come from NLTK's Punkt span_tokenize. Sentences are added to a
+    chunk until the next one would exceed max_tokens; the next chunk then starts with
+    as many trailing sentences of the previous chunk as needed to reach overlap_tokens.
+
+    Args:
+        text: Input text to chunk
+        tokenizer: Tokenizer of the embedding model
+        max_tokens: Max number of tokens per chunk (without special tokens)
+        overlap_tokens: Min number of tokens shared with the previous chunk
+
+    Returns:
+        Tuple of (chunks, metadata) where every metadata dict has 'chunk_index',
+        'start_index', 'end_index' (character offsets into text), 'start_byte',
+        'end_byte' (offsets into the UTF-8 encoded text) and 'num_tokens'
+    """
+    sent_detector = nltk.data.load('tokenizers/punkt/english.pickle')
+    sentence_spans = []
+    sentences = []
+    for start, end in sent_detector.span_tokenize(text):
+        sentence = text[start:end].strip()
+        if sentence:
+            sentence_spans.append((start, end))
+            sentences.append(sentence)
+    if not sentences:
+        return [], []
+    # tokenize all sentences in one call, the counts are reused for overlaps
+    token_counts = [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)['input_ids']]
+    # UTF-8 byte offsets of the sentence boundaries, encoding the text piece by piece once
+    byte_offsets = {}
+    char_pos = byte_pos = 0
+    for offset in sorted({offset for span in sentence_spans for offset in span}):
+        byte_pos += len(text[char_pos:offset].encode('utf-8'))
+        char_pos = offset
+        byte_offsets[offset] = byte_pos
+
+    chunks = []
+    metadata = []
+
+    def add_chunk(first: int, last: int):
+        chunk_start, chunk_end = sentence_spans[first][0], sentence_spans[last][1]
+        chunks.append(text[chunk_start:chunk_end])
+        metadata.append({
+            'chunk_index': len(chunks) - 1,
+            'start_index': chunk_start,
+            'end_index': chunk_end,
+            'start_byte': byte_offsets[chunk_start],
+            'end_byte': byte_offsets[chunk_end],
+            'num_tokens': sum(token_counts[first:last + 1]),
+        })
+
+    first = 0               # index of the first sentence of the current chunk
+    current_token_count = 0
+    for i, num_tokens in enumerate(token_counts):
+        if i > first and current_token_count + num_tokens > max_tokens:
+            add_chunk(first, i - 1)
+            # back up until at least overlap_tokens are shared with the finished chunk
+            new_first, overlap_token_count = i, 0
+            while new_first > first and (new_first == i or overlap_token_count < overlap_tokens):
+                new_first -= 1
+                overlap_token_count += token_counts[new_first]
+            first = new_first
+            current_token_count = overlap_token_count
+        current_token_count += num_tokens
+
+    add_chunk(first, len(token_counts) - 1)
+    return chunks, metadata
@@ -1,9 +1,26 @@
 from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential_jitter, retry_if_result
 from httpx import AsyncClient, Response
+from contextlib import asynccontextmanager
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar
+import hashlib
 import logging
+import os
+import re
+import time
+
+import anyio
+from anyio.streams.memory import MemoryObjectReceiveStream
+import httpx
+
+if TYPE_CHECKING:
+    from app.config import ScraperConfig
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 async def retry_fetch(session: AsyncClient, url: str, **kwargs) -> Response:
     """Fetch URL with retry logic for server errors.
     
@@ -13,12 +30,264 @@ async def retry_fetch(session: AsyncClient, url: str, **kwargs) -> Response:
         **kwargs: Additional arguments to pass to get request
         
     Returns:
-        Response from the server
+        Response from the server, the server error of the last attempt if all of them failed
     """
     async for attempt in AsyncRetrying(
         stop=stop_after_attempt(3), 
         wait=wait_exponential_jitter(max=30), 
-        retry=retry_if_result(lambda res: res.is_server_error)
+        retry=retry_if_result(lambda res: res.is_server_error),
+        # the last response goes to the caller's raise_for_status instead of a RetryError
+        retry_error_callback=lambda state: state.outcome.result(),
     ):
         with attempt:
-            return await session.get(url, **kwargs) 
\ No newline at end of file
+            response = await session.get(url, **kwargs)
+        # a result is only checked by the retry predicate once it is set on the attempt
+        if not attempt.retry_state.outcome.failed:
+            attempt.retry_state.set_result(response)
+    return response
+
+class RateLimiter:
+    """Token bucket starting at most `rate` requests per second, `burst` of them at once.
+
+    Waiters are served in turn, a rate of 0 does not limit.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = anyio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await anyio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class ScraperRuntime:
+    """One long-lived, connection pooled client shared by every search and download.
+
+    Requests go through a per host and a global concurrency limit and a global rate
+    limiter, so a slow mirror cannot take every slot. The runtime has the
+    `get` of an AsyncClient, so it can be passed as the session of `retry_fetch`:
+
+        async with ScraperRuntime(settings.scraper) as runtime:
+            await runtime.run(titles, worker)
+    """
+
+    def __init__(self, config: "ScraperConfig", transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.config = config
+        self.limiter = anyio.CapacityLimiter(config.concurrency)
+        self.host_limiters: dict[str, anyio.CapacityLimiter] = {}
+        self.rate_limiter = RateLimiter(config.rate, config.burst)
+        self._transport = transport
+        self.client: Optional[AsyncClient] = None
+
+    async def __aenter__(self) -> "ScraperRuntime":
+        self.client = AsyncClient(
+            http2=self.config.http2,
+            proxy=self.config.proxy or None,
+            timeout=httpx.Timeout(self.config.timeout),
+            limits=httpx.Limits(
+                max_connections=self.config.max_connections,
+                max_keepalive_connections=self.config.max_keepalive_connections,
+                keepalive_expiry=self.config.keepalive_expiry,
+            ),
+            follow_redirects=True,
+            transport=self._transport,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.client = None
+
+    def _host_limiter(self, url: str) -> anyio.CapacityLimiter:
+        host = httpx.URL(url).host
+        if host not in self.host_limiters:
+            self.host_limiters[host] = anyio.CapacityLimiter(self.config.per_host)
+        return self.host_limiters[host]
+
+    @asynccontextmanager
+    async def _slot(self, url: str) -> AsyncIterator[None]:
+        # the host slot first, so waiting on a busy host does not hold a global slot
+        async with self._host_limiter(url), self.limiter:
+            await self.rate_limiter.acquire()
+            yield
+
+    async def get(self, url: str, **kwargs) -> Response:
+        """GET within the concurrency and rate limits."""
+        async with self._slot(url):
+            return await self.client.get(url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, url: str, **kwargs) -> AsyncIterator[Response]:
+        """Streamed GET within the concurrency and rate limits, holding its slot until closed."""
+        async with self._slot(url):
+            async with self.client.stream("GET", url, **kwargs) as response:
+                yield response
+
+    async def run(
+        self,
+        items: Iterable[T],
+        worker: Callable[[T], Awaitable[None]],
+        workers: Optional[int] = None,
+    ):
+        """Feed `items` through a bounded queue to `workers` concurrent calls of `worker`.
+
+        A slow item only holds up its own worker. Failures are logged and do not stop the
+        other items.
+
+        Args:
+            items: Work items, consumed lazily as the queue has room
+            worker: Coroutine function processing one item
+            workers: Concurrent workers, defaults to config.workers
+        """
+        send, receive = anyio.create_memory_object_stream[T](self.config.queue_size)
+
+        async def consume(receive: MemoryObjectReceiveStream):
+            async with receive:
+                async for item in receive:
+                    try:
+                        await worker(item)
+                    except Exception as e:
+                        logger.error(f"Failed to process {item}: {e}")
+
+        async with anyio.create_task_group() as tg:
+            for _ in range(workers or self.config.workers):
+                tg.start_soon(consume, receive.clone())
+            receive.close()
+            async with send:
+                for item in items:
+                    await send.send(item)
+
+
+def part_path(path: Path, source: str) -> Path:
+    """Partial download of `source` into `path`, one per source so a resume never mixes files."""
+    return path.with_name(f"{path.name}.{hashlib.sha1(source.encode()).hexdigest()[:16]}.part")
+
+
+def file_md5(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def download_file(
+    runtime: ScraperRuntime,
+    url: str,
+    path: Path,
+    *,
+    md5: Optional[str] = None,
+    validate: Optional[Callable[[Path], bool]] = None,
+    source: Optional[str] = None,
+    attempts: int = 3,
+) -> Path:
+    """Stream `url` to `path` through a partial file, resuming it with HTTP Range requests.
+
+    Chunks are appended to the partial file as they arrive, so memory stays flat and a
+    retry (or a rerun) continues from the bytes already on disk. The complete file is
+    checked against the announced size, `md5` and `validate` before it is atomically
+    renamed to `path`, so `path` never holds a truncated download.
+
+    Args:
+        runtime: Runtime sending the requests
+        url: URL of the file
+        path: Destination file
+        md5: Expected hex digest of the file, if known
+        validate: Check of the complete partial file, e.g. its magic bytes
+        source: Stable id of the file the partial file is kept under, defaults to `url`
+            (pass one when the URL carries an expiring key)
+        attempts: Requests tried, each resuming where the previous one stopped
+
+    Returns:
+        The destination path
+
+    Raises:
+        ValueError: The downloaded file failed validation, its partial file is removed
+        httpx.HTTPError: The last attempt failed, the partial file is kept for a resume
+    """
+    path = Path(path)
+    part = part_path(path, source or url)
+    for attempt in range(1, attempts + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        # ranges refer to the encoded bytes, so ask for the file as is
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            async with runtime.stream(url, headers=headers) as response:
+                if response.status_code == 416 and offset:
+                    # the partial file already has every byte
+                    size = offset
+                else:
+                    response.raise_for_status()
+                    resumed = response.status_code == 206 and _content_range_start(response) == offset
+                    if offset and not resumed:
+                        logger.debug(f"{url} does not resume at {offset}, downloading it again")
+                    size = _total_size(response, offset if resumed else 0)
+                    async with await anyio.open_file(part, "ab" if resumed else "wb") as f:
+                        # chunks as they arrive, a buffered chunk would be lost on a reset
+                        async for chunk in response.aiter_bytes():
+                            await f.write(chunk)
+            break
+        except httpx.TransportError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Download of {url} interrupted ({e}), resuming")
+
+    # hashing and fsyncing a multi-MB file would stall every other download on the loop
+    return await anyio.to_thread.run_sync(partial(_complete_download, part, path, url, size, md5, validate))
+
+
+def _complete_download(
+    part: Path, path: Path, url: str, size: Optional[int], md5: Optional[str], validate: Optional[Callable[[Path], bool]]
+) -> Path:
+    """Validates the complete partial file and renames it to `path`, blocking."""
+    try:
+        if size is not None and part.stat().st_size != size:
+            raise ValueError(f"Expected {size} bytes from {url}, got {part.stat().st_size}")
+        if md5 is not None and file_md5(part) != md5.lower():
+            raise ValueError(f"Checksum mismatch of {url}")
+        if validate is not None and not validate(part):
+            raise ValueError(f"Invalid file from {url}")
+    except ValueError:
+        part.unlink(missing_ok=True)
+        raise
+
+    with open(part, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(part, path)
+    for stale in path.parent.glob(f"{path.name}.*.part"):
+        stale.unlink(missing_ok=True)
+    return path
+
+
+def _content_range_start(response: Response) -> Optional[int]:
+    match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+
+def _total_size(response: Response, offset: int) -> Optional[int]:
+    """Size of the complete file, from Content-Range or Content-Length (unless encoded)."""
+    match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+    if match:
+        return int(match.group(1))
+    length = response.headers.get("Content-Length")
+    if length is None or response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    return offset + int(length)
@@ -0,0 +1,137 @@
+"""Atomic file writes and a small JSON manifest for resumable batch jobs"""
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+import orjson
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Write data to path atomically.
+
+    The data is written to a temporary file next to `path`, fsynced and renamed over
+    `path`, so readers see either the old or the new content, never a partial file.
+
+    Args:
+        path: Destination file
+        data: Content to write
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def append_journal(path: Path, entry: dict):
+    """Append one JSON line to a journal file and fsync it.
+
+    Args:
+        path: Journal file, created with its parent directory if missing
+        entry: JSON serializable entry
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(orjson.dumps(entry) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(path: Path) -> Iterator[dict]:
+    """Yield the entries of a journal file in the order they were appended.
+
+    Lines that do not parse are skipped, the last line of a crashed run may be torn.
+
+    Args:
+        path: Journal file, nothing is yielded if it does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+
+
+@dataclass
+class Manifest:
+    """Record of processed items keyed by id, journaled per item and compacted atomically.
+
+    Every `record` and `discard` appends one line to a journal next to the manifest and
+    fsyncs it, so bookkeeping costs the same for the first and the ten-thousandth item.
+    `load` replays the journal over the last snapshot and compacts both into a new
+    snapshot with `atomic_write_bytes`, so a crash loses at most the item being written
+    and a rerun can skip done work by a dictionary lookup.
+    """
+    path: Path
+    records: dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def journal_path(self) -> Path:
+        return self.path.with_name(f"{self.path.name}.journal")
+
+    @classmethod
+    def load(cls, path: Path | str) -> "Manifest":
+        """Load the manifest from path, or start an empty one if it does not exist.
+
+        Args:
+            path: Path to manifest JSON file
+
+        Returns:
+            Manifest with the committed records
+        """
+        path = Path(path)
+        records = orjson.loads(path.read_bytes()) if path.exists() else {}
+        manifest = cls(path=path, records=records)
+        if manifest.journal_path.exists():
+            for entry in read_journal(manifest.journal_path):
+                if entry.get("discard"):
+                    manifest.records.pop(entry["key"], None)
+                else:
+                    manifest.records[entry["key"]] = entry["fields"]
+            manifest.commit()
+        return manifest
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, key: str, default: dict | None = None) -> dict | None:
+        return self.records.get(key, default)
+
+    def record(self, key: str, commit: bool = True, **fields):
+        """Record (or overwrite) an item and journal it.
+
+        Args:
+            key: Item id
+            commit: Whether to persist the item right away
+            **fields: JSON serializable fields stored for the item
+        """
+        self.records[key] = fields
+        if commit:
+            append_journal(self.journal_path, {"key": key, "fields": fields})
+
+    def discard(self, key: str, commit: bool = True):
+        """Remove an item so it is processed again on the next run."""
+        if self.records.pop(key, None) is not None and commit:
+            append_journal(self.journal_path, {"key": key, "discard": True})
+
+    def commit(self):
+        """Atomically write all records to disk and start a new journal."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(self.path, orjson.dumps(self.records))
+        self.journal_path.unlink(missing_ok=True)
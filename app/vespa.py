@@ -1,3 +1,16 @@
+"""
+Vespa application package of narana.
+
+The schemas are built from `SchemaParams`, so the vector indexes can be tuned for memory
+and latency (HNSW links, paged attributes, reranking depth, schema variants) and the
+package rendered and tested offline. Nothing is deployed on import, see app/deploy.py:
+
+    python -m app.deploy --output data/vespa/application
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
 from vespa.package import (
     ApplicationPackage,
     Field,
@@ -11,228 +24,652 @@ from vespa.package import (
     Function,
     FirstPhaseRanking,
     HNSW,
+    Summary,
 )
-from vespa.deployment import VespaDocker
+
+APPLICATION_NAME = "narana"
+
+# optional document embedding schemas, see binary_doc_embedding_schema, compact_doc_embedding_schema
+# and chunk_embedding_schema
+SCHEMA_VARIANTS = ("binary", "compact", "chunks")
+
+
+@dataclass
+class SchemaParams:
+    """
+    hnsw_max_links_per_node:             max-links-per-node of every HNSW index, more links
+                                         raise recall and memory
+    hnsw_neighbors_to_explore_at_insert: neighbors-to-explore-at-insert of every HNSW index,
+                                         more raise the index quality and the feed time
+    paged_colbert:                       keep colbert_rep of document_embeddings and
+                                         chunk_embeddings on disk, the HNSW index of the former
+                                         (unused by the colbert queries) is dropped
+    paged_full_precision:                keep the full precision vectors the variants rescore with
+                                         on disk
+    rerank_count:                        hits rescored by the second phases
+    best_chunks:                         chunks per hit of the "best" summary
+    compact_dense_dims:                  dimensions of the int8 vectors of the compact variant,
+                                         the dims of its quantizer (see app/quantization.py)
+    variants:                            optional schemas in the package, of SCHEMA_VARIANTS
+    """
+
+    hnsw_max_links_per_node: int = 16
+    hnsw_neighbors_to_explore_at_insert: int = 200
+    paged_colbert: bool = False
+    paged_full_precision: bool = True
+    rerank_count: int = 100
+    best_chunks: int = 3
+    compact_dense_dims: int = 1024
+    variants: tuple[str, ...] = field(default=SCHEMA_VARIANTS)
+
+
+def _hnsw(params: SchemaParams, distance_metric: str = "angular") -> HNSW:
+    return HNSW(
+        distance_metric=distance_metric,
+        max_links_per_node=params.hnsw_max_links_per_node,
+        neighbors_to_explore_at_insert=params.hnsw_neighbors_to_explore_at_insert,
+    )
+
+
+def _summary_fields(names: list[str]) -> list[Summary]:
+    return [Summary(name, None, [("source", name)]) for name in names]
 
 
-app_package = ApplicationPackage(name="narana")
+# Document summaries selected per query with presentation.summary (see VespaRetriever):
+#   lean    - ids and short attributes, served from memory
+#   text    - lean and the full text
+#   matched - lean and only the chunks matching the query terms (documents)
+#   best    - lean and only the best scoring chunks of the rank profile (document_embeddings)
+#   tensors - lean and the embeddings (embedding schemas only)
+# match-features are returned with every summary.
+
+
+def _best_chunks(params: SchemaParams, per_chunk_score: str) -> Function:
+    """Summary feature with the highest scoring chunks, selects the chunks of the "best" summary."""
+    return Function(name="best_chunks", expression=f"top({params.best_chunks}, {per_chunk_score})")
+
+
+def _best_summary() -> DocumentSummary:
+    return DocumentSummary(
+        name="best",
+        inherits="lean",
+        summary_fields=[
+            Summary("chunks", None, [("source", "chunks")], select_elements_by="best_chunks")
+        ],
+    )
+
 
 # the original data from tvtropes dataset is split into multiple tables in the CSV files
 # I merged them into a single table, only difference is the name of the field Example and Description
 # for a definition of a trope and example of a trope in the story
-trope_example_schema = Schema(
-    name="trope_examples",
-    document=Document(
-        fields=[
-            Field(
-                name="title",
-                type="string",
-                indexing=["summary", "attribute"],
-            ),
-            Field(
-                name="trope",
-                type="string",
-                indexing=["summary", "attribute"],
-            ),
-            Field(name="author", type="string", indexing=["attribute", "summary"]),
-            Field(
-                name="example",
-                type="string",
-                indexing=["summary", "index"],
-                index="enable-bm25",
-            ),
-            Field(name="trope_id", type="string", indexing=["attribute", "summary"]),
-            Field(name="title_id", type="string", indexing=["attribute", "summary"]),
-        ]
-    ),
-    fieldsets=[
-        # this data will be mainly retrieved based on trope information
-        FieldSet(name="default", fields=["trope", "example"]),
-    ],
-    rank_profiles=[RankProfile(name="bm25", first_phase="bm25(example)")],
-)
+def trope_example_schema() -> Schema:
+    return Schema(
+        name="trope_examples",
+        document=Document(
+            fields=[
+                Field(
+                    name="title",
+                    type="string",
+                    indexing=["summary", "attribute"],
+                ),
+                Field(
+                    name="trope",
+                    type="string",
+                    indexing=["summary", "attribute"],
+                ),
+                Field(name="author", type="string", indexing=["attribute", "summary"]),
+                Field(
+                    name="example",
+                    type="string",
+                    indexing=["summary", "index"],
+                    index="enable-bm25",
+                ),
+                Field(name="trope_id", type="string", indexing=["attribute", "summary"]),
+                Field(name="title_id", type="string", indexing=["attribute", "summary"]),
+            ]
+        ),
+        fieldsets=[
+            # this data will be mainly retrieved based on trope information
+            FieldSet(name="default", fields=["trope", "example"]),
+        ],
+        document_summaries=[
+            DocumentSummary(
+                name="lean",
+                summary_fields=_summary_fields(["title", "trope", "author", "trope_id", "title_id"]),
+            ),
+            DocumentSummary(name="text", inherits="lean", summary_fields=_summary_fields(["example"])),
+        ],
+        rank_profiles=[RankProfile(name="bm25", first_phase="bm25(example)")],
+    )
 
 
-trope_example_embedding_schema = Schema(
-    name="trope_example_embeddings",
-    inherits="trope_examples",
-    document=Document(
+def trope_example_embedding_schema(params: SchemaParams) -> Schema:
+    return Schema(
+        name="trope_example_embeddings",
         inherits="trope_examples",
-        fields=[
-            Field(name="model", type="string", indexing=["attribute", "summary"]),
-            Field(name="version", type="string", indexing=["attribute", "summary"]),
-            Field(
-                name="dense_rep",
-                type="tensor<bfloat16>(x[1024])",
-                indexing=["attribute", "index"],
-                ann=HNSW(distance_metric="angular"),
-            ),
-            Field(
-                name="colbert_rep",
-                type="tensor<bfloat16>(token{}, x[1024])",
-                indexing=["attribute", "index"],
-                ann=HNSW(distance_metric="angular"),
-            ),
-        ],
-    ),
-    rank_profiles=[
-        RankProfile(
-            name="dense",
-            inputs=[("query(q_dense)", "tensor<bfloat16>(x[1024])")],
-            inherits="default",
-            first_phase="closeness(field, dense_rep)",
-            match_features=["closeness(field, dense_rep)"],
-        ),
-        RankProfile(
-            name="colbert",
-            inputs=[("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])")],
-            functions=[
-                Function(
-                    name="max_sim",
-                    expression="sum(reduce(sum(query(q_colbert) * attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+        document=Document(
+            inherits="trope_examples",
+            fields=[
+                Field(name="model", type="string", indexing=["attribute", "summary"]),
+                Field(name="version", type="string", indexing=["attribute", "summary"]),
+                Field(
+                    name="dense_rep",
+                    type="tensor<bfloat16>(x[1024])",
+                    indexing=["attribute", "index"],
+                    ann=_hnsw(params),
+                ),
+                Field(
+                    name="colbert_rep",
+                    type="tensor<bfloat16>(token{}, x[1024])",
+                    indexing=["attribute", "index"],
+                    ann=_hnsw(params),
                 ),
             ],
-            first_phase=FirstPhaseRanking(
-                expression="max_sim",
-                rank_score_drop_limit=0.3,
+        ),
+        document_summaries=[
+            DocumentSummary(
+                name="tensors",
+                inherits="lean",
+                summary_fields=_summary_fields(["model", "version", "dense_rep", "colbert_rep"]),
+            ),
+        ],
+        rank_profiles=[
+            RankProfile(
+                name="dense",
+                inputs=[("query(q_dense)", "tensor<bfloat16>(x[1024])")],
+                inherits="default",
+                first_phase="closeness(field, dense_rep)",
+                match_features=["closeness(field, dense_rep)"],
+            ),
+            RankProfile(
+                name="colbert",
+                inputs=[("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])")],
+                functions=[
+                    Function(
+                        name="max_sim",
+                        expression="sum(reduce(sum(query(q_colbert) * attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                ],
+                first_phase=FirstPhaseRanking(
+                    expression="max_sim",
+                    rank_score_drop_limit=0.3,
+                ),
             ),
+        ],
+    )
+
+
+def document_schema() -> Schema:
+    return Schema(
+        name="documents",
+        global_document=True,
+        document=Document(
+            fields=[
+                Field(name="document_id", type="string", indexing=["attribute", "summary"]),
+                Field(name="parent_id", type="string", indexing=["attribute", "summary"]),
+                Field(name="title", type="string", indexing=["summary", "attribute"]),
+                Field(
+                    name="authors", type="array<string>", indexing=["summary", "attribute"]
+                ),
+                Field(
+                    name="chunks",
+                    type="array<string>",
+                    indexing=["summary", "index"],
+                    bolding=True,
+                    index="enable-bm25",
+                ),
+                Field(name="max_chunk_size", type="int", indexing=["attribute", "summary"]),
+            ]
         ),
-    ],
-)
+        fieldsets=[
+            FieldSet(name="default", fields=["title", "chunks", "authors"]),
+        ],
+        document_summaries=[
+            DocumentSummary(
+                name="lean",
+                summary_fields=_summary_fields(["document_id", "parent_id", "title", "authors"]),
+            ),
+            DocumentSummary(name="text", inherits="lean", summary_fields=_summary_fields(["chunks"])),
+            DocumentSummary(
+                name="matched",
+                inherits="lean",
+                summary_fields=[Summary("chunks", None, [("source", "chunks"), "matched-elements-only"])],
+            ),
+        ],
+        rank_profiles=[RankProfile(name="bm25", first_phase="bm25(chunks)")],
+    )
 
 
-document_schema = Schema(
-    name="documents",
-    global_document=True,
-    document=Document(
-        fields=[
-            Field(name="document_id", type="string", indexing=["attribute", "summary"]),
-            Field(name="parent_id", type="string", indexing=["attribute", "summary"]),
-            Field(name="title", type="string", indexing=["summary", "attribute"]),
-            Field(
-                name="authors", type="array<string>", indexing=["summary", "attribute"]
-            ),
-            Field(
-                name="chunks",
-                type="array<string>",
-                indexing=["summary", "index"],
-                bolding=True,
-                index="enable-bm25",
-            ),
-            Field(name="max_chunk_size", type="int", indexing=["attribute", "summary"]),
-        ]
-    ),
-    fieldsets=[
-        FieldSet(name="default", fields=["title", "chunks", "authors"]),
-    ],
-    rank_profiles=[RankProfile(name="bm25", first_phase="bm25(chunks)")],
-)
+def _dense_profile(params: SchemaParams) -> RankProfile:
+    return RankProfile(
+        name="dense",
+        inputs=[("query(q_dense)", "tensor<bfloat16>(x[1024])")],
+        inherits="default",
+        functions=[
+            Function(
+                name="per_chunk_dense",
+                expression="cosine_similarity(query(q_dense), attribute(dense_rep), x)",
+            ),
+            _best_chunks(params, "per_chunk_dense"),
+        ],
+        first_phase="closeness(field, dense_rep)",
+        match_features=["closeness(field, dense_rep)", "per_chunk_dense"],
+        summary_features=["best_chunks"],
+    )
 
 
-doc_embedding_schema = Schema(
-    name="document_embeddings",
-    inherits="documents",
-    document=Document(
+def doc_embedding_schema(params: SchemaParams) -> Schema:
+    if params.paged_colbert:
+        colbert_rep = Field(
+            name="colbert_rep",
+            type="tensor<bfloat16>(chunk{},token{},x[1024])",
+            indexing=["attribute"],
+            attribute=["paged"],
+        )
+    else:
+        colbert_rep = Field(
+            name="colbert_rep",
+            type="tensor<bfloat16>(chunk{},token{},x[1024])",
+            indexing=["index", "attribute"],
+            ann=_hnsw(params),
+        )
+    return Schema(
+        name="document_embeddings",
         inherits="documents",
-        fields=[
-            Field(name="model", type="string", indexing=["attribute", "summary"]),
-            # version is a literal with values dense, colbert or hybrid
-            Field(name="version", type="string", indexing=["attribute", "summary"]),
-            Field(
-                name="dense_rep",
-                type="tensor<bfloat16>(chunk{},x[1024])",
-                indexing=["index", "attribute"],
-                ann=HNSW(distance_metric="angular"),
-            ),
-            Field(
-                name="colbert_rep",
-                type="tensor<bfloat16>(chunk{},token{},x[1024])",
-                indexing=["index", "attribute"],
-                ann=HNSW(distance_metric="angular")
-            ),
-            Field(name="document_id", type="string", indexing=["attribute", "summary"]),
-        ],
-    ),
-    fieldsets=[FieldSet(name="default", fields=["chunks", "title", "authors"])],
-    rank_profiles=[
-        RankProfile(
-            name="dense",
-            inputs=[("query(q_dense)", "tensor<bfloat16>(x[1024])")],
-            inherits="default",
-            first_phase="closeness(field, dense_rep)",
-            match_features=["closeness(field, dense_rep)"],
-        ),
-        RankProfile(
-            name="colbert",
-            inputs=[
-                ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
-                ("query(q_len_colbert)", "float"),
+        document=Document(
+            inherits="documents",
+            fields=[
+                Field(name="model", type="string", indexing=["attribute", "summary"]),
+                # version is a literal with values dense, colbert or hybrid
+                Field(name="version", type="string", indexing=["attribute", "summary"]),
+                Field(
+                    name="dense_rep",
+                    type="tensor<bfloat16>(chunk{},x[1024])",
+                    indexing=["index", "attribute"],
+                    ann=_hnsw(params),
+                ),
+                colbert_rep,
+                Field(name="document_id", type="string", indexing=["attribute", "summary"]),
             ],
-            functions=[
-                Function(
-                    name="per_chunk_max_sim",
-                    expression="sum(reduce(cosine_similarity(query(q_colbert), attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+        ),
+        fieldsets=[FieldSet(name="default", fields=["chunks", "title", "authors"])],
+        document_summaries=[
+            DocumentSummary(
+                name="tensors",
+                inherits="lean",
+                summary_fields=_summary_fields(["model", "version", "dense_rep", "colbert_rep"]),
+            ),
+            _best_summary(),
+        ],
+        rank_profiles=[
+            _dense_profile(params),
+            RankProfile(
+                name="colbert",
+                inputs=[
+                    ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
+                    ("query(q_len_colbert)", "float"),
+                ],
+                functions=[
+                    Function(
+                        name="per_chunk_max_sim",
+                        expression="sum(reduce(cosine_similarity(query(q_colbert), attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                    Function(
+                        name="max_sim",
+                        expression="reduce(per_chunk_max_sim, max, chunk)",
+                    ),
+                    _best_chunks(params, "per_chunk_max_sim"),
+                ],
+                first_phase=FirstPhaseRanking(
+                    expression="max_sim",
                 ),
-                Function(
-                    name="max_sim",
-                    expression="reduce(per_chunk_max_sim, max, chunk)",
+                match_features=["max_sim", "per_chunk_max_sim"],
+                summary_features=["best_chunks"],
+            ),
+            RankProfile(
+                name="hybrid",
+                inputs=[
+                    ("query(q_dense)", "tensor<bfloat16>(x[1024])"),
+                    ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
+                    ("query(q_len_colbert)", "float"),
+                ],
+                functions=[
+                    Function(
+                        name="max_dense",
+                        expression="reduce(cosine_similarity(query(q_dense), attribute(dense_rep), x), max, chunk)",
+                    ),
+                    Function(
+                        name="avg_dense",
+                        expression="reduce(cosine_similarity(query(q_dense), attribute(dense_rep), x), avg, chunk)",
+                    ),
+                    Function(
+                        name="per_chunk_dense",
+                        expression="cosine_similarity(query(q_dense), attribute(dense_rep), x)",
+                    ),
+                    # max_sim to handle an extra dimension chunk{} and token{}
+                    # - sum over x dimension: sum(query(q_colbert)*attribute(colbert_rep), x)
+                    #   This leaves dimensions qt{}, chunk{}, token{}.
+                    # - reduce with max over token dimension: reduce(..., max, token)
+                    #   This now leaves qt{}, chunk{}. (qt values are sim. scores with max sim tokens from each cunk)
+                    # - sum over qt and normalize by len of query (q_len_colbert)
+                    # - finally divide return max over chunks
+                    Function(
+                        name="per_chunk_max_sim",
+                        expression="sum(reduce(sum(query(q_colbert) * attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                    Function(
+                        name="max_sim",
+                        expression="reduce(per_chunk_max_sim, max, chunk)"
+                    ),
+                    # the chunks the second phase score comes from
+                    _best_chunks(params, "per_chunk_max_sim"),
+                ],
+                first_phase=FirstPhaseRanking(
+                    expression="max_dense + bm25(chunks)",
+                    rank_score_drop_limit=0.3,
                 ),
-            ],
-            first_phase=FirstPhaseRanking(
-                expression="max_sim",
+                second_phase=SecondPhaseRanking(
+                    expression="max_sim",
+                    rerank_count=params.rerank_count,
+                ),
+                match_features=["avg_dense", "max_dense", "max_sim", "per_chunk_dense", "bm25(chunks)"],
+                summary_features=["best_chunks"],
             ),
-            match_features=["max_sim", "per_chunk_max_sim"],
-        ),
-        RankProfile(
-            name="hybrid",
-            inputs=[
-                ("query(q_dense)", "tensor<bfloat16>(x[1024])"),
-                ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
-                ("query(q_len_colbert)", "float"),
+        ],
+    )
+
+
+# document_embeddings with the ColBERT token vectors binarized to their sign bits and packed
+# into x[128] int8 cells (see binarize in app/crud/vespa.py), 128 bytes per token instead of
+# 2 KB. The colbert and hybrid profiles rank by the Hamming MaxSim of the binarized query
+# (query(q_colbert_binary)) and rescore in second phase with the full precision query
+# against the unpacked bits. unpack_bits restores x[1024], so query(q_colbert) is unchanged.
+def binary_doc_embedding_schema(params: SchemaParams) -> Schema:
+    return Schema(
+        name="document_embeddings_binary",
+        inherits="documents",
+        document=Document(
+            inherits="documents",
+            fields=[
+                Field(name="model", type="string", indexing=["attribute", "summary"]),
+                Field(name="version", type="string", indexing=["attribute", "summary"]),
+                Field(
+                    name="dense_rep",
+                    type="tensor<bfloat16>(chunk{},x[1024])",
+                    indexing=["index", "attribute"],
+                    ann=_hnsw(params),
+                ),
+                Field(
+                    name="colbert_rep",
+                    type="tensor<int8>(chunk{},token{},x[128])",
+                    indexing=["attribute"],
+                ),
+                Field(name="document_id", type="string", indexing=["attribute", "summary"]),
             ],
-            functions=[
-                Function(
-                    name="max_dense",
-                    expression="reduce(cosine_similarity(query(q_dense), attribute(dense_rep), x), max, chunk)",
-                ),
-                Function(
-                    name="avg_dense",
-                    expression="reduce(cosine_similarity(query(q_dense), attribute(dense_rep), x), avg, chunk)",
-                ),
-                Function(
-                    name="per_chunk_dense",
-                    expression="cosine_similarity(query(q_dense), attribute(dense_rep), x)",
-                ),
-                # max_sim to handle an extra dimension chunk{} and token{}
-                # - sum over x dimension: sum(query(q_colbert)*attribute(colbert_rep), x)
-                #   This leaves dimensions qt{}, chunk{}, token{}.
-                # - reduce with max over token dimension: reduce(..., max, token)
-                #   This now leaves qt{}, chunk{}. (qt values are sim. scores with max sim tokens from each cunk)
-                # - sum over qt and normalize by len of query (q_len_colbert)
-                # - finally divide return max over chunks
-                Function(
-                    name="max_sim",
-                    expression="reduce(sum(reduce(sum(query(q_colbert) * attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert), max, chunk)"
+        ),
+        fieldsets=[FieldSet(name="default", fields=["chunks", "title", "authors"])],
+        document_summaries=[
+            DocumentSummary(
+                name="tensors",
+                inherits="lean",
+                summary_fields=_summary_fields(["model", "version", "dense_rep", "colbert_rep"]),
+            ),
+            _best_summary(),
+        ],
+        rank_profiles=[
+            _dense_profile(params),
+            RankProfile(
+                name="colbert",
+                inputs=[
+                    ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
+                    ("query(q_colbert_binary)", "tensor<int8>(qt{}, x[128])"),
+                    ("query(q_len_colbert)", "float"),
+                ],
+                functions=[
+                    # similarity of two tokens is 1 / (1 + number of differing bits)
+                    Function(
+                        name="per_chunk_max_sim_binary",
+                        expression="sum(reduce(1 / (1 + sum(hamming(query(q_colbert_binary), attribute(colbert_rep)), x)), max, token), qt)",
+                    ),
+                    Function(
+                        name="per_chunk_max_sim",
+                        expression="sum(reduce(sum(query(q_colbert) * unpack_bits(attribute(colbert_rep)), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                    Function(name="max_sim_binary", expression="reduce(per_chunk_max_sim_binary, max, chunk)"),
+                    Function(name="max_sim", expression="reduce(per_chunk_max_sim, max, chunk)"),
+                    _best_chunks(params, "per_chunk_max_sim"),
+                ],
+                first_phase=FirstPhaseRanking(expression="max_sim_binary"),
+                second_phase=SecondPhaseRanking(expression="max_sim", rerank_count=params.rerank_count),
+                match_features=["max_sim_binary", "max_sim", "per_chunk_max_sim"],
+                summary_features=["best_chunks"],
+            ),
+            RankProfile(
+                name="hybrid",
+                inputs=[
+                    ("query(q_dense)", "tensor<bfloat16>(x[1024])"),
+                    ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
+                    ("query(q_len_colbert)", "float"),
+                ],
+                functions=[
+                    Function(
+                        name="per_chunk_dense",
+                        expression="cosine_similarity(query(q_dense), attribute(dense_rep), x)",
+                    ),
+                    Function(name="max_dense", expression="reduce(per_chunk_dense, max, chunk)"),
+                    Function(
+                        name="per_chunk_max_sim",
+                        expression="sum(reduce(sum(query(q_colbert) * unpack_bits(attribute(colbert_rep)), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                    Function(name="max_sim", expression="reduce(per_chunk_max_sim, max, chunk)"),
+                    _best_chunks(params, "per_chunk_max_sim"),
+                ],
+                first_phase=FirstPhaseRanking(
+                    expression="max_dense + bm25(chunks)",
+                    rank_score_drop_limit=0.3,
+                ),
+                second_phase=SecondPhaseRanking(expression="max_sim", rerank_count=params.rerank_count),
+                match_features=["max_dense", "max_sim", "per_chunk_dense", "bm25(chunks)"],
+                summary_features=["best_chunks"],
+            ),
+        ],
+    )
+
+
+# document_embeddings with only the dense vectors, the HNSW index is built on their int8
+# codes (dense_rep_int8, 1 byte per dimension) and the full precision vectors are kept in
+# a paged attribute, read from disk for the second phase rescoring of the top hits only.
+def compact_doc_embedding_schema(params: SchemaParams) -> Schema:
+    return Schema(
+        name="document_embeddings_compact",
+        inherits="documents",
+        document=Document(
+            inherits="documents",
+            fields=[
+                Field(name="model", type="string", indexing=["attribute", "summary"]),
+                Field(name="version", type="string", indexing=["attribute", "summary"]),
+                Field(
+                    name="dense_rep",
+                    type="tensor<bfloat16>(chunk{},x[1024])",
+                    indexing=["attribute"],
+                    attribute=["paged"] if params.paged_full_precision else None,
+                ),
+                Field(
+                    name="dense_rep_int8",
+                    type=f"tensor<int8>(chunk{{}},x[{params.compact_dense_dims}])",
+                    indexing=["index", "attribute"],
+                    ann=_hnsw(params),
                 ),
+                Field(name="document_id", type="string", indexing=["attribute", "summary"]),
             ],
-            first_phase=FirstPhaseRanking(
-                expression="max_dense + bm25(chunks)",
-                rank_score_drop_limit=0.3,
+        ),
+        fieldsets=[FieldSet(name="default", fields=["chunks", "title", "authors"])],
+        document_summaries=[
+            DocumentSummary(
+                name="tensors",
+                inherits="lean",
+                summary_fields=_summary_fields(["model", "version", "dense_rep", "dense_rep_int8"]),
             ),
-            second_phase=SecondPhaseRanking(
-                expression="max_sim",
-                rerank_count=100,
+            _best_summary(),
+        ],
+        rank_profiles=[
+            RankProfile(
+                name="dense",
+                inputs=[
+                    ("query(q_dense)", "tensor<bfloat16>(x[1024])"),
+                    ("query(q_dense_int8)", f"tensor<int8>(x[{params.compact_dense_dims}])"),
+                ],
+                inherits="default",
+                functions=[
+                    Function(
+                        name="per_chunk_dense",
+                        expression="cosine_similarity(query(q_dense), attribute(dense_rep), x)",
+                    ),
+                    _best_chunks(params, "per_chunk_dense"),
+                ],
+                first_phase="closeness(field, dense_rep_int8)",
+                second_phase=SecondPhaseRanking(
+                    expression="reduce(per_chunk_dense, max, chunk)",
+                    rerank_count=params.rerank_count,
+                ),
+                match_features=["closeness(field, dense_rep_int8)", "per_chunk_dense"],
+                summary_features=["best_chunks"],
             ),
-            match_features=["avg_dense", "max_dense", "max_sim", "per_chunk_dense", "bm25(chunks)"],
+        ],
+    )
+
+
+# One document per chunk instead of one per section with chunk{} tensors, so an embedding
+# update assigns the tensors of a single chunk and ranking evaluates one chunk per hit.
+# Chunks reference their section in the global documents schema and import its book,
+# title and authors, the chunk id is "<document_id>_<chunk_index>" (see app/crud/vespa.py).
+def chunk_embedding_schema(params: SchemaParams) -> Schema:
+    return Schema(
+        name="chunk_embeddings",
+        document=Document(
+            fields=[
+                Field(name="document_ref", type="reference<documents>", indexing=["attribute"]),
+                Field(name="document_id", type="string", indexing=["attribute", "summary"]),
+                Field(name="chunk_index", type="int", indexing=["attribute", "summary"]),
+                Field(
+                    name="chunk",
+                    type="string",
+                    indexing=["summary", "index"],
+                    bolding=True,
+                    index="enable-bm25",
+                ),
+                Field(name="model", type="string", indexing=["attribute", "summary"]),
+                Field(name="version", type="string", indexing=["attribute", "summary"]),
+                Field(
+                    name="dense_rep",
+                    type="tensor<bfloat16>(x[1024])",
+                    indexing=["index", "attribute"],
+                    ann=_hnsw(params),
+                ),
+                Field(
+                    name="colbert_rep",
+                    type="tensor<bfloat16>(token{},x[1024])",
+                    indexing=["attribute"],
+                    attribute=["paged"] if params.paged_colbert else None,
+                ),
+            ]
         ),
-    ],
-)
+        imported_fields=[
+            ImportedField(name="parent_id", reference_field="document_ref", field_to_import="parent_id"),
+            ImportedField(name="title", reference_field="document_ref", field_to_import="title"),
+            ImportedField(name="authors", reference_field="document_ref", field_to_import="authors"),
+        ],
+        fieldsets=[FieldSet(name="default", fields=["chunk"])],
+        # a hit is a single chunk, so text, best and matched are the same summary
+        document_summaries=[
+            DocumentSummary(
+                name="lean",
+                summary_fields=_summary_fields(["document_id", "chunk_index", "parent_id", "title", "authors"]),
+            ),
+            DocumentSummary(name="text", inherits="lean", summary_fields=_summary_fields(["chunk"])),
+            DocumentSummary(name="best", inherits="text"),
+            DocumentSummary(name="matched", inherits="text"),
+            DocumentSummary(
+                name="tensors",
+                inherits="lean",
+                summary_fields=_summary_fields(["model", "version", "dense_rep", "colbert_rep"]),
+            ),
+        ],
+        rank_profiles=[
+            RankProfile(name="bm25", first_phase="bm25(chunk)"),
+            RankProfile(
+                name="dense",
+                inputs=[("query(q_dense)", "tensor<bfloat16>(x[1024])")],
+                first_phase="closeness(field, dense_rep)",
+                match_features=["closeness(field, dense_rep)"],
+            ),
+            RankProfile(
+                name="colbert",
+                inputs=[
+                    ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
+                    ("query(q_len_colbert)", "float"),
+                ],
+                functions=[
+                    Function(
+                        name="max_sim",
+                        expression="sum(reduce(sum(query(q_colbert) * attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                ],
+                first_phase=FirstPhaseRanking(expression="max_sim"),
+                match_features=["max_sim"],
+            ),
+            RankProfile(
+                name="hybrid",
+                inputs=[
+                    ("query(q_dense)", "tensor<bfloat16>(x[1024])"),
+                    ("query(q_colbert)", "tensor<bfloat16>(qt{}, x[1024])"),
+                    ("query(q_len_colbert)", "float"),
+                ],
+                functions=[
+                    Function(
+                        name="max_sim",
+                        expression="sum(reduce(sum(query(q_colbert) * attribute(colbert_rep), x), max, token), qt) / query(q_len_colbert)",
+                    ),
+                ],
+                first_phase=FirstPhaseRanking(
+                    expression="closeness(field, dense_rep) + bm25(chunk)",
+                    rank_score_drop_limit=0.3,
+                ),
+                second_phase=SecondPhaseRanking(expression="max_sim", rerank_count=params.rerank_count),
+                match_features=["closeness(field, dense_rep)", "max_sim", "bm25(chunk)"],
+            ),
+        ],
+    )
+
+
+def build_application_package(params: Optional[SchemaParams] = None) -> ApplicationPackage:
+    """
+    The application package with all schemas, the variants from `params.variants`.
+    """
+    params = params or SchemaParams()
+    unknown = set(params.variants) - set(SCHEMA_VARIANTS)
+    if unknown:
+        raise ValueError(f"Unknown schema variants {sorted(unknown)}, expected any of {SCHEMA_VARIANTS}")
 
+    app_package = ApplicationPackage(name=APPLICATION_NAME)
+    app_package.add_schema(trope_example_schema())
+    app_package.add_schema(trope_example_embedding_schema(params))
+    app_package.add_schema(document_schema())
+    app_package.add_schema(doc_embedding_schema(params))
+    if "binary" in params.variants:
+        app_package.add_schema(binary_doc_embedding_schema(params))
+    if "compact" in params.variants:
+        app_package.add_schema(compact_doc_embedding_schema(params))
+    if "chunks" in params.variants:
+        app_package.add_schema(chunk_embedding_schema(params))
+    return app_package
 
-app_package.add_schema(trope_example_schema)
-app_package.add_schema(trope_example_embedding_schema)
-app_package.add_schema(document_schema)
-app_package.add_schema(doc_embedding_schema)
 
-vespa_docker = VespaDocker()
-app = vespa_docker.deploy(application_package=app_package)
+def write_application_package(root: Path, params: Optional[SchemaParams] = None) -> ApplicationPackage:
+    """
+    Writes the application package (services.xml, schemas/*.sd, ...) to `root` for deployment.
+    """
+    app_package = build_application_package(params)
+    Path(root).mkdir(parents=True, exist_ok=True)
+    app_package.to_files(Path(root))
+    return app_package
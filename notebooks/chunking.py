@@ -1,3 +1,5 @@
+import numpy as np
+import torch
 from nltk import sent_tokenize
 
 def sentence_chunking(input_text: str, tokenizer: callable):
@@ -41,39 +43,94 @@ def sentence_chunking(input_text: str, tokenizer: callable):
     return {'sentences': sentences, 'input_ids': final_chunk, 'spans': spans}
 
 
+def pool_spans(
+    token_embeddings: "torch.Tensor",
+    batch_indices: list[int],
+    starts: list[int],
+    ends: list[int],
+) -> "torch.Tensor":
+    """
+    Mean-pools token embeddings over many (possibly overlapping) spans in one sparse matmul.
+
+    A pooling matrix of shape (n_spans, batch_size * seq_len) holds 1 / span_length for every
+    token covered by a span, so multiplying it with the flattened token embeddings gives all
+    span means of the batch at once.
+
+    Parameters
+    ----------
+    token_embeddings: torch.Tensor
+        Token embeddings of shape (batch_size, seq_len, hidden_dim).
+    batch_indices: list[int]
+        Index of the sequence in the batch each span belongs to.
+    starts: list[int]
+        Span start token indices (inclusive).
+    ends: list[int]
+        Span end token indices (exclusive), each end must be greater than its start.
+
+    Returns
+    -------
+    torch.Tensor
+        Pooled embeddings of shape (n_spans, hidden_dim) in the dtype of token_embeddings.
+    """
+    batch_size, seq_len, hidden_dim = token_embeddings.shape
+    device = token_embeddings.device
+    batch_indices = torch.as_tensor(batch_indices, dtype=torch.long, device=device)
+    starts = torch.as_tensor(starts, dtype=torch.long, device=device)
+    ends = torch.as_tensor(ends, dtype=torch.long, device=device)
+    if starts.numel() == 0:
+        return token_embeddings.new_zeros((0, hidden_dim))
+
+    lengths = ends - starts
+    span_ids = torch.repeat_interleave(torch.arange(len(lengths), device=device), lengths)
+    # position of every covered token inside its span: 0, 1, ..., length - 1
+    span_offsets = torch.cumsum(lengths, dim=0) - lengths
+    token_positions = torch.arange(len(span_ids), device=device) - span_offsets[span_ids]
+    columns = batch_indices[span_ids] * seq_len + starts[span_ids] + token_positions
+    values = (1.0 / lengths.float())[span_ids]
+
+    pooling = torch.sparse_coo_tensor(
+        torch.stack([span_ids, columns]),
+        values,
+        size=(len(lengths), batch_size * seq_len),
+        check_invariants=False,
+    )
+    flat = token_embeddings.reshape(batch_size * seq_len, hidden_dim).float()
+    return torch.sparse.mm(pooling, flat).to(token_embeddings.dtype)
+
+
 def late_chunking(
     model_output: 'BatchEncoding', span_annotation: list, max_length=None
-):
+) -> list[np.ndarray]:
+    """
+    Late chunking: mean-pools the token embeddings of each annotated span.
+    Spans starting at 0 are shifted by one to skip the [CLS] token.
+
+    All spans of the batch are pooled with a single tensor operation and the result is
+    moved to the CPU once, returning one (n_spans, hidden_dim) array per sequence.
+    """
     token_embeddings = model_output[0]
-    outputs = []
-    for embeddings, annotations in zip(token_embeddings, span_annotation):
-        if (
-            max_length is not None
-        ):  # remove annotations which go bejond the max-length of the model
-            annotations = [
-                (start, min(end, max_length - 1))
-                for (start, end) in annotations
-                if start < (max_length - 1)
-            ]
-        pooled_embeddings = []
+    seq_len = token_embeddings.shape[1]
+    limit = seq_len if max_length is None else min(seq_len, max_length - 1)
+
+    batch_indices, starts, ends, counts = [], [], [], []
+    for i, annotations in enumerate(span_annotation):
+        count = 0
         for start, end in annotations:
+            # remove annotations which go beyond the max-length of the model
+            end = min(end, limit)
             if (end - start) >= 1:
                 if start == 0:
                     start += 1
-                    end += 1
-                pooled_embeddings.append(
-                    embeddings[start:end].sum(dim=0) / (end - start)
-                )
-
-
-
-        pooled_embeddings = [
-            embedding.detach().cpu().numpy() for embedding in pooled_embeddings
-        ]
-      
-        outputs.append(pooled_embeddings)
+                    end = min(end + 1, seq_len)
+                batch_indices.append(i)
+                starts.append(start)
+                ends.append(end)
+                count += 1
+        counts.append(count)
 
-    return outputs
+    pooled_embeddings = pool_spans(token_embeddings, batch_indices, starts, ends)
+    pooled_embeddings = pooled_embeddings.detach().cpu().numpy()
+    return np.split(pooled_embeddings, np.cumsum(counts)[:-1])
 
 
 def split_doc_to_chunks(tokens: list[int], spans: list[(int, int)], max_length: int, overlap: int = 0):
@@ -6,6 +6,8 @@ the CSV outputs produced by clustering.py.
 
 import pandas as pd
 from pathlib import Path
+from app.clustering.report import cluster_report
+from app.crud.documents import read_chunk_texts
 
 
 ###############################################
@@ -18,9 +20,8 @@ def print_cluster_text_chunks(
     books_folder=Path("data/books"),
 ):
     """
-    Loads combined_embeddings_with_clusters.csv and for each row belonging to the specified cluster,
-    loads the corresponding text file from `books_folder` and extracts the chunk text using the
-    'start_index' and 'end_index' values. It then prints up to `num_chunks` text chunks.
+    Loads combined_embeddings_with_clusters.csv and prints the text of up to `num_chunks` chunks
+    belonging to the specified cluster, sliced from the book text files in `books_folder`.
     """
     if not metadata_file.exists():
         print(f"Metadata file {metadata_file} not found.")
@@ -30,30 +31,15 @@ def print_cluster_text_chunks(
     if cluster_df.empty:
         print(f"No chunks found for cluster {cluster_label}.")
         return
-    printed = 0
-    for idx, row in cluster_df.iterrows():
-        book_id = row["book_id"]
-        start_index = int(row["start_index"])
-        end_index = int(row["end_index"])
-        text_file = books_folder / f"{book_id}.txt"
-        if not text_file.exists():
-            print(f"Text file {text_file} not found. Skipping this row.")
+    cluster_df = cluster_df.head(num_chunks)
+    for (idx, row), chunk_text in zip(cluster_df.iterrows(), read_chunk_texts(cluster_df, books_folder)):
+        if chunk_text is None:
             continue
-        try:
-            with open(text_file, "r", encoding="utf-8") as f:
-                full_text = f.read()
-        except Exception as e:
-            print(f"Error reading {text_file}: {e}")
-            continue
-        chunk_text = full_text[start_index:end_index]
         print(
-            f"--- Chunk from {book_id} (chunk_index={row['chunk_index']}) label={row['trope']} ---"
+            f"--- Chunk from {row['book_id']} (chunk_index={row['chunk_index']}) label={row['trope']} ---"
         )
         print(chunk_text)
         print("\n")
-        printed += 1
-        if printed >= num_chunks:
-            break
 
 
 ###############################################
@@ -67,37 +53,29 @@ def compute_cluster_soft_labels(
     the frequency of 'trope' labels, along with the number of books per cluster and the number of
     chunks per book for each cluster.
 
-    Returns a dictionary where each key is a cluster label and the value is a dictionary with:
-        - 'soft_labels': a dictionary mapping trope names to their relative frequency (as proportions),
-        - 'num_books': the total number of unique books in the cluster,
-        - 'chunks_per_book': a dictionary mapping each book_id to its number of chunks in the cluster.
+    Returns a ClusterReport (see app.clustering.report) with:
+        - 'clusters': per cluster number of chunks and books, top trope, purity and entropy,
+        - 'trope_distribution': the soft labels as (cluster, trope, count, share) rows,
+        - 'chunks_per_book': (cluster, book_id, num_chunks) rows.
+    The report is empty if the metadata file does not exist.
     """
     if not metadata_file.exists():
         print(f"Metadata file {metadata_file} not found.")
-        return {}
-
-    df = pd.read_csv(metadata_file)
-    cluster_info = {}
-
-    # Group by cluster and compute the required information
-    for cluster, group in df.groupby("cluster"):
-        # Compute soft labels for trope frequencies
-        trope_counts = group["trope"].value_counts()
-        soft_labels = (trope_counts / trope_counts.sum()).to_dict()
-
-        # Compute number of unique books in the cluster
-        num_books = group["book_id"].nunique()
-
-        # Compute number of chunks per book in the cluster
-        chunks_per_book = group["book_id"].value_counts().to_dict()
-
-        cluster_info[cluster] = {
-            "soft_labels": soft_labels,
-            "num_books": num_books,
-            "chunks_per_book": chunks_per_book,
-        }
+        df = pd.DataFrame(
+            {
+                "cluster": pd.Series(dtype="int64"),
+                "book_id": pd.Series(dtype="category"),
+                "trope": pd.Series(dtype="category"),
+            }
+        )
+        return cluster_report(df)
 
-    return cluster_info
+    df = pd.read_csv(
+        metadata_file,
+        usecols=["cluster", "book_id", "trope"],
+        dtype={"book_id": "category", "trope": "category"},
+    )
+    return cluster_report(df)
 
 
 ###############################################
@@ -112,8 +90,8 @@ def save_random_chunks_for_each_cluster(
 ):
     """
     Loads combined_embeddings_with_clusters.csv and for each cluster, randomly samples up to `num_chunks` rows.
-    For each sampled row, loads the corresponding text chunk from the book text file (using start_index and end_index),
-    and saves these chunks to a file named "cluster_<cluster>.txt" in the output_folder.
+    The texts of all sampled chunks are read in one pass over the book text files,
+    and saved to a file named "cluster_<cluster>.txt" in the output_folder per cluster.
     """
     if not metadata_file.exists():
         print(f"Metadata file {metadata_file} not found.")
@@ -123,32 +101,19 @@ def save_random_chunks_for_each_cluster(
     # Create the output folder if it doesn't exist.
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    # Group by cluster and process each group.
-    for cluster, group in df.groupby("cluster"):
-        if cluster not in cluster_labels:
-            continue
-        # Sample up to num_chunks random rows from the group.
-        sampled = group.sample(n=min(num_chunks, len(group)), random_state=42)
+    # Sample up to num_chunks random rows from each requested cluster.
+    df = df[df["cluster"].isin(cluster_labels)]
+    sampled = df.sample(frac=1, random_state=42).groupby("cluster").head(num_chunks)
+    # Each book is opened once for the chunks of all clusters.
+    sampled["text"] = read_chunk_texts(sampled, books_folder)
+
+    for cluster, group in sampled.groupby("cluster"):
         chunks_list = []
-        for idx, row in sampled.iterrows():
-
-            book_id = row["book_id"]
-            start_index = int(row["start_index"])
-            end_index = int(row["end_index"])
-            text_file = books_folder / f"{book_id}.txt"
-            if not text_file.exists():
-                print(f"Text file {text_file} not found for book {book_id}. Skipping.")
-                continue
-            try:
-                with open(text_file, "r", encoding="utf-8") as f:
-                    full_text = f.read()
-            except Exception as e:
-                print(f"Error reading {text_file}: {e}")
+        for idx, row in group.iterrows():
+            if pd.isna(row["text"]):
                 continue
-            # Extract the chunk from the full text.
-            chunk_text = full_text[start_index:end_index]
-            header = f"--- Chunk from {book_id} (chunk_index={row['chunk_index']}) label={row.get('trope', 'Unknown')} ---\n"
-            chunks_list.append(header + chunk_text + "\n\n")
+            header = f"--- Chunk from {row['book_id']} (chunk_index={row['chunk_index']}) label={row.get('trope', 'Unknown')} ---\n"
+            chunks_list.append(header + row["text"] + "\n\n")
         # If any chunks were found, save them to a text file for this cluster.
         if chunks_list:
             output_file = output_folder / f"cluster_{cluster}.txt"
@@ -187,17 +152,19 @@ def count_tokens_per_book(
 ###############################################
 if __name__ == "__main__":
     # Example usage: Uncomment to test functions individually.
-    cluster_stats = compute_cluster_soft_labels()
-    interesting_clusters = []
-    for cluster, stats in cluster_stats.items():
-        if max(list(stats["soft_labels"].values())) < 0.7:
-            interesting_clusters.append(cluster)
-            print(f"Cluster {cluster}:")
-            print(f"  Number of books: {stats['num_books']}")
-            print(f"  Chunks per book: {stats['chunks_per_book']}")
-            for trope, score in stats["soft_labels"].items():
-                print(f"  {trope}: {score:.2f}")
-
+    report = compute_cluster_soft_labels()
+    if report.clusters.empty:
+        raise SystemExit("No clusters to postprocess.")
+    interesting = report.clusters[report.clusters["purity"] < 0.7]
+    chunks_per_book = report.chunks_per_book.groupby("cluster")
+    for cluster, stats in interesting.iterrows():
+        print(f"Cluster {cluster}:")
+        print(f"  Number of books: {stats['num_books']}")
+        print(f"  Chunks per book: {dict(chunks_per_book.get_group(cluster)[['book_id', 'num_chunks']].values)}")
+        for trope, score in report.soft_labels(cluster).items():
+            print(f"  {trope}: {score:.2f}")
+
+    interesting_clusters = interesting.index.tolist()
     print(interesting_clusters)
 
     # save_random_chunks_for_each_cluster(num_chunks=20)
@@ -1,11 +1,11 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import umap
 from scipy.cluster.hierarchy import dendrogram, linkage
 import pandas as pd
 from pathlib import Path
 from matplotlib.patches import Circle
-import hdbscan
+from app.clustering.pipeline import ClusteringParams, cluster_store
+from app.crud.embeddings import EmbeddingStore
 
 ###############################################
 # Data Loading & Merging Functions
@@ -13,28 +13,13 @@ import hdbscan
 
 def load_embeddings_and_metadata(embeddings_dir=Path("data/books/embeddings")):
     """
-    Loads all *_embeddings.npy files and corresponding metadata CSVs from embeddings_dir.
-    Returns the stacked embeddings and concatenated metadata.
+    Opens the sharded embedding store in embeddings_dir.
+    Returns the memory-mapped embeddings (rows are read on access) and the chunk metadata.
     """
-    embedding_files = sorted(embeddings_dir.glob("*_embeddings.npy"))
-    metadata_files = {f.stem.split("_")[0]: f for f in embeddings_dir.glob("*_metadata.csv")}
-    
-    all_embeddings = []
-    metadata_list = []
-    for emb_file in embedding_files:
-        # Extract book_id from filename (assumes format "<bookid>_embeddings.npy")
-        book_id = emb_file.stem.split("_")[0]
-        emb = np.load(emb_file)
-        all_embeddings.append(emb)
-        meta_file = metadata_files.get(book_id)
-        if meta_file is not None:
-            meta_df = pd.read_csv(meta_file)
-            # Add book_id column.
-            meta_df["book_id"] = book_id
-            metadata_list.append(meta_df)
-    
-    embeddings = np.vstack(all_embeddings)
-    metadata = pd.concat(metadata_list, ignore_index=True)
+    store = EmbeddingStore.open(embeddings_dir)
+    embeddings = store.embeddings
+    metadata = store.metadata()
+    metadata["book_id"] = metadata["book_id"].astype(str)
     print(f"Loaded embeddings with shape: {embeddings.shape}")
     return embeddings, metadata
 
@@ -54,37 +39,26 @@ def merge_genre_data(metadata):
     return merged_metadata
 
 ###############################################
-# UMAP & Clustering Functions
+# Clustering Functions
 ###############################################
 
-def run_umap(embeddings, n_neighbors=15, n_components=5):
+def run_clustering(store, merged_metadata, params=None, run_name="latest"):
     """
-    Runs UMAP dimensionality reduction on the embeddings.
+    Runs the out-of-core clustering pipeline on the store: UMAP and HDBSCAN are fitted
+    on a sample stratified by book and the remaining chunks are assigned shard by shard.
+    The kNN graph of the sample is cached, reruns with other parameters reuse it.
+    Updates merged_metadata with cluster labels, and saves the result.
     """
-    umap_vis = umap.UMAP(n_neighbors=n_neighbors, n_components=n_components, metric='euclidean')
-    embeddings_umap = umap_vis.fit_transform(embeddings)
-    print(f"UMAP (visualization) reduced shape: {embeddings_umap.shape}")
-    return embeddings_umap
-
+    run = cluster_store(
+        store, params or ClusteringParams(), store.dir / "clusters" / run_name, knn_cache_dir=store.dir / "knn"
+    )
+    print(f"Found {run.n_clusters} clusters using HDBSCAN")
 
-def run_clustering(embeddings_umap, merged_metadata, embeddings_dir=Path("data/books/embeddings")):
-    """
-    Runs clustering (using HDBSCAN) on the UMAP projection,
-    updates merged_metadata with cluster labels, and saves the result.
-    """
-    # Use HDBSCAN to produce cluster labels without computing the full pairwise distance matrix.
-    clusterer = hdbscan.HDBSCAN(min_cluster_size=50, metric='euclidean')
-    cluster_labels = clusterer.fit_predict(embeddings_umap)
-    # Exclude noise (-1) when counting clusters.
-    n_clusters = len(set(cluster_labels)) - (1 if -1 in cluster_labels else 0)
-
-    print(f"Found {n_clusters} clusters using HDBSCAN")
-    
-    merged_metadata['cluster'] = cluster_labels
-    combined_meta_file = embeddings_dir / "combined_embeddings_with_clusters.csv"
+    merged_metadata['cluster'] = np.asarray(run.labels)
+    combined_meta_file = store.dir / "combined_embeddings_with_clusters.csv"
     merged_metadata.to_csv(combined_meta_file, index=False)
     print(f"Saved clustering results to {combined_meta_file}")
-    return merged_metadata
+    return run, merged_metadata
 
 ###############################################
 # Visualization Functions
@@ -178,10 +152,12 @@ def plot_dendrogram(embeddings_umap, subsample_size=2000):
 # Main
 ###############################################
 if __name__ == "__main__":
-    embeddings, metadata = load_embeddings_and_metadata()
+    store = EmbeddingStore.open(Path("data/books/embeddings"))
+    metadata = store.metadata()
+    metadata["book_id"] = metadata["book_id"].astype(str)
     merged_metadata = merge_genre_data(metadata)
-    embeddings_umap = run_umap(embeddings)
-    merged_metadata = run_clustering(embeddings_umap, merged_metadata)
-    plot_umap(embeddings_umap, merged_metadata)
-    plot_dendrogram(embeddings_umap)
-
+    run, merged_metadata = run_clustering(store, merged_metadata)
+    # plot the fitted sample only, the full corpus is too large to draw
+    sample_umap = np.asarray(run.reduced[run.sample_rows])
+    plot_umap(sample_umap, merged_metadata.iloc[run.sample_rows].reset_index(drop=True))
+    plot_dendrogram(sample_umap)
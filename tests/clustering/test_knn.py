@@ -0,0 +1,23 @@
+from app.clustering.knn import cached_knn_graph, graph_dir
+import numpy as np
+
+
+def test_cached_knn_graph_roundtrip(tmp_path):
+    data = np.random.default_rng(0).normal(size=(200, 8)).astype(np.float32)
+    rows = np.arange(0, 400, 2)
+    graph = cached_knn_graph(tmp_path, data, rows, n_neighbors=10)
+
+    indices, distances = graph.neighbors(5)
+    assert indices.shape == distances.shape == (200, 5)
+    assert np.array_equal(indices[:, 0], np.arange(200))
+    assert np.all(np.diff(distances, axis=1) >= 0)
+    # NN-descent is approximate, but on small data it should be close to exact
+    exact = np.argsort(((data[:, None] - data[None]) ** 2).sum(-1), axis=1)[:, :5]
+    recall = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(indices, exact)])
+    assert recall > 0.9
+
+
+    cached = cached_knn_graph(tmp_path, None, rows, n_neighbors=10)
+    assert (graph_dir(tmp_path, rows, 10, "euclidean") / "graph.json").exists()
+    assert np.array_equal(cached.indices, graph.indices)
+    assert cached.index is not None
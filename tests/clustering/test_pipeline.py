@@ -0,0 +1,49 @@
+from app.clustering.pipeline import ClusteringParams, cluster_store, load_assignments, stratified_sample
+from app.crud.embeddings import EmbeddingStore
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Three books, each drawn around its own center."""
+    store = EmbeddingStore.open(tmp_path / "embeddings", dim=8, shard_size=64, dtype="float32")
+    rng = np.random.default_rng(0)
+    for i, n in enumerate([90, 60, 10]):
+        center = np.zeros(8)
+        center[i] = 10
+        store.append(f"lit{i}", center + rng.normal(size=(n, 8)), {"chunk_index": np.arange(n)})
+    return store
+
+
+def test_stratified_sample_covers_every_book(store):
+    rows = stratified_sample(store, 20)
+    assert len(rows) == 20
+    assert np.all(np.diff(rows) > 0)
+    ranges = [store.book_range(book_id) for book_id in store.book_ids()]
+    counts = [np.sum((rows >= start) & (rows < end)) for start, end in ranges]
+    # proportional quotas 11.25, 7.5 and 1.25, rounded down and topped up to the sample size
+    assert counts[0] >= 11 and counts[1] >= 7 and counts[2] >= 1
+
+
+def test_stratified_sample_keeps_small_books(store):
+    rows = stratified_sample(store, 3)
+    assert [store.metadata()["book_id"][row] for row in rows] == ["lit0", "lit1", "lit2"]
+
+
+def test_cluster_store_assigns_every_row(store, tmp_path):
+    params = ClusteringParams(
+        sample_size=80, n_neighbors=10, n_components=2, min_cluster_size=5, batch_size=16
+    )
+    run = cluster_store(store, params, tmp_path / "run", knn_cache_dir=tmp_path / "knn")
+
+    assert run.labels.shape == (len(store),)
+    assert run.reduced.shape == (len(store), 2)
+    assert len(list(run.dir.glob("*.cluster.npy"))) == store.num_shards
+    labels = np.asarray(run.labels)
+    # chunks of the two large books end up in different clusters
+    first, second = labels[:90], labels[90:150]
+    assert np.bincount(first[first >= 0]).argmax() != np.bincount(second[second >= 0]).argmax()
+
+    labels_again, _ = load_assignments(store, run.dir)
+    assert np.array_equal(np.asarray(labels_again), labels)
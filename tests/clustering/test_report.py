@@ -0,0 +1,30 @@
+from app.clustering.report import cluster_report
+import numpy as np
+import pandas as pd
+
+
+def test_cluster_report_matches_per_group_counts():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "cluster": rng.integers(-1, 20, 2000),
+            "book_id": [f"lit{i}" for i in rng.integers(0, 50, 2000)],
+            "trope": rng.choice(["Romance", "Horror", "Fantasy"], 2000, p=[0.6, 0.3, 0.1]),
+        }
+    )
+    report = cluster_report(df)
+
+    assert report.clusters.index.tolist() == sorted(df["cluster"].unique())
+    for cluster, group in df.groupby("cluster"):
+        counts = group["trope"].value_counts()
+        shares = counts / counts.sum()
+        stats = report.clusters.loc[cluster]
+        assert stats["num_chunks"] == len(group)
+        assert stats["num_books"] == group["book_id"].nunique()
+        assert stats["top_trope"] == counts.idxmax()
+        assert np.isclose(stats["purity"], shares.max())
+        assert np.isclose(stats["entropy"], -(shares * np.log(shares)).sum())
+        assert report.soft_labels(cluster).to_dict() == shares.to_dict()
+
+        books = report.chunks_per_book[report.chunks_per_book["cluster"] == cluster]
+        assert dict(books[["book_id", "num_chunks"]].values) == group["book_id"].value_counts().to_dict()
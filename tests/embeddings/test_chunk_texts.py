@@ -0,0 +1,45 @@
+import re
+
+from app.crud.documents import read_chunk_texts
+from app.utils.document_processing import chunk_text_with_overlap
+import nltk
+import pandas as pd
+import pytest
+
+
+class SentenceSplitter:
+    def span_tokenize(self, text):
+        for match in re.finditer(r"[^.!?]+[.!?]", text):
+            yield match.start(), match.end()
+
+
+class WordTokenizer:
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    monkeypatch.setattr(nltk.data, "load", lambda _: SentenceSplitter())
+    text = " ".join(f"Señor Ñoño {i} wrote — «naïve» café prose №{i}." for i in range(40))
+    (tmp_path / "lit1.txt").write_bytes(text.encode("utf-8"))
+    chunks, metadata = chunk_text_with_overlap(text, WordTokenizer(), max_tokens=30, overlap_tokens=8)
+    return chunks, pd.DataFrame(metadata).assign(book_id="lit1")
+
+
+def test_byte_offsets_match_character_offsets(book, tmp_path):
+    chunks, metadata = book
+    data = (tmp_path / "lit1.txt").read_bytes()
+    for chunk, row in zip(chunks, metadata.itertuples()):
+        assert data[row.start_byte : row.end_byte].decode("utf-8") == chunk
+
+
+def test_read_chunk_texts(book, tmp_path):
+    chunks, metadata = book
+    rows = pd.concat([metadata.iloc[::-1], metadata.head(1).assign(book_id="lit2")])
+    texts = read_chunk_texts(rows, tmp_path)
+    assert texts == chunks[::-1] + [None]
+
+    # stores written before byte offsets fall back to character offsets
+    legacy = metadata.assign(start_byte=0, end_byte=0)
+    assert read_chunk_texts(legacy, tmp_path) == chunks
@@ -0,0 +1,98 @@
+import numpy as np
+
+from app.create_embeddings import (
+    COLBERT_COLUMNS,
+    PendingBook,
+    PreparedBook,
+    encode_batch,
+    token_budget_batches,
+    write_book,
+)
+from app.crud.embeddings import EmbeddingStore
+from app.retriever import LocalRetriever
+
+
+def test_token_budget_batches_respects_budget():
+    items = [(i, n) for i, n in enumerate([10, 50, 20, 50, 10, 40])]
+    batches = list(token_budget_batches(items, token_budget=100))
+
+    assert sorted(i for batch in batches for i in batch) == list(range(6))
+    lengths = dict(items)
+    for batch in batches:
+        assert len(batch) * max(lengths[i] for i in batch) <= 100
+
+
+def test_token_budget_batches_groups_similar_lengths():
+    items = [("a", 10), ("b", 500), ("c", 10), ("d", 500)]
+    assert list(token_budget_batches(items, token_budget=1000)) == [["a", "c"], ["b", "d"]]
+
+
+def test_token_budget_batches_oversized_item():
+    items = [("a", 10), ("b", 300)]
+    assert list(token_budget_batches(items, token_budget=100, pool_size=1)) == [["a"], ["b"]]
+
+
+class StubModel:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.max_lengths = []
+
+    def encode(self, texts, batch_size, max_length, return_dense, return_colbert_vecs=False):
+        self.max_lengths.append(max_length)
+        if self.fail_on in texts:
+            raise RuntimeError("CUDA out of memory")
+        output = {"dense_vecs": [np.full(2, len(text), dtype=np.float32) for text in texts]}
+        if return_colbert_vecs:
+            # one token vector per character, along the first axis for "x", the second for "y"
+            output["colbert_vecs"] = [
+                np.array([[1.0, 0.0] if c == "x" else [0.0, 1.0] for c in text], dtype=np.float32) for text in texts
+            ]
+        return output
+
+
+def _pending(book_id, chunks, num_tokens, colbert=False):
+    book = PreparedBook(
+        book_id=book_id,
+        chunks=chunks,
+        metadata=[{"chunk_index": i, "num_tokens": n} for i, n in enumerate(num_tokens)],
+    )
+    return PendingBook(
+        book=book,
+        vectors=[None] * len(chunks),
+        remaining=len(chunks),
+        colbert=[None] * len(chunks) if colbert else None,
+    )
+
+
+def test_encode_batch_keeps_long_chunks_and_isolates_failures():
+    pending = {"a": _pending("a", ["x", "yy"], [10, 600]), "b": _pending("b", ["bad", "z"], [5, 9000])}
+    model = StubModel(fail_on="bad")
+
+    assert encode_batch(model, pending, [("a", 0), ("a", 1)]) == ["a"]
+    assert model.max_lengths == [602]
+    assert [v[0] for v in pending["a"].vectors] == [1, 2]
+
+    assert encode_batch(model, pending, [("b", 0)]) == []
+    assert "b" not in pending
+    # the later chunks of a dropped book are ignored
+    assert encode_batch(model, pending, [("b", 1)]) == []
+    assert model.max_lengths == [602, 7]
+
+    pending["c"] = _pending("c", ["w"], [9000])
+    assert encode_batch(model, pending, [("c", 0)]) == ["c"]
+    assert model.max_lengths[-1] == 8192
+
+
+def test_token_vectors_are_written_for_the_colbert_rerank(tmp_path):
+    store = EmbeddingStore.open(tmp_path / "dense", dim=2, shard_size=4, dtype="float32")
+    tokens = EmbeddingStore.open(tmp_path / "colbert", dim=2, shard_size=4, dtype="float32", columns=COLBERT_COLUMNS)
+    pending = {"a": _pending("a", ["xx", "yyy"], [2, 3], colbert=True)}
+
+    assert encode_batch(StubModel(), pending, [("a", 0), ("a", 1)], colbert=True) == ["a"]
+    write_book(store, pending.pop("a"), colbert_store=tokens)
+    assert len(store) == 2 and len(tokens) == 5
+    assert tokens.column("chunk_index")[0:5].tolist() == [0, 0, 1, 1, 1]
+
+    retriever = LocalRetriever(store, rank_profile="colbert", colbert_store=tokens)
+    rows, _ = retriever.rerank_colbert([np.array([[0.0, 1.0]])], [np.array([0, 1])], top_k=2)
+    assert rows[0].tolist() == [1, 0]
@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from app.feeder import bgem3_embed_documents_with_chunks, bgem3_late_chunk_embed_documents
+from app.models.documents import Document
+
+
+class Batch(dict):
+    def to(self, device):
+        return self
+
+
+class WordTokenizer:
+    """Every word "w<n>" is the token n + 10, 1 and 2 are [CLS] and [SEP]."""
+
+    cls_token_id, sep_token_id = 1, 2
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=True):
+        input_ids, offsets = [], []
+        for text in texts:
+            ids, spans, position = [], [], 0
+            for word in text.split(" "):
+                ids.append(int(word[1:]) + 10)
+                spans.append((position, position + len(word)))
+                position += len(word) + 1
+            input_ids.append(ids)
+            offsets.append(spans)
+        return {"input_ids": input_ids, "offset_mapping": offsets}
+
+    def pad(self, features, padding=True, return_tensors="pt"):
+        input_ids = features["input_ids"]
+        length = max(len(ids) for ids in input_ids)
+        return Batch(
+            input_ids=torch.tensor([ids + [0] * (length - len(ids)) for ids in input_ids]),
+            attention_mask=torch.tensor([[1] * len(ids) + [0] * (length - len(ids)) for ids in input_ids]),
+        )
+
+
+class Encoder(torch.nn.Module):
+    """Token states that do not depend on the context, so late and separate chunking agree."""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.embeddings = torch.nn.Embedding(64, 4)
+        self.colbert_linear = torch.nn.Linear(4, 4)
+        self.model = lambda input_ids, attention_mask, return_dict: SimpleNamespace(
+            last_hidden_state=self.embeddings(input_ids)
+        )
+
+
+class StubModel:
+    def __init__(self):
+        self.tokenizer = WordTokenizer()
+        self.model = Encoder()
+
+    def encode(self, sentences, return_dense=True, return_colbert_vecs=False, return_sparse=False):
+        """BGE-M3's encode of every sentence on its own."""
+        output = {"dense_vecs": [], "colbert_vecs": []}
+        with torch.no_grad():
+            for ids in self.tokenizer(sentences)["input_ids"]:
+                states = self.model.embeddings(torch.tensor(ids))
+                dense = states.mean(dim=0).numpy()
+                output["dense_vecs"].append(dense / np.linalg.norm(dense))
+                colbert = torch.nn.functional.normalize(self.model.colbert_linear(states), dim=-1)
+                output["colbert_vecs"].append(colbert.numpy())
+        return output
+
+
+def _document(document_id, num_words, size, overlap):
+    words = [f"w{i}" for i in range(num_words)]
+    chunks = [" ".join(words[i : i + size]) for i in range(0, num_words - overlap, size - overlap)]
+    return Document(
+        document_id=document_id, parent_id=None, title=None, authors=None, chunks=chunks, max_chunk_size=size
+    )
+
+
+@pytest.mark.parametrize("overlap", [0, 2])
+def test_late_chunking_matches_separate_chunks(overlap):
+    model = StubModel()
+    data = [_document("lit1_0", 12, 5, overlap), _document("lit2_0", 7, 5, overlap)]
+
+    expected = bgem3_embed_documents_with_chunks(model, data, return_colbert=True)
+    # windows of at most 10 tokens, every document spans more than one
+    late = bgem3_late_chunk_embed_documents(
+        model, data, return_colbert=True, max_length=12, overlap=overlap, batch_size=2
+    )
+
+    assert [(e.document_id, e.document_chunk_index) for e in late] == [
+        (e.document_id, e.document_chunk_index) for e in expected
+    ]
+    for late_embedding, embedding in zip(late, expected):
+        assert late_embedding.version == "dense+colbert"
+        assert late_embedding.dense.shape == embedding.dense.shape
+        assert np.allclose(late_embedding.dense, embedding.dense, atol=1e-5)
+        assert late_embedding.colbert.shape == embedding.colbert.shape
+        assert np.allclose(late_embedding.colbert, embedding.colbert, atol=1e-5)
+
+
+def test_late_chunking_flags():
+    model = StubModel()
+    data = [_document("lit1_0", 12, 5, 2)]
+    dense_only = bgem3_late_chunk_embed_documents(model, data, max_length=12, overlap=2)
+    assert all(e.colbert is None and e.dense.shape == (4,) for e in dense_only)
+    with pytest.raises(ValueError):
+        bgem3_late_chunk_embed_documents(model, data, return_lexical=True)
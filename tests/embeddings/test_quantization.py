@@ -0,0 +1,39 @@
+import numpy as np
+
+from app.crud.embeddings import EmbeddingStore
+from app.crud.vespa import prepare_partial_update_compact_doc_embeddings
+from app.models.embeddings import Embedding
+from app.quantization import DenseQuantizer, calibrate
+
+
+def test_quantize_keeps_the_ranking(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 64)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    store = EmbeddingStore.open(tmp_path / "embeddings", dim=64, shard_size=128, dtype="float32")
+    store.append("lit1", vectors, {"chunk_index": np.arange(500)})
+
+    quantizer = calibrate(store, sample_size=200, dims=48)
+    codes = quantizer.quantize(vectors)
+    assert codes.shape == (500, 48) and codes.dtype == np.int8
+    # values beyond the calibrated percentile are clipped
+    inside = np.abs(vectors[:, :48]) <= 127 * quantizer.scale
+    assert inside.mean() > 0.99
+    assert np.abs(quantizer.dequantize(codes) - vectors[:, :48])[inside].max() <= quantizer.scale / 2 + 1e-6
+
+    query = vectors[0] + 0.1 * rng.normal(size=64)
+    exact = np.argsort(-vectors[:, :48] @ query[:48])[:10]
+    approx = np.argsort(-codes.astype(np.float32) @ quantizer.quantize(query).astype(np.float32))[:10]
+    assert len(set(exact) & set(approx)) >= 8
+
+    quantizer.save(tmp_path / "quantizer.json")
+    assert DenseQuantizer.load(tmp_path / "quantizer.json") == quantizer
+
+
+def test_compact_update_has_int8_codes():
+    quantizer = DenseQuantizer(dims=2, scale=0.01)
+    embedding = Embedding(model="bge-m3", document_id="lit1", document_chunk_index=4, dense=np.array([0.5, -2.0, 0.3]))
+    update = prepare_partial_update_compact_doc_embeddings([embedding], quantizer)[0]
+    block = update["fields"]["dense_rep_int8"]["add"]["blocks"][0]
+    assert block == {"address": {"chunk": 4}, "values": [50, -127]}
+    assert "colbert_rep" not in update["fields"]
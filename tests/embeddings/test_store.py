@@ -0,0 +1,106 @@
+from app.crud.embeddings import EmbeddingStore, import_book_files
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EmbeddingStore.open(tmp_path / "embeddings", dim=4, shard_size=5)
+
+
+def book_rows(n, offset=0):
+    embeddings = np.arange(offset, offset + n * 4, dtype=np.float32).reshape(n, 4)
+    metadata = {
+        "chunk_index": np.arange(n),
+        "start_index": np.arange(n) * 10,
+        "end_index": np.arange(n) * 10 + 12,
+    }
+    return embeddings, metadata
+
+
+def test_append_spans_shards(store):
+    first = book_rows(3)
+    second = book_rows(4, offset=100)
+    assert store.append("lit0", *first) == (0, 3)
+    assert store.append("lit1", *second) == (3, 7)
+
+    assert len(store) == 7
+    assert store.num_shards == 2
+    assert "lit1" in store and "lit2" not in store
+    assert store.book_ids() == ["lit0", "lit1"]
+
+    embeddings, metadata = store.get_book("lit1")
+    assert np.array_equal(embeddings, second[0].astype(np.float16))
+    assert np.array_equal(metadata["start_index"], second[1]["start_index"])
+
+
+def test_views_do_not_copy_within_shard(store):
+    store.append("lit0", *book_rows(3))
+    view = store.embeddings[1:3]
+    assert isinstance(view, np.memmap)
+    assert view.shape == (2, 4)
+
+
+def test_reopen_and_index(store, tmp_path):
+    store.append("lit0", *book_rows(6))
+    reopened = EmbeddingStore.open(tmp_path / "embeddings")
+    assert reopened.shard_size == 5
+    assert reopened.book_range("lit0") == (0, 6)
+
+    embeddings = reopened.embeddings
+    assert embeddings.shape == (6, 4)
+    assert np.array_equal(embeddings[5], np.arange(20, 24))
+    assert np.array_equal(embeddings[[5, 0]], embeddings[np.array([5, 0])])
+    assert np.array_equal(np.asarray(embeddings), book_rows(6)[0])
+    assert [start for start, _ in embeddings.blocks(block_size=2)] == [0, 2, 4, 5]
+
+
+def test_metadata_frame(store):
+    store.append("lit0", *book_rows(2))
+    store.append("lit1", *book_rows(1))
+    df = store.metadata()
+    assert list(df.columns) == [
+        "book_id", "chunk_index", "start_index", "end_index", "start_byte", "end_byte"
+    ]
+    assert df["book_id"].tolist() == ["lit0", "lit0", "lit1"]
+    assert df["end_index"].tolist() == [12, 22, 12]
+
+
+def test_append_rejects_duplicates_and_bad_shapes(store):
+    store.append("lit0", *book_rows(1))
+    with pytest.raises(ValueError):
+        store.append("lit0", *book_rows(1))
+    with pytest.raises(ValueError):
+        store.append("lit1", np.zeros((2, 3)))
+
+
+def test_import_book_files(store, tmp_path):
+    files_dir = tmp_path / "legacy"
+    files_dir.mkdir()
+    embeddings, metadata = book_rows(2)
+    np.save(files_dir / "lit7_embeddings.npy", embeddings)
+    pd.DataFrame(metadata).assign(book_id="lit7").to_csv(files_dir / "lit7_metadata.csv", index=False)
+
+    assert import_book_files(store, files_dir) == 1
+    assert import_book_files(store, files_dir) == 0
+    assert store.book_range("lit7") == (0, 2)
+
+
+def test_appends_are_journaled_until_close(store, tmp_path):
+    manifest = (tmp_path / "embeddings" / "manifest.json").read_bytes()
+    store.append("lit0", *book_rows(2))
+    store.append("lit1", *book_rows(3))
+    assert (tmp_path / "embeddings" / "manifest.json").read_bytes() == manifest
+    with open(store.journal_path, "ab") as f:
+        f.write(b'{"book_id": "lit2", "st')  # torn by a crash
+
+    reopened = EmbeddingStore.open(tmp_path / "embeddings")
+    assert reopened.book_ids() == ["lit0", "lit1"]
+    assert len(reopened) == 5
+    assert not reopened.journal_path.exists()
+
+    with reopened:
+        reopened.append("lit2", *book_rows(1))
+    assert not reopened.journal_path.exists()
+    assert EmbeddingStore.open(tmp_path / "embeddings").book_range("lit2") == (5, 6)
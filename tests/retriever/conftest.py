@@ -0,0 +1,111 @@
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from adalflow.core.types import Embedding, EmbedderOutput
+
+from app.retriever import VespaRetriever
+from vespa.io import VespaQueryResponse
+
+
+class FakeClient:
+    """The httpr.Client of `Vespa.get_sync_session`, a request slower than `timeout` fails."""
+
+    def __init__(self, timeout: float = 120):
+        self.timeout = timeout
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeVespaSync:
+    """The `VespaSync` session `FakeVespa.syncio` yields."""
+
+    def __init__(self, app: "FakeVespa", client: FakeClient):
+        self.app = app
+        self.client = client
+
+    def query(self, body=None, groupname=None, streaming=False, profile=False, keep_request_body=False, **kwargs):
+        self.app.requests.append((body, kwargs))
+        latency = self.app.latency.get(body.get("ranking"), 0.0)
+        if latency > self.client.timeout:
+            time.sleep(self.client.timeout)
+            raise TimeoutError(f"timed out after {self.client.timeout} s waiting for the response headers")
+        time.sleep(latency)
+        answer = self.app.respond(body, kwargs)
+        json = answer if isinstance(answer, dict) else {"root": {"children": answer}}
+        return VespaQueryResponse(json=json, status_code=200, url="http://fake")
+
+
+class FakeVespa:
+    """
+    `vespa.application.Vespa` with the signatures of pyvespa's syncio, get_sync_session
+    and feed_iterable (see test_fake_vespa_has_the_pyvespa_signatures).
+
+    Queries are recorded in `requests` as (body, params) and answered by
+    `respond(body, params)`, a list of hits or the whole response JSON. `latency` delays
+    the queries of a rank profile, past the client timeout they fail like an HTTP read timeout.
+    Feeds are recorded in `feeds`.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.feeds = []
+        self.latency = {}
+        self.respond = lambda body, params: []
+
+    @contextmanager
+    def syncio(self, connections=8, compress="auto", session=None, num_retries_429=10):
+        yield FakeVespaSync(self, session if session is not None else FakeClient())
+
+    def get_sync_session(self, connections=8, compress="auto"):
+        return FakeClient()
+
+    def feed_iterable(
+        self,
+        iter,
+        schema=None,
+        namespace=None,
+        callback=None,
+        operation_type="feed",
+        max_queue_size=1000,
+        max_workers=8,
+        max_connections=16,
+        compress="auto",
+        num_retries_429=10,
+        **kwargs,
+    ):
+        self.feeds.append(SimpleNamespace(schema=schema, docs=list(iter), operation_type=operation_type, kwargs=kwargs))
+
+
+class FakeEmbedder:
+    """Constant query vectors, counts its calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, input, embedding_type="dense", **kwargs):
+        self.calls += 1
+        vector = [0.1] * 4 if embedding_type == "dense" else [[0.1] * 4] * 2
+        return EmbedderOutput(data=[Embedding(vector, i) for i in range(len(input))])
+
+
+@pytest.fixture
+def vespa() -> FakeVespa:
+    return FakeVespa()
+
+
+@pytest.fixture
+def make_retriever(vespa):
+    """VespaRetriever on the fake Vespa with a FakeEmbedder unless another is given."""
+
+    def make(**kwargs) -> VespaRetriever:
+        retriever = VespaRetriever(**{"embedder": FakeEmbedder(), **kwargs})
+        retriever.app = vespa
+        # adalflow Documents need the tokenizer files, the hits are enough here
+        retriever._format_docs = lambda hits: [SimpleNamespace(meta_data=dict(hit["fields"])) for hit in hits]
+        return retriever
+
+    return make
@@ -0,0 +1,72 @@
+from adalflow.core.types import Document, RetrieverOutput
+from app.benchmark import build_queries, evaluate_ranking, run_benchmark, save_report
+from app.crud.tvtropes import TropeExamplesCRUD, TropesCRUD
+import orjson
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def queries():
+    tropes = TropesCRUD(
+        df=pd.DataFrame(
+            {
+                "TropeID": ["t1", "t2", "t3"],
+                "Trope": ["BrilliantButLazy", "ChosenOne", "Unused"],
+                "Description": ["a lazy genius", "a chosen hero", "nobody"],
+            }
+        ),
+        name="tropes",
+        config=None,
+    )
+    examples = TropeExamplesCRUD(
+        df=pd.DataFrame(
+            {
+                "trope_id": ["t1", "t1", "t2", "t2", "t3"],
+                "title_id": ["lit1", "lit2", "lit2", "lit3", "lit9"],
+            }
+        ),
+        name="lit_goodreads_match",
+        config=None,
+    )
+    return build_queries(tropes, examples, title_ids={"lit1", "lit2", "lit3"})
+
+
+class StubRetriever:
+    """Returns chunks of fixed books for every query."""
+
+    def __init__(self, books):
+        self.books = books
+
+    def call(self, input, top_k=None, embedding_type=None, **kwargs):
+        documents = [Document(text="", meta_data={"parent_id": book}) for book in self.books]
+        return [RetrieverOutput(doc_indices=list(range(len(documents))), documents=documents, query=input)]
+
+
+def test_build_queries(queries):
+    assert [(q.query_id, q.text, q.relevant) for q in queries] == [
+        ("t1", "a lazy genius", {"lit1", "lit2"}),
+        ("t2", "a chosen hero", {"lit2", "lit3"}),
+    ]
+
+
+def test_evaluate_ranking():
+    metrics = evaluate_ranking(["lit5", "lit2", "lit1"], {"lit1", "lit2"}, ks=[1, 2, 3])
+    assert metrics == {"recall@1": 0.0, "recall@2": 0.5, "recall@3": 1.0, "mrr": 0.5}
+
+
+def test_run_benchmark_report(queries, tmp_path):
+    retrievers = {"bm25": StubRetriever(["lit2", "lit2", "lit3"]), "dense": StubRetriever(["lit7"])}
+    report = run_benchmark(retrievers.__getitem__, queries, ["bm25", "dense"], top_k=10, ks=[1, 2], warmup=1)
+
+    bm25 = report["profiles"]["bm25"]
+    # chunks of the same book count once: the ranking is [lit2, lit3]
+    assert bm25["recall@1"] == pytest.approx(0.5)
+    assert bm25["recall@2"] == pytest.approx(0.75)
+    assert bm25["mrr"] == pytest.approx(1.0)
+    assert bm25["errors"] == 0 and bm25["qps"] > 0
+    assert bm25["latency_ms"]["p50"] <= bm25["latency_ms"]["p99"]
+    assert report["profiles"]["dense"]["mrr"] == 0.0
+
+    save_report(report, tmp_path / "bench" / "run.json")
+    assert orjson.loads((tmp_path / "bench" / "run.json").read_bytes())["num_queries"] == 2
@@ -0,0 +1,26 @@
+import numpy as np
+
+from app.crud.vespa import binarize, prepare_partial_update_doc_embeddings
+from app.models.embeddings import Embedding
+
+
+def test_binarize_packs_sign_bits():
+    vectors = np.random.default_rng(0).normal(size=(5, 1024)).astype(np.float32)
+    packed = binarize(vectors)
+    assert packed.shape == (5, 128) and packed.dtype == np.int8
+    assert np.array_equal(np.unpackbits(packed.view(np.uint8), axis=-1), (vectors > 0).astype(np.uint8))
+
+
+def test_binary_feed_and_query(make_retriever, vespa):
+    colbert = np.random.default_rng(1).normal(size=(3, 1024))
+    embedding = Embedding(model="bge-m3", document_id="lit1", document_chunk_index=2, dense=np.ones(4), colbert=colbert)
+    update = prepare_partial_update_doc_embeddings([embedding], binary_colbert=True)[0]
+    blocks = update["fields"]["colbert_rep"]["add"]["blocks"]
+    assert [block["address"] for block in blocks] == [{"chunk": 2, "token": i} for i in range(3)]
+    assert blocks[1]["values"] == binarize(colbert)[1].tolist()
+
+    retriever = make_retriever(schema="document_embeddings_binary", rank_profile="colbert", binary_colbert=True)
+    retriever._query_colbert("a lazy genius", colbert, query_len=3.0, top_k=5)
+    body, _ = vespa.requests[0]
+    assert len(body["input.query(q_colbert)"]["blocks"][0]["values"]) == 1024
+    assert body["input.query(q_colbert_binary)"]["blocks"][2]["values"] == binarize(colbert)[2].tolist()
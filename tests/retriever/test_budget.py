@@ -0,0 +1,45 @@
+import inspect
+import time
+
+from vespa.application import Vespa, VespaSync
+
+
+def _retriever(make_retriever, vespa, **kwargs):
+    # hybrid queries take 0.5s, they time out on a client with a shorter timeout
+    vespa.latency = {"hybrid": 0.5}
+    vespa.respond = lambda body, params: [{"id": f"{body['ranking']}-1", "relevance": 1.0, "fields": {}}]
+    return make_retriever(schema="document_embeddings", rank_profile="hybrid", **kwargs)
+
+
+def test_hybrid_falls_back_to_dense_within_the_budget(make_retriever, vespa):
+    retriever = _retriever(make_retriever, vespa, budget=0.3)
+    started = time.perf_counter()
+    output = retriever.call("a lazy genius", top_k=3)[0]
+    assert time.perf_counter() - started < 0.3
+    assert output.served_profile == "dense"
+    assert output.doc_indices == ["dense-1"]
+    assert 0 < output.budget_left < 0.3 * 0.3
+
+    (hybrid, hybrid_params), (dense, _) = vespa.requests
+    assert (hybrid["ranking"], dense["ranking"]) == ("hybrid", "dense")
+    hybrid_timeout = hybrid_params["timeout"]
+    assert hybrid_timeout.endswith("ms") and int(hybrid_timeout[:-2]) <= 210
+
+
+def test_without_a_budget_the_profile_is_kept(make_retriever, vespa):
+    retriever = _retriever(make_retriever, vespa)
+    output = retriever.call("a lazy genius", top_k=3)[0]
+    assert output.served_profile == "hybrid"
+    assert output.budget_left is None
+    assert [(body["ranking"], params.get("timeout")) for body, params in vespa.requests] == [("hybrid", None)]
+
+
+def test_fake_vespa_has_the_pyvespa_signatures(vespa):
+    def parameters(function):
+        return list(inspect.signature(function).parameters)
+
+    assert parameters(vespa.syncio) == parameters(Vespa.syncio)[1:]
+    assert parameters(vespa.get_sync_session) == parameters(Vespa.get_sync_session)[1:]
+    assert parameters(vespa.feed_iterable) == parameters(Vespa.feed_iterable)[1:]
+    with vespa.syncio() as session:
+        assert parameters(session.query) == parameters(VespaSync.query)[1:]
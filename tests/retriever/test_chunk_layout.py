@@ -0,0 +1,54 @@
+import numpy as np
+
+from app.crud.vespa import VespaChunkDocumentsCRUD, documents_crud, prepare_partial_update_chunk_embeddings
+from app.models.documents import Document
+from app.models.embeddings import Embedding
+from app.retriever import VespaRetriever, best_chunks, matched_chunks
+
+
+def test_feed_sections_then_chunks(vespa):
+    crud = documents_crud("chunk", app=vespa, namespace="narana", content_cluster_name="narana_content")
+    assert isinstance(crud, VespaChunkDocumentsCRUD)
+    doc = Document(document_id="lit1_3", parent_id="lit1", title="A", authors=["B"], chunks=["one", "two"], max_chunk_size=256)
+    crud.feed([doc])
+
+    parents, chunks = vespa.feeds
+    assert parents.schema == "documents" and [d["id"] for d in parents.docs] == ["lit1_3"]
+    assert chunks.schema == "chunk_embeddings"
+    assert [d["id"] for d in chunks.docs] == ["lit1_3_0", "lit1_3_1"]
+    assert chunks.docs[1]["fields"] == {
+        "document_ref": "id:narana:documents::lit1_3",
+        "document_id": "lit1_3",
+        "chunk_index": 1,
+        "chunk": "two",
+    }
+
+
+def test_chunk_embedding_update_assigns_one_chunk():
+    embedding = Embedding(
+        model="bge-m3", document_id="lit1_3", document_chunk_index=1, dense=np.ones(4), colbert=np.zeros((2, 4))
+    )
+    update = prepare_partial_update_chunk_embeddings([embedding])[0]
+    assert update["id"] == "lit1_3_1"
+    assert update["fields"]["dense_rep"] == {"assign": [1.0] * 4}
+    assert [block["address"] for block in update["fields"]["colbert_rep"]["assign"]["blocks"]] == [{"token": 0}, {"token": 1}]
+
+
+def test_chunk_embedding_update_is_not_assigned_twice(vespa):
+    crud = documents_crud("chunk", app=vespa, namespace="narana", content_cluster_name="narana_content")
+    embedding = Embedding(
+        model="bge-m3", document_id="lit1_3", document_chunk_index=0, dense=np.ones(4), colbert=np.zeros((1, 4))
+    )
+    crud.update_embeddings([embedding])
+    update, = vespa.feeds
+    assert update.schema == "chunk_embeddings" and update.docs[0]["id"] == "lit1_3_0"
+    assert update.operation_type == "update"
+    assert update.kwargs["auto_assign"] is False
+
+
+def test_retriever_chunk_layout():
+    assert VespaRetriever(layout="chunk").schema == "chunk_embeddings"
+    assert VespaRetriever(schema="documents", layout="chunk").schema == "documents"
+    hit = {"fields": {"document_id": "lit1_3", "chunk_index": 4, "chunk": "text"}}
+    assert best_chunks(hit) == [(4, "text")]
+    assert matched_chunks(hit) == [4]
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from app.retriever import fuse_rankings
+
+
+def _hits(*ids_and_scores):
+    return [{"id": doc_id, "relevance": score, "fields": {}} for doc_id, score in ids_and_scores]
+
+
+def test_reciprocal_rank_fusion():
+    rankings = {
+        "bm25": _hits(("a", 12.0), ("b", 9.0), ("c", 1.0)),
+        "dense": _hits(("b", 0.9), ("d", 0.8), ("a", 0.1)),
+    }
+    fused = fuse_rankings(rankings, method="rrf", rrf_k=60)
+    assert [hit["id"] for hit, _, _ in fused] == ["b", "a", "d", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+    assert fused[0][2] == {"bm25": 2, "dense": 1}
+
+    weighted = fuse_rankings(rankings, method="rrf", weights={"bm25": 3.0})
+    assert weighted[0][0]["id"] == "a"
+
+
+def test_weighted_score_fusion():
+    rankings = {
+        "bm25": _hits(("a", 12.0), ("b", 2.0)),
+        "dense": _hits(("b", 0.9), ("a", 0.5), ("c", 0.4)),
+    }
+    fused = {hit["id"]: score for hit, score, _ in fuse_rankings(rankings, method="weighted")}
+    assert fused["a"] == pytest.approx(1.0 + 0.2)
+    assert fused["b"] == pytest.approx(0.0 + 1.0)
+    assert fused["c"] == pytest.approx(0.0)
+
+
+def test_fusion_leaves_out_legs_over_the_budget(make_retriever, vespa):
+    # every rank profile answers with its own hits, colbert after a delay
+    responses = {
+        "bm25": _hits(("a", 12.0), ("b", 9.0)),
+        "dense": _hits(("b", 0.9), ("c", 0.8)),
+        "colbert": _hits(("c", 30.0)),
+    }
+    vespa.respond = lambda body, params: responses[body["ranking"]]
+    vespa.latency = {"colbert": 0.5}
+    retriever = make_retriever(schema="document_embeddings", rank_profile="fusion", fusion_timeout=0.2)
+    started = time.perf_counter()
+    output = retriever.call("a lazy genius", top_k=3)[0]
+    assert time.perf_counter() - started < 0.45
+    assert output.doc_indices == ["b", "a", "c"]
+    assert output.documents[0].meta_data["fusion_ranks"] == {"bm25": 2, "dense": 1}
+    retriever.close()
+    assert retriever._executor is None
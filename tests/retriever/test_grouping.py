@@ -0,0 +1,105 @@
+from app.retriever import _book_groups, best_chunks, matched_chunks
+
+GROUPED_RESPONSE = {
+    "root": {
+        "id": "toplevel",
+        "children": [
+            {
+                "id": "group:root:0",
+                "children": [
+                    {
+                        "id": "grouplist:parent_id",
+                        "label": "parent_id",
+                        "children": [
+                            {
+                                "id": "group:string:lit7",
+                                "value": "lit7",
+                                "relevance": 0.9,
+                                "children": [
+                                    {
+                                        "id": "hitlist:hits",
+                                        "label": "hits",
+                                        "children": [
+                                            {
+                                                "id": "index:narana_content/0/1",
+                                                "relevance": 0.9,
+                                                "fields": {
+                                                    "parent_id": "lit7",
+                                                    "matchfeatures": {
+                                                        "per_chunk_dense": {
+                                                            "type": "tensor(chunk{})",
+                                                            "cells": {"0": 0.2, "3": 0.9, "5": 0.5},
+                                                        }
+                                                    },
+                                                },
+                                            }
+                                        ],
+                                    }
+                                ],
+                            }
+                        ],
+                    }
+                ],
+            }
+        ],
+    }
+}
+
+
+def test_grouped_dense_query(make_retriever, vespa):
+    vespa.respond = lambda body, params: GROUPED_RESPONSE
+    retriever = make_retriever(schema="document_embeddings", group_by_book=True, sections_per_book=2, summary="best")
+    retriever._query_dense("a lazy genius", [0.0] * 4, top_k=5)
+
+    body, params = vespa.requests[0]
+    assert params["hits"] == 0
+    assert body["presentation.summary"] == "best"
+    assert "{targetHits: 10}" in body["yql"]
+    assert body["yql"].endswith(
+        "| all(group(parent_id) max(5) order(-max(relevance())) each(max(2) each(output(summary(best)))))"
+    )
+
+
+def test_parse_groups_and_matched_chunks():
+    groups = _book_groups(GROUPED_RESPONSE)
+    assert [group["value"] for group in groups] == ["lit7"]
+    hit = groups[0]["children"][0]["children"][0]
+    assert matched_chunks(hit) == [3, 5, 0]
+
+    long_form = {"fields": {"matchfeatures": {"per_chunk_max_sim": {"cells": [
+        {"address": {"chunk": "1"}, "value": 0.1},
+        {"address": {"chunk": "2"}, "value": 0.7},
+    ]}}}}
+    assert matched_chunks(long_form) == [2, 1]
+    assert matched_chunks({"fields": {}}) == []
+
+
+def test_summary_per_call(make_retriever, vespa):
+    retriever = make_retriever(schema="documents", rank_profile="bm25", summary="best")
+    retriever._query_text("a lazy genius", top_k=3, summary="text")
+    retriever._query_text("a lazy genius", top_k=3)
+    assert [body.get("presentation.summary") for body, _ in vespa.requests] == ["text", "matched"]
+
+
+def test_default_summary_is_left_to_vespa(make_retriever, vespa):
+    # the trope example schemas behind "*" have no "best" or "matched" summary
+    make_retriever(rank_profile="bm25")._query_text("a lazy genius", top_k=3)
+    body, _ = vespa.requests[0]
+    assert "presentation.summary" not in body
+
+
+def test_best_chunks_follow_the_summary_feature():
+    # the "best" summary returns the selected chunks 2, 4 and 7 in document order
+    hit = {"fields": {
+        "chunks": ["second", "fourth", "seventh"],
+        "summaryfeatures": {"best_chunks": {"type": "tensor(chunk{})", "cells": {"7": 0.9, "2": 0.4, "4": 0.6}}},
+    }}
+    assert best_chunks(hit) == [(7, "seventh"), (4, "fourth"), (2, "second")]
+
+    all_chunks = {"fields": {
+        "chunks": ["a", "b", "c"],
+        "matchfeatures": {"per_chunk_dense": {"cells": {"0": 0.1, "1": 0.3, "2": 0.2}}},
+    }}
+    assert best_chunks(all_chunks) == [(1, "b"), (2, "c"), (0, "a")]
+    assert best_chunks({"fields": {"chunks": ["matched"]}}) == [(None, "matched")]
+    assert best_chunks({"fields": {}}) == []
@@ -0,0 +1,76 @@
+from adalflow.core.types import Embedding, EmbedderOutput
+from app.crud.embeddings import EmbeddingStore
+from app.retriever import LocalRetriever, build_hnsw_index, exact_top_k
+import numpy as np
+import pytest
+
+
+def normalize(x):
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+class FakeEmbedder:
+    """Looks the query vectors up by query text."""
+
+    def __init__(self, dense, colbert=None):
+        self.vectors = {"dense": dense, "colbert": colbert}
+
+    def __call__(self, input, embedding_type="dense", **kwargs):
+        return EmbedderOutput(
+            data=[Embedding(self.vectors[embedding_type][q], i) for i, q in enumerate(input)]
+        )
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EmbeddingStore.open(tmp_path / "dense", dim=16, shard_size=32, dtype="float32")
+    rng = np.random.default_rng(0)
+    for book in range(5):
+        store.append(f"lit{book}", normalize(rng.normal(size=(20, 16))), {"chunk_index": np.arange(20)})
+    return store
+
+
+def test_exact_top_k_matches_brute_force(store):
+    queries = normalize(np.random.default_rng(1).normal(size=(4, 16)))
+    rows, scores = exact_top_k(store.embeddings, queries, top_k=7, block_size=10)
+    expected = np.argsort(-(queries @ np.asarray(store.embeddings).T), axis=1)[:, :7]
+    assert np.array_equal(rows, expected)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+
+def test_dense_retriever_output(store):
+    query = np.asarray(store.embeddings[42])
+    retriever = LocalRetriever(store, embedder=FakeEmbedder({"q": query}), top_k=3)
+    output = retriever.call("q")[0]
+    assert output.doc_indices[0] == 42
+    assert output.documents[0].id == "lit2_2"
+    assert output.documents[0].meta_data["book_id"] == "lit2"
+    assert np.isclose(output.doc_scores[0], 1.0)
+
+
+def test_hnsw_index(store, tmp_path):
+    build_hnsw_index(store, tmp_path / "dense.hnsw")
+    queries = np.asarray(store.embeddings[[5, 77]])
+    retriever = LocalRetriever(store, hnsw_index_path=tmp_path / "dense.hnsw")
+    rows, scores = retriever.search(queries, top_k=5)
+    assert rows[:, 0].tolist() == [5, 77]
+    assert np.allclose(scores[:, 0], 1.0, atol=1e-5)
+
+
+def test_colbert_rerank(store, tmp_path):
+    tokens = EmbeddingStore.open(tmp_path / "colbert", dim=16, shard_size=64, dtype="float32")
+    rng = np.random.default_rng(2)
+    for book_id in store.book_ids():
+        chunk_index = np.repeat(np.arange(20), 3)
+        tokens.append(book_id, normalize(rng.normal(size=(60, 16))), {"chunk_index": chunk_index})
+    # the query tokens match the tokens of chunk 7 of lit3 (row 67) exactly
+    start, _ = tokens.book_range("lit3")
+    query_tokens = np.asarray(tokens.embeddings[start + 21 : start + 24])
+
+    embedder = FakeEmbedder({"q": np.ones(16) / 4}, {"q": query_tokens})
+    retriever = LocalRetriever(
+        store, embedder=embedder, rank_profile="colbert", colbert_store=tokens, rerank_depth=100
+    )
+    output = retriever.call(["q"], top_k=2)[0]
+    assert output.doc_indices[0] == 67
+    assert np.isclose(output.doc_scores[0], 1.0)
@@ -0,0 +1,22 @@
+import pytest
+
+from app.retriever import VespaRetriever
+
+
+def test_pages_window_one_ranking(make_retriever, vespa):
+    # ranks 25 documents, answering the requested window of them
+    ranked = [{"id": f"doc{i}", "relevance": 100.0 - i, "fields": {}} for i in range(25)]
+    vespa.respond = lambda body, params: ranked[params.get("offset", 0):params.get("offset", 0) + params["hits"]]
+    retriever = make_retriever(schema="document_embeddings", rank_profile="dense")
+
+    pages = list(retriever.pages("a lazy genius", page_size=10, depth=40))
+    assert [len(page.doc_indices) for page in pages] == [10, 10, 5]
+    assert [doc_id for page in pages for doc_id in page.doc_indices] == [f"doc{i}" for i in range(25)]
+    assert retriever.embedder.calls == 1
+    assert all("targetHits: 40" in body["yql"] for body, _ in vespa.requests)
+    assert [params.get("offset") for _, params in vespa.requests] == [None, 10, 20]
+
+
+def test_pages_need_a_single_ranking():
+    with pytest.raises(ValueError):
+        next(VespaRetriever(rank_profile="bm25", group_by_book=True).pages("query"))
@@ -0,0 +1,25 @@
+from app.crud.vespa import BaseVespaCRUD
+from app.utils.cache import QueryCache
+
+
+def test_identical_queries_hit_the_cache(make_retriever, vespa):
+    vespa.respond = lambda body, params: [{"id": "id:narana:documents::lit1_0", "relevance": 1.0, "fields": {}}]
+    retriever = make_retriever(rank_profile="bm25", schema="documents", cache=QueryCache())
+
+    first = retriever._query_text("brilliant  but lazy ", top_k=3)
+    second = retriever._query_text(" brilliant but\nlazy", top_k=3)
+    assert len(vespa.requests) == 1
+    assert second is not first and second.json == first.json
+
+    # changes of a served response do not leak into the cache
+    second.hits[0]["fields"]["fusion_ranks"] = {"bm25": 1}
+    third = retriever._query_text("brilliant but lazy", top_k=3)
+    assert third.hits[0]["fields"] == {}
+
+    retriever._query_text("brilliant but lazy", top_k=5)
+    assert len(vespa.requests) == 2
+
+    # a feed through any CRUD invalidates the cached results
+    BaseVespaCRUD(app=vespa, namespace="narana", content_cluster_name="c", schema_name="documents").feed_iterable([])
+    retriever._query_text("brilliant but lazy", top_k=3)
+    assert len(vespa.requests) == 3
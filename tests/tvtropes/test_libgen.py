@@ -0,0 +1,81 @@
+import hashlib
+import time
+
+import anyio
+import httpx
+import tenacity
+
+from app.config import ScraperConfig
+from app.libgen import DownloadEngine
+from app.utils.http import ScraperRuntime
+from app.utils.manifest import Manifest
+
+BOOK = b"PK\x03\x04" + b"epub" * 1024
+MD5 = hashlib.md5(BOOK).hexdigest()
+
+
+async def handler(request: httpx.Request) -> httpx.Response:
+    host, path = request.url.host, request.url.path
+    if host == "down.example":
+        return httpx.Response(503)
+    if path.startswith("/page/"):
+        return httpx.Response(200, html=f'<a href="https://{host}/get/{MD5}">GET</a>')
+    if host == "slow.example":
+        await anyio.sleep(5)
+    return httpx.Response(200, content=BOOK)
+
+
+def test_engine_races_mirrors_and_persists_states(tmp_path):
+    manifest_path = tmp_path / "downloads.json"
+    hits = [{"download_urls": ["https://slow.example/page/1", "https://fast.example/page/1"]}]
+    config = ScraperConfig(http2=False, rate=0)
+
+    async def main():
+        async with ScraperRuntime(config, transport=httpx.MockTransport(handler)) as runtime:
+            engine = DownloadEngine(runtime, Manifest.load(manifest_path), tmp_path, race=2)
+            states = [
+                await engine.process("lit1", hits=hits),
+                await engine.process("lit2", hits=[{"download_urls": []}]),
+                await engine.process("lit1", hits=hits),
+            ]
+            engine.commit()
+            return states
+
+    started = time.perf_counter()
+    assert anyio.run(main) == ["downloaded", "failed", "downloaded"]
+    assert time.perf_counter() - started < 2
+    assert (tmp_path / "lit1.epub").read_bytes() == BOOK
+    assert not list(tmp_path.glob("*.part"))
+
+    records = Manifest.load(manifest_path).records
+    assert records["lit1"]["state"] == "downloaded"
+    assert records["lit1"]["links"][1] == ["https://fast.example/page/1", f"https://fast.example/get/{MD5}"]
+    assert records["lit2"] == {"pages": [], "state": "failed", "reason": "no hits"}
+
+
+def test_a_failing_mirror_page_does_not_fail_the_title(tmp_path, monkeypatch):
+    # the mirror page is retried without waiting
+    monkeypatch.setattr("app.utils.http.wait_exponential_jitter", lambda **kwargs: tenacity.wait_none())
+    config = ScraperConfig(http2=False, rate=0)
+    down = []
+
+    async def counting(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "down.example":
+            down.append(request.url.path)
+        return await handler(request)
+
+    async def main():
+        async with ScraperRuntime(config, transport=httpx.MockTransport(counting)) as runtime:
+            engine = DownloadEngine(runtime, Manifest.load(tmp_path / "downloads.json"), tmp_path)
+            return [
+                await engine.process(
+                    "lit1", hits=[{"download_urls": ["https://down.example/page/1", "https://fast.example/page/1"]}]
+                ),
+                await engine.process("lit2", hits=[{"download_urls": ["https://down.example/page/2"]}]),
+            ]
+
+    assert anyio.run(main) == ["downloaded", "failed"]
+    assert down == ["/page/1"] * 3 + ["/page/2"] * 3
+    records = Manifest.load(tmp_path / "downloads.json").records
+    assert records["lit1"]["links"] == [["https://fast.example/page/1", f"https://fast.example/get/{MD5}"]]
+    assert records["lit2"]["reason"] == "no valid download"
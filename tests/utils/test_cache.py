@@ -0,0 +1,37 @@
+from app.utils.cache import QueryCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_generation():
+    clock = Clock()
+    cache = QueryCache(ttl=10, clock=clock)
+    cache.put("a", 1, size=1, generation=3)
+    assert cache.get("a", generation=3) == 1
+    assert cache.get("a", generation=4) is None
+    assert len(cache) == 0
+
+    cache.put("b", 2, size=1)
+    clock.now = 10
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = QueryCache(max_entries=2, max_bytes=10)
+    cache.put("a", 1, size=4)
+    cache.put("b", 2, size=4)
+    cache.get("a")
+    cache.put("c", 3, size=4)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    cache.put("d", 4, size=8)
+    assert len(cache) == 1 and cache.num_bytes == 8
+    cache.put("e", 5, size=11)
+    assert cache.get("e") is None
@@ -0,0 +1,73 @@
+from utils.chunking import late_chunking, pack_chunks_to_windows, pool_spans
+import numpy as np
+import pytest
+import torch
+
+
+@pytest.fixture
+def token_embeddings():
+    torch.manual_seed(0)
+    return torch.randn(2, 16, 8)
+
+
+def naive_late_chunking(token_embeddings, span_annotation, max_length=None):
+    outputs = []
+    for embeddings, annotations in zip(token_embeddings, span_annotation):
+        if max_length is not None:
+            annotations = [
+                (start, min(end, max_length - 1))
+                for (start, end) in annotations
+                if start < (max_length - 1)
+            ]
+        outputs.append([
+            embeddings[start:end].sum(dim=0).numpy() / (end - start)
+            for start, end in annotations
+            if (end - start) >= 1
+        ])
+    return outputs
+
+
+def test_pool_spans_overlapping(token_embeddings):
+    pooled = pool_spans(token_embeddings, [0, 0, 1], [0, 2, 5], [4, 6, 6])
+    assert pooled.shape == (3, 8)
+    assert torch.allclose(pooled[0], token_embeddings[0, 0:4].mean(dim=0), atol=1e-6)
+    assert torch.allclose(pooled[1], token_embeddings[0, 2:6].mean(dim=0), atol=1e-6)
+    assert torch.allclose(pooled[2], token_embeddings[1, 5], atol=1e-6)
+
+
+def test_pool_spans_empty(token_embeddings):
+    assert pool_spans(token_embeddings, [], [], []).shape == (0, 8)
+
+
+def test_late_chunking_matches_naive(token_embeddings):
+    spans = [[(0, 3), (3, 10), (10, 10), (12, 20)], [(1, 2), (2, 15)]]
+    outputs = late_chunking((token_embeddings,), spans, max_length=14)
+    expected = naive_late_chunking(token_embeddings, spans, max_length=14)
+
+    assert len(outputs) == 2
+    for out, exp in zip(outputs, expected):
+        assert isinstance(out, np.ndarray)
+        assert out.shape == (len(exp), 8)
+        assert np.allclose(out, np.stack(exp), atol=1e-6)
+
+
+def test_late_chunking_keeps_dtype(token_embeddings):
+    outputs = late_chunking((token_embeddings.half(),), [[(0, 4)], [(4, 8)]])
+    assert outputs[0].dtype == np.float16
+    assert outputs[1].shape == (1, 8)
+
+
+def test_pack_chunks_to_windows_shares_overlap():
+    windows = pack_chunks_to_windows([[1, 2, 3], [3, 4, 5], [5, 6]], [0, 1, 1], max_length=5)
+    assert windows == [
+        {'input_ids': [1, 2, 3, 4, 5], 'spans': [(0, 3), (2, 5)], 'chunk_indices': [0, 1]},
+        {'input_ids': [5, 6], 'spans': [(0, 2)], 'chunk_indices': [2]},
+    ]
+
+
+def test_pack_chunks_to_windows_truncates_long_chunks():
+    windows = pack_chunks_to_windows([[1, 2, 3, 4, 5, 6], [7]], [0, 0], max_length=4)
+    assert windows == [
+        {'input_ids': [1, 2, 3, 4], 'spans': [(0, 4)], 'chunk_indices': [0]},
+        {'input_ids': [7], 'spans': [(0, 1)], 'chunk_indices': [1]},
+    ]
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+from functools import partial
+
+import anyio
+import httpx
+import pytest
+
+from app.config import ScraperConfig
+from app.utils.http import RateLimiter, ScraperRuntime, download_file, retry_fetch
+
+
+def test_rate_limiter_paces_after_the_burst(monkeypatch):
+    now = [0.0]
+    limiter = RateLimiter(rate=10.0, burst=2, clock=lambda: now[0])
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    async def main():
+        for _ in range(4):
+            await limiter.acquire()
+
+    monkeypatch.setattr(anyio, "sleep", fake_sleep)
+    anyio.run(main)
+    assert slept == [0.1, 0.1]
+
+
+def test_runtime_shares_one_client_under_the_concurrency_limit():
+    in_flight, peak, clients = 0, 0, set()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await anyio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, text=request.url.params["q"])
+
+    config = ScraperConfig(http2=False, concurrency=3, rate=0, workers=8, queue_size=2)
+    seen = []
+
+    async def main():
+        async with ScraperRuntime(config, transport=httpx.MockTransport(handler)) as runtime:
+
+            async def worker(item: int):
+                if item == 5:
+                    raise ValueError("a failing item does not stop the others")
+                clients.add(id(runtime.client))
+                response = await retry_fetch(runtime, "https://example.org/", params={"q": item})
+                seen.append(int(response.text))
+
+            await runtime.run(range(20), worker)
+
+    anyio.run(main)
+    assert sorted(seen) == [i for i in range(20) if i != 5]
+    assert peak == 3
+    assert len(clients) == 1
+
+
+BOOK = b"PK\x03\x04" + bytes(range(256)) * 64
+
+
+def _serve_book(requests):
+    """Serves BOOK with Range support, the first full response breaks off halfway."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.headers.get("Range"))
+        if request.headers.get("Range"):
+            start = int(request.headers["Range"][len("bytes="):-1])
+            return httpx.Response(
+                206,
+                content=BOOK[start:],
+                headers={"Content-Range": f"bytes {start}-{len(BOOK) - 1}/{len(BOOK)}"},
+            )
+
+        async def broken():
+            yield BOOK[: len(BOOK) // 2]
+            raise httpx.ReadError("connection reset")
+
+        return httpx.Response(200, content=broken(), headers={"Content-Length": str(len(BOOK))})
+
+    return handler
+
+
+def test_download_resumes_and_validates(tmp_path):
+    requests = []
+    config = ScraperConfig(http2=False, rate=0)
+    path = tmp_path / "lit1.epub"
+
+    async def main(**kwargs):
+        async with ScraperRuntime(config, transport=httpx.MockTransport(_serve_book(requests))) as runtime:
+            return await download_file(runtime, "https://example.org/book", path, **kwargs)
+
+    threads = []
+
+    def validate(part):
+        threads.append(threading.current_thread())
+        return part.read_bytes()[:2] == b"PK"
+
+    anyio.run(partial(main, md5=hashlib.md5(BOOK).hexdigest(), validate=validate))
+    assert path.read_bytes() == BOOK
+    # the checks run off the event loop
+    assert threads and threads[0] is not threading.main_thread()
+    assert requests == [None, f"bytes={len(BOOK) // 2}-"]
+    assert [p.name for p in tmp_path.iterdir()] == ["lit1.epub"]
+
+    path.unlink()
+    with pytest.raises(ValueError):
+        anyio.run(partial(main, md5="0" * 32))
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,44 @@
+from app.utils.manifest import Manifest, atomic_write_bytes
+
+
+def test_atomic_write_bytes_replaces_file(tmp_path):
+    path = tmp_path / "out.txt"
+    atomic_write_bytes(path, b"first")
+    atomic_write_bytes(path, b"second")
+    assert path.read_bytes() == b"second"
+    assert [p.name for p in tmp_path.iterdir()] == ["out.txt"]
+
+
+def test_manifest_roundtrip(tmp_path):
+    path = tmp_path / "jobs" / "manifest.json"
+    manifest = Manifest.load(path)
+    assert len(manifest) == 0
+
+    manifest.record("lit0", reason="no text")
+    manifest.record("lit1", commit=False, reason="no chunks")
+
+    reloaded = Manifest.load(path)
+    assert "lit0" in reloaded
+    assert "lit1" not in reloaded
+    assert reloaded.get("lit0") == {"reason": "no text"}
+
+    reloaded.discard("lit0")
+    assert "lit0" not in Manifest.load(path)
+
+
+def test_manifest_journals_records_and_compacts_on_load(tmp_path):
+    path = tmp_path / "manifest.json"
+    manifest = Manifest.load(path)
+    for i in range(3):
+        manifest.record(f"lit{i}", reason="no text")
+    manifest.discard("lit1")
+
+    # records only append to the journal, the snapshot is written on load
+    assert not path.exists()
+    assert len(manifest.journal_path.read_bytes().splitlines()) == 4
+    with open(manifest.journal_path, "ab") as f:
+        f.write(b'{"key": "lit3", "fie')  # torn by a crash
+
+    reloaded = Manifest.load(path)
+    assert sorted(reloaded.records) == ["lit0", "lit2"]
+    assert path.exists() and not reloaded.journal_path.exists()
@@ -0,0 +1,50 @@
+import pytest
+
+from app.vespa import SchemaParams, build_application_package, write_application_package
+
+
+def _schema(app_package, name):
+    return next(schema for schema in app_package.schemas if schema.name == name)
+
+
+def test_default_package_has_all_schemas():
+    names = [schema.name for schema in build_application_package().schemas]
+    for name in [
+        "trope_examples",
+        "documents",
+        "document_embeddings",
+        "document_embeddings_binary",
+        "document_embeddings_compact",
+        "chunk_embeddings",
+    ]:
+        assert name in names
+
+
+def test_knobs_are_rendered():
+    params = SchemaParams(
+        hnsw_max_links_per_node=32,
+        hnsw_neighbors_to_explore_at_insert=400,
+        paged_colbert=True,
+        rerank_count=50,
+        variants=("compact",),
+    )
+    app_package = build_application_package(params)
+    assert "document_embeddings_binary" not in [schema.name for schema in app_package.schemas]
+
+    text = _schema(app_package, "document_embeddings").schema_to_text
+    assert "max-links-per-node: 32" in text
+    assert "neighbors-to-explore-at-insert: 400" in text
+    assert "rerank-count: 50" in text
+    colbert_field = text[text.index("field colbert_rep"):text.index("field document_id")]
+    assert "paged" in colbert_field and "hnsw" not in colbert_field
+
+
+def test_unknown_variant():
+    with pytest.raises(ValueError):
+        build_application_package(SchemaParams(variants=("sparse",)))
+
+
+def test_write_application_package(tmp_path):
+    write_application_package(tmp_path / "application")
+    assert (tmp_path / "application" / "services.xml").exists()
+    assert (tmp_path / "application" / "schemas" / "document_embeddings.sd").exists()